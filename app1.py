@@ -1,8 +1,28 @@
+import os
+import uuid
+from datetime import datetime
+
 from cassandra.cluster import Cluster
 
-# Function to create a connection to Cassandra running on Docker
-def create_cassandra_connection():
+from batcher import FANOUT, write_batched
+from autocomplete import load_tag_index
+from buckets import BUCKETED_CQL, route_rows
+from cache import CachedReader
+from ingest import AdaptiveLoader
+from locations import reconcile_locations
+from metrics import instrument_from_env
+from migrate import migrate_schema
+
+# Function to create a connection to Cassandra running on Docker, or to the embedded store
+# in engine.py when a data directory is given (or KILLRVIDEO_EMBEDDED is set)
+def create_cassandra_connection(embedded_path=None):
     try:
+        embedded_path = embedded_path or os.environ.get('KILLRVIDEO_EMBEDDED')
+        if embedded_path:
+            from engine import open_session
+            session = open_session(embedded_path)
+            print(f"Opened embedded store at {embedded_path}")
+            return session
         # Connect to the Cassandra cluster (adjust '127.0.0.1' and port if necessary)
         cluster = Cluster(['127.0.0.1'], port=9042)
         session = cluster.connect()
@@ -22,10 +42,43 @@ def execute_cql_statements(session, cql_statements):
     except Exception as e:
         print(f"Error executing CQL: {e}")
 
+# The application reads the user lookup tables instead of these; set KILLRVIDEO_SASI=0 to leave
+# them out, so writes to users stop paying for them. The next migration then drops them from an
+# existing keyspace.
+USER_SASI_INDEXES = os.environ.get('KILLRVIDEO_SASI', '1') != '0'
+
+sasi_statements = [
+    "CREATE CUSTOM INDEX ON users (firstname) USING 'org.apache.cassandra.index.sasi.SASIIndex' "
+    "WITH OPTIONS = {'analyzer_class': 'org.apache.cassandra.index.sasi.analyzer.NonTokenizingAnalyzer', 'case_sensitive': 'false'};",
+    "CREATE CUSTOM INDEX ON users (lastname) USING 'org.apache.cassandra.index.sasi.SASIIndex' WITH OPTIONS = {'mode': 'CONTAINS'};",
+    "CREATE CUSTOM INDEX ON users (email) USING 'org.apache.cassandra.index.sasi.SASIIndex' WITH OPTIONS = {'mode': 'CONTAINS'};",
+    "CREATE CUSTOM INDEX ON users (created_date) USING 'org.apache.cassandra.index.sasi.SASIIndex' WITH OPTIONS = {'mode': 'SPARSE'};",
+]
+
+# videos_by_location is a table the writer keeps in step with videos (locations.py). Set
+# KILLRVIDEO_LOCATION_MV=1 for the original materialized view, maintained by the server instead.
+LOCATION_VIEW = os.environ.get('KILLRVIDEO_LOCATION_MV') == '1'
+
+location_table_statements = [
+    "CREATE TABLE videos_by_location ("
+    "   location text,"
+    "   videoid uuid,"
+    "   userid uuid,"
+    "   added_date timestamp,"
+    "   PRIMARY KEY (location, videoid)"
+    ");",
+]
+
+location_view_statements = [
+    "CREATE MATERIALIZED VIEW videos_by_location AS "
+    "SELECT userid, added_date, videoid, location "
+    "FROM videos WHERE videoid IS NOT NULL AND location IS NOT NULL "
+    "PRIMARY KEY(location, videoid);",
+]
+
 # List of CQL statements to execute
 cql_statements = [
-    # Drop and Create Keyspace
-    "DROP KEYSPACE IF EXISTS killrvideo;",
+    # Create Keyspace
     "CREATE KEYSPACE killrvideo WITH REPLICATION = { 'class' : 'SimpleStrategy', 'replication_factor' : 3 };",
     
     # Use the new keyspace
@@ -47,12 +100,38 @@ cql_statements = [
     "   created_date timestamp"
     ");",
 
+    # User lookup tables, written with every users row (user_lookups.py)
+    "CREATE TABLE users_by_email ("
+    "   email text PRIMARY KEY,"
+    "   userid uuid,"
+    "   firstname varchar,"
+    "   lastname varchar,"
+    "   created_date timestamp"
+    ");",
+
+    "CREATE TABLE users_by_lastname_prefix ("
+    "   prefix text,"
+    "   lastname_key text,"
+    "   userid uuid,"
+    "   firstname varchar,"
+    "   lastname varchar,"
+    "   email text,"
+    "   created_date timestamp,"
+    "   PRIMARY KEY (prefix, lastname_key, userid)"
+    ");",
+
+    "CREATE TABLE users_by_signup_day ("
+    "   signup_day text,"
+    "   created_date timestamp,"
+    "   userid uuid,"
+    "   firstname varchar,"
+    "   lastname varchar,"
+    "   email text,"
+    "   PRIMARY KEY (signup_day, created_date, userid)"
+    ") WITH CLUSTERING ORDER BY (created_date DESC, userid ASC);",
+
     # SASI Indexes for users table
-    "CREATE CUSTOM INDEX ON users (firstname) USING 'org.apache.cassandra.index.sasi.SASIIndex' "
-    "WITH OPTIONS = {'analyzer_class': 'org.apache.cassandra.index.sasi.analyzer.NonTokenizingAnalyzer', 'case_sensitive': 'false'};",
-    "CREATE CUSTOM INDEX ON users (lastname) USING 'org.apache.cassandra.index.sasi.SASIIndex' WITH OPTIONS = {'mode': 'CONTAINS'};",
-    "CREATE CUSTOM INDEX ON users (email) USING 'org.apache.cassandra.index.sasi.SASIIndex' WITH OPTIONS = {'mode': 'CONTAINS'};",
-    "CREATE CUSTOM INDEX ON users (created_date) USING 'org.apache.cassandra.index.sasi.SASIIndex' WITH OPTIONS = {'mode': 'SPARSE'};",
+    *(sasi_statements if USER_SASI_INDEXES else []),
 
     # Create a UDT for video metadata
     "CREATE TYPE video_metadata ("
@@ -79,11 +158,8 @@ cql_statements = [
     # Index on tags
     "CREATE INDEX tags_idx ON videos(tags);",
 
-    # Materialized view for videos by location
-    "CREATE MATERIALIZED VIEW videos_by_location AS "
-    "SELECT userid, added_date, videoid, location "
-    "FROM videos WHERE videoid IS NOT NULL AND location IS NOT NULL "
-    "PRIMARY KEY(location, videoid);",
+    # Videos by location, kept in step with videos by the writer or by the server
+    *(location_view_statements if LOCATION_VIEW else location_table_statements),
 
     # Table for user videos
     "CREATE TABLE user_videos ("
@@ -172,6 +248,21 @@ cql_statements = [
     "   PRIMARY KEY ((videoid,userid),event_timestamp,event)"
     ") WITH CLUSTERING ORDER BY (event_timestamp DESC,event ASC);",
 
+    # Per-video watch statistics computed from video_event by watch_stats.py
+    "CREATE TABLE video_watch_stats ("
+    "   videoid uuid PRIMARY KEY,"
+    "   sessions bigint,"
+    "   completed bigint,"
+    "   completion_rate double,"
+    "   total_watch_ms bigint,"
+    "   mean_watch_ms double,"
+    "   median_watch_ms bigint,"
+    "   duration_ms bigint,"
+    "   watch_time_histogram list<bigint>,"
+    "   dropoff_histogram list<bigint>,"
+    "   computed_at timestamp"
+    ");",
+
     # Table for uploaded videos
     "CREATE TABLE uploaded_videos ("
     "   videoid uuid PRIMARY KEY,"
@@ -194,6 +285,14 @@ cql_statements = [
     "   added_date timestamp"
     ");",
 
+    # Jobs by the day they were uploaded, written with uploaded_videos_by_jobid (encoding_jobs.py)
+    "CREATE TABLE uploaded_jobs_by_day ("
+    "   added_day text,"
+    "   added_date timestamp,"
+    "   jobid text,"
+    "   PRIMARY KEY (added_day, added_date, jobid)"
+    ");",
+
     # Table for encoding job notifications
     "CREATE TABLE encoding_job_notifications ("
     "   jobid text,"
@@ -205,358 +304,197 @@ cql_statements = [
     ") WITH CLUSTERING ORDER BY (status_date DESC, etag ASC);"
 ]
 
-# Function to execute CQL commands
-def execute_cql_insert_statements(session, cql_insert_statements):
-    try:
-        for statement in cql_insert_statements:
-            print(f"Executing CQL: {statement}")
-            session.execute(statement)
-        print("All CQL statements executed successfully")
-    except Exception as e:
-        print(f"Error executing CQL: {e}")
-
-# List of CQL statements to execute
-cql_insert_statements = [
+# Optional time-bucketed layout for comments_by_video and video_event: 'day', 'hour' or unset
+BUCKET_GRANULARITY = os.environ.get('KILLRVIDEO_BUCKETS')
+
+# Derived rows written with each base row. With the view in place the server derives
+# videos_by_location itself, and writing it too would be rejected.
+WRITE_FANOUT = {table: rows for table, rows in FANOUT.items() if not (LOCATION_VIEW and table == 'videos')}
+
+# Rows that still fail after their retries are appended here (see ingest.replay_dead_letters)
+DEAD_LETTER_PATH = os.environ.get('KILLRVIDEO_DEAD_LETTER', 'killrvideo-dead-letter.jsonl')
+
+# Function to load the demo rows through prepared statements, batched per partition.
+# Each listener is called with (table, params) per row as it is handed to the batcher, and each
+# written listener once that row's write has been applied (e.g. CachedReader.on_write/on_written).
+# With a bucket granularity, comments_by_video and video_event rows go to their bucketed tables.
+# The in-flight window adapts to the cluster, and timed-out or overloaded writes are retried.
+def execute_cql_insert_statements(session, insert_rows, concurrency=64, listeners=(),
+                                  bucket_granularity=BUCKET_GRANULARITY, written_listeners=()):
+    if bucket_granularity:
+        insert_rows = route_rows(insert_rows, bucket_granularity)
+    loader = AdaptiveLoader(session, concurrency, dead_letter=DEAD_LETTER_PATH)
+    report, metrics = write_batched(session, insert_rows, concurrency, listeners=listeners, fanout=WRITE_FANOUT,
+                                    loader=loader, written_listeners=written_listeners)
+    print(report.summary())
+    print(metrics.summary())
+    return report
+
+# Ids shared across the demo rows
+TCODD = uuid.UUID('d0f60aa8-54a9-4840-b70c-fe562b68842b')
+CDATE = uuid.UUID('522b1fe2-2e36-4cef-a667-cd4237d08b89')
+PMCFADIN = uuid.UUID('9761d3d7-7fbd-4269-9988-6cfd4e188678')
+
+FUNNY_CAT = uuid.UUID('99051fe9-6a9c-46c2-b949-38ef78858dd0')
+DOG_PIANO = uuid.UUID('b3a76c6b-7c7f-4af6-964f-803a9283c401')
+DB_INTRO = uuid.UUID('0c3f7e87-f6b6-41d2-9668-2b64d117102c')
+CAP_THEOREM = uuid.UUID('416a5ddc-00a5-49ed-adde-d99da9a27c0c')
+DATA_MODEL_DEAD = uuid.UUID('06049cbb-dfed-421f-b889-5f649a0de1ed')
+SUPER_MODELER = uuid.UUID('873ff430-9c23-4e60-be5f-278ea2bb21bd')
+NEXT_TOP_MODEL = uuid.UUID('49f64d40-7d89-4890-b910-dbf923563a33')
+
+# video_metadata UDT values are bound as (height, width, video_bit_rate, encoding) tuples
+MP4_480P = [(480, 640, frozenset({'1000kbs', '400kbs'}), 'MP4')]
+
+# Demo rows as (table, parameters) in the column order of loader.INSERT_COLUMNS
+insert_rows = [
     # User_credentials
-    "INSERT INTO user_credentials (userid,  email, password)"
-    "VALUES (d0f60aa8-54a9-4840-b70c-fe562b68842b,'tcodd@relational.com','5f4dcc3b5aa765d61d8327deb882cf99');",
-
-    "INSERT INTO user_credentials (userid,  email, password)"
-    "VALUES (522b1fe2-2e36-4cef-a667-cd4237d08b89,'cdate@relational.com','6cb75f652a9b52798eb6cf2201057c73');",
-
-    "INSERT INTO user_credentials (userid,  email, password)"
-    "VALUES (9761d3d7-7fbd-4269-9988-6cfd4e188678,'patrick@datastax.com','ba27e03fd95e507daf2937c937d499ab');",
+    ('user_credentials', ('tcodd@relational.com', '5f4dcc3b5aa765d61d8327deb882cf99', TCODD)),
+    ('user_credentials', ('cdate@relational.com', '6cb75f652a9b52798eb6cf2201057c73', CDATE)),
+    ('user_credentials', ('patrick@datastax.com', 'ba27e03fd95e507daf2937c937d499ab', PMCFADIN)),
 
     # Users
-    "INSERT INTO users (userid, firstname, lastname, email, created_date)"
-    "VALUES (d0f60aa8-54a9-4840-b70c-fe562b68842b,'Ted','Codd', 'tcodd@relational.com','2011-06-01 08:00:00');",
-
-    "INSERT INTO users (userid, firstname, lastname, email, created_date)"
-    "VALUES (522b1fe2-2e36-4cef-a667-cd4237d08b89,'Chris','Date', 'cdate@relational.com','2011-06-20 13:50:00');",
-
-    "INSERT INTO users (userid, firstname, lastname, email, created_date)"
-    "VALUES (9761d3d7-7fbd-4269-9988-6cfd4e188678,'Patrick','McFadin', 'patrick@datastax.com','2011-06-20 13:50:00');",
-
-    #Videos
-    "INSERT INTO videos (videoid, name, userid, description, location, location_type, preview_thumbnails, tags, added_date, metadata)"
-    "VALUES (99051fe9-6a9c-46c2-b949-38ef78858dd0,'My funny cat',d0f60aa8-54a9-4840-b70c-fe562b68842b, 'My cat likes to play the piano! So funny.','/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401',1,{'10':'/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401'},{'cats','piano','lol'},'2012-06-01 08:00:00',"
-    "   {"
-    "       {"
-    "          height: 480,"
-    "          width:  640,"
-    "          encoding: 'MP4',"
-    "          video_bit_rate:"
-    "             {"
-    "                '1000kbs',"
-    "                '400kbs'"
-    "             }"
-    "       }"
-    "   }"
-    ");",
+    ('users', (TCODD, 'Ted', 'Codd', 'tcodd@relational.com', datetime(2011, 6, 1, 8, 0))),
+    ('users', (CDATE, 'Chris', 'Date', 'cdate@relational.com', datetime(2011, 6, 20, 13, 50))),
+    ('users', (PMCFADIN, 'Patrick', 'McFadin', 'patrick@datastax.com', datetime(2011, 6, 20, 13, 50))),
+
+    # Videos
+    ('videos', (FUNNY_CAT, TCODD, 'My funny cat', 'My cat likes to play the piano! So funny.',
+                '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401', 1,
+                {'10': '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401'}, {'cats', 'piano', 'lol'},
+                MP4_480P, datetime(2012, 6, 1, 8, 0))),
+    ('videos', (DOG_PIANO, TCODD, 'Now my dog plays piano!', 'My dog learned to play the piano because of the cat.',
+                '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401', 1,
+                {'10': '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401'}, {'dogs', 'piano', 'lol'},
+                MP4_480P, datetime(2012, 8, 30, 16, 50))),
+    ('videos', (DB_INTRO, CDATE, 'An Introduction to Database Systems', 'An overview of my book',
+                '/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c', 1,
+                {'10': '/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c'}, {'database', 'relational', 'book'},
+                MP4_480P, datetime(2012, 9, 3, 10, 30))),
+    ('videos', (CAP_THEOREM, CDATE, 'Intro to CAP theorem', 'I think there might be something to this.',
+                '/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c', 1,
+                {'10': '/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c'}, {'database', 'cap', 'brewer'},
+                MP4_480P, datetime(2012, 12, 1, 11, 29))),
+    ('videos', (DATA_MODEL_DEAD, PMCFADIN, 'The data model is dead. Long live the data model.',
+                'First in a three part series for Cassandra Data Modeling',
+                'http://www.youtube.com/watch?v=px6U2n74q3g', 1,
+                {'YouTube': 'http://www.youtube.com/watch?v=px6U2n74q3g'},
+                {'cassandra', 'data model', 'relational', 'instruction'},
+                MP4_480P, datetime(2013, 5, 2, 12, 30, 29))),
+    ('videos', (SUPER_MODELER, PMCFADIN, 'Become a Super Modeler',
+                'Second in a three part series for Cassandra Data Modeling',
+                'http://www.youtube.com/watch?v=qphhxujn5Es', 1,
+                {'YouTube': 'http://www.youtube.com/watch?v=qphhxujn5Es'},
+                {'cassandra', 'data model', 'cql', 'instruction'},
+                MP4_480P, datetime(2013, 5, 16, 16, 50))),
+    ('videos', (NEXT_TOP_MODEL, PMCFADIN, "The World's Next Top Data Model",
+                'Third in a three part series for Cassandra Data Modeling',
+                'http://www.youtube.com/watch?v=HdJlsOZVGwM', 1,
+                {'YouTube': 'http://www.youtube.com/watch?v=HdJlsOZVGwM'},
+                {'cassandra', 'data model', 'examples', 'instruction'},
+                MP4_480P, datetime(2013, 6, 11, 11, 0))),
+
+    # user_videos - Every video a user uploads is indexed into a single partition by username
+    ('user_videos', (TCODD, datetime(2012, 6, 1, 8, 0), FUNNY_CAT, 'My funny cat',
+                     '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401')),
+    ('user_videos', (TCODD, datetime(2012, 8, 30, 16, 50), DOG_PIANO, 'Now my dog plays piano!',
+                     '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401')),
+    ('user_videos', (CDATE, datetime(2013, 5, 2, 12, 30, 29), DB_INTRO, 'An Introduction to Database Systems',
+                     '/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c')),
+    ('user_videos', (CDATE, datetime(2012, 12, 1, 11, 29), CAP_THEOREM, 'Intro to CAP theorem',
+                     '/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c')),
+    ('user_videos', (PMCFADIN, datetime(2013, 5, 2, 12, 30, 29), DATA_MODEL_DEAD,
+                     'The data model is dead. Long live the data model.',
+                     'http://www.youtube.com/watch?v=px6U2n74q3g')),
+    ('user_videos', (PMCFADIN, datetime(2013, 5, 16, 16, 50), SUPER_MODELER, 'Become a Super Modeler',
+                     'http://www.youtube.com/watch?v=qphhxujn5Es')),
+    ('user_videos', (PMCFADIN, datetime(2013, 6, 11, 11, 0), NEXT_TOP_MODEL, "The World's Next Top Data Model",
+                     'http://www.youtube.com/watch?v=HdJlsOZVGwM')),
+
+    # latest_videos
+    ('latest_videos', ('2012-06-01', datetime(2012, 6, 1, 8, 0), FUNNY_CAT, 'My funny cat',
+                       '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401')),
+    ('latest_videos', ('2012-08-30', datetime(2012, 8, 30, 16, 50), DOG_PIANO, 'Now my dog plays piano!',
+                       '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401')),
+    ('latest_videos', ('2013-05-02', datetime(2013, 5, 2, 12, 30, 29), DB_INTRO, 'An Introduction to Database Systems',
+                       '/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c')),
+    ('latest_videos', ('2012-12-01', datetime(2012, 12, 1, 11, 29), CAP_THEOREM, 'Intro to CAP theorem',
+                       '/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c')),
+    ('latest_videos', ('2013-05-02', datetime(2013, 5, 2, 12, 30, 29), DATA_MODEL_DEAD,
+                       'The data model is dead. Long live the data model.',
+                       'http://www.youtube.com/watch?v=px6U2n74q3g')),
+    ('latest_videos', ('2013-05-16', datetime(2013, 5, 16, 16, 50), SUPER_MODELER, 'Become a Super Modeler',
+                       'http://www.youtube.com/watch?v=qphhxujn5Es')),
+    ('latest_videos', ('2013-06-11', datetime(2013, 6, 11, 11, 0), NEXT_TOP_MODEL, "The World's Next Top Data Model",
+                       'http://www.youtube.com/watch?v=HdJlsOZVGwM')),
+
+    # Video Rating counters: (rating_counter increment, rating_total increment, videoid)
+    ('video_rating', (1, 3, FUNNY_CAT)),
+    ('video_rating', (1, 5, FUNNY_CAT)),
+    ('video_rating', (1, 4, FUNNY_CAT)),
+
+    # video_ratings_by_user
+    ('video_ratings_by_user', (FUNNY_CAT, PMCFADIN, 3)),
+    ('video_ratings_by_user', (FUNNY_CAT, PMCFADIN, 5)),
+    ('video_ratings_by_user', (FUNNY_CAT, PMCFADIN, 4)),
+]
 
-"INSERT INTO videos (videoid, name, userid, description, location, location_type, preview_thumbnails, tags, added_date, metadata)"
-"VALUES (b3a76c6b-7c7f-4af6-964f-803a9283c401,'Now my dog plays piano!',d0f60aa8-54a9-4840-b70c-fe562b68842b, 'My dog learned to play the piano because of the cat.','/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401',1,{'10':'/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401'},{'dogs','piano','lol'},'2012-08-30 16:50:00',"
-"   {"
-"       {"
-"          height: 480,"
-"          width:  640,"
-"          encoding: 'MP4',"
-"          video_bit_rate:"
-"             {"
-"                '1000kbs',"
-"                '400kbs'"
-"             }"
-"       }"
-"   }"
-");",
-
-"INSERT INTO videos (videoid, name, userid, description, location, location_type, preview_thumbnails, tags, added_date, metadata)"
-"VALUES (0c3f7e87-f6b6-41d2-9668-2b64d117102c,'An Introduction to Database Systems',522b1fe2-2e36-4cef-a667-cd4237d08b89, 'An overview of my book','/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c',1,{'10':'/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c'},{'database','relational','book'},'2012-09-03 10:30:00',"
-"   {"
-"       {"
-"          height: 480,"
-"          width:  640,"
-"          encoding: 'MP4',"
-"          video_bit_rate:"
-"             {"
-"                '1000kbs',"
-"                '400kbs'"
-"             }"
-"       }"
-"   }"
-");",
-
-"INSERT INTO videos (videoid, name, userid, description, location, location_type, preview_thumbnails, tags, added_date, metadata)"
-"VALUES (416a5ddc-00a5-49ed-adde-d99da9a27c0c,'Intro to CAP theorem',522b1fe2-2e36-4cef-a667-cd4237d08b89, 'I think there might be something to this.','/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c',1,{'10':'/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c'},{'database','cap','brewer'},'2012-12-01 11:29:00',"
-"   {"
-"       {"
-"          height: 480,"
-"          width:  640,"
-"          encoding: 'MP4',"
-"          video_bit_rate:"
-"             {"
-"                '1000kbs',"
-"                '400kbs'"
-"             }"
-"       }"
-"   }"
-");",
-
-"INSERT INTO videos (videoid, name, userid, description, location, location_type, preview_thumbnails, tags, added_date, metadata)"
-"VALUES (06049cbb-dfed-421f-b889-5f649a0de1ed,'The data model is dead. Long live the data model.',9761d3d7-7fbd-4269-9988-6cfd4e188678, 'First in a three part series for Cassandra Data Modeling','http://www.youtube.com/watch?v=px6U2n74q3g',1,{'YouTube':'http://www.youtube.com/watch?v=px6U2n74q3g'},{'cassandra','data model','relational','instruction'},'2013-05-02 12:30:29',"
-"   {"
-"       {"
-"          height: 480,"
-"          width:  640,"
-"          encoding: 'MP4',"
-"          video_bit_rate:"
-"             {"
-"                '1000kbs',"
-"                '400kbs'"
-"             }"
-"       }"
-"   }"
-");",
-
-"INSERT INTO videos (videoid, name, userid, description, location, location_type, preview_thumbnails, tags, added_date, metadata)"
-"VALUES (873ff430-9c23-4e60-be5f-278ea2bb21bd,'Become a Super Modeler',9761d3d7-7fbd-4269-9988-6cfd4e188678, 'Second in a three part series for Cassandra Data Modeling','http://www.youtube.com/watch?v=qphhxujn5Es',1,{'YouTube':'http://www.youtube.com/watch?v=qphhxujn5Es'},{'cassandra','data model','cql','instruction'},'2013-05-16 16:50:00',"
-"   {"
-"       {"
-"          height: 480,"
-"          width:  640,"
-"          encoding: 'MP4',"
-"          video_bit_rate:"
-"             {"
-"                '1000kbs',"
-"                '400kbs'"
-"             }"
-"       }"
-"   }"
-");",
-
-"INSERT INTO videos (videoid, name, userid, description, location, location_type, preview_thumbnails, tags, added_date, metadata)"
-"VALUES (49f64d40-7d89-4890-b910-dbf923563a33,'The World''s Next Top Data Model',9761d3d7-7fbd-4269-9988-6cfd4e188678, 'Third in a three part series for Cassandra Data Modeling','http://www.youtube.com/watch?v=HdJlsOZVGwM',1,{'YouTube':'http://www.youtube.com/watch?v=HdJlsOZVGwM'},{'cassandra','data model','examples','instruction'},'2013-06-11 11:00:00',"
-"   {"
-"       {"
-"          height: 480,"
-"          width:  640,"
-"          encoding: 'MP4',"
-"          video_bit_rate:"
-"             {"
-"                '1000kbs',"
-"                '400kbs'"
-"             }"
-"       }"
-"   }"
-");",
-
-# user_videos - Every video a user uploads is indexed into a single partition by username
-"INSERT INTO user_videos (userid, videoid, added_date, name, preview_image_location)"
-"VALUES (d0f60aa8-54a9-4840-b70c-fe562b68842b,99051fe9-6a9c-46c2-b949-38ef78858dd0,'2012-06-01 08:00:00','My funny cat',"
-"        '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401');",
-
-"INSERT INTO user_videos (userid, videoid, added_date, name, preview_image_location)"
-"VALUES (d0f60aa8-54a9-4840-b70c-fe562b68842b,b3a76c6b-7c7f-4af6-964f-803a9283c401,'2012-08-30 16:50:00','Now my dog plays piano!',"
-"        '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401');",
-
-"INSERT INTO user_videos (userid, videoid, added_date, name, preview_image_location)"
-"VALUES (522b1fe2-2e36-4cef-a667-cd4237d08b89,0c3f7e87-f6b6-41d2-9668-2b64d117102c,'2013-05-02 12:30:29','An Introduction to Database Systems',"
-"        '/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c');",
-
-"INSERT INTO user_videos (userid, videoid, added_date, name, preview_image_location)"
-"VALUES (522b1fe2-2e36-4cef-a667-cd4237d08b89,416a5ddc-00a5-49ed-adde-d99da9a27c0c,'2012-12-01 11:29:00','Intro to CAP theorem',"
-"        '/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c');",
-
-"INSERT INTO user_videos (userid, videoid, added_date, name, preview_image_location)"
-"VALUES (9761d3d7-7fbd-4269-9988-6cfd4e188678,06049cbb-dfed-421f-b889-5f649a0de1ed,'2013-05-02 12:30:29','The data model is dead. Long live the data model.',"
-"        'http://www.youtube.com/watch?v=px6U2n74q3g');",
-
-"INSERT INTO user_videos (userid, videoid, added_date, name, preview_image_location)"
-"VALUES (9761d3d7-7fbd-4269-9988-6cfd4e188678,873ff430-9c23-4e60-be5f-278ea2bb21bd,'2013-05-16 16:50:00','Become a Super Modeler',"
-"        'http://www.youtube.com/watch?v=qphhxujn5Es');",
-
-"INSERT INTO user_videos (userid, videoid, added_date, name, preview_image_location)"
-"VALUES (9761d3d7-7fbd-4269-9988-6cfd4e188678,49f64d40-7d89-4890-b910-dbf923563a33,'2013-06-11 11:00:00','The World''s Next Top Data Model',"
-"        'http://www.youtube.com/watch?v=HdJlsOZVGwM');",
-
-# latest_videos
-"INSERT INTO latest_videos (yyyymmdd, videoid, added_date, name, preview_image_location)"
-"VALUES ('2012-06-01',99051fe9-6a9c-46c2-b949-38ef78858dd0,'2012-06-01 08:00:00','My funny cat',"
-"        '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401');",
-
-"INSERT INTO latest_videos (yyyymmdd, videoid, added_date, name, preview_image_location)"
-"VALUES ('2012-08-30',b3a76c6b-7c7f-4af6-964f-803a9283c401,'2012-08-30 16:50:00','Now my dog plays piano!',"
-"        '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401');",
-
-"INSERT INTO latest_videos (yyyymmdd, videoid, added_date, name, preview_image_location)"
-"VALUES ('2013-05-02',0c3f7e87-f6b6-41d2-9668-2b64d117102c,'2013-05-02 12:30:29','An Introduction to Database Systems',"
-"        '/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c');",
-
-"INSERT INTO latest_videos (yyyymmdd, videoid, added_date, name, preview_image_location)"
-"VALUES ('2012-12-01',416a5ddc-00a5-49ed-adde-d99da9a27c0c,'2012-12-01 11:29:00','Intro to CAP theorem',"
-"        '/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c');",
-
-"INSERT INTO latest_videos (yyyymmdd, videoid, added_date, name, preview_image_location)"
-"VALUES ('2013-05-02',06049cbb-dfed-421f-b889-5f649a0de1ed,'2013-05-02 12:30:29','The data model is dead. Long live the data model.',"
-"        'http://www.youtube.com/watch?v=px6U2n74q3g');",
-
-"INSERT INTO latest_videos (yyyymmdd, videoid, added_date, name, preview_image_location)"
-"VALUES ('2013-05-16',873ff430-9c23-4e60-be5f-278ea2bb21bd,'2013-05-16 16:50:00','Become a Super Modeler',"
-"        'http://www.youtube.com/watch?v=qphhxujn5Es');",
-
-"INSERT INTO latest_videos (yyyymmdd, videoid, added_date, name, preview_image_location)"
-"VALUES ('2013-06-11',49f64d40-7d89-4890-b910-dbf923563a33,'2013-06-11 11:00:00','The World''s Next Top Data Model',"
-"        'http://www.youtube.com/watch?v=HdJlsOZVGwM');",
-
-# Video Rating counters
-"UPDATE video_rating SET rating_counter = rating_counter + 1, rating_total = rating_total + 3 "
-"WHERE videoid = 99051fe9-6a9c-46c2-b949-38ef78858dd0;",
-
-"UPDATE video_rating SET rating_counter = rating_counter + 1, rating_total = rating_total + 5 "
-"WHERE videoid = 99051fe9-6a9c-46c2-b949-38ef78858dd0;",
-
-"UPDATE video_rating SET rating_counter = rating_counter + 1, rating_total = rating_total + 4 "
-"WHERE videoid = 99051fe9-6a9c-46c2-b949-38ef78858dd0;",
-
-# video_ratings_by_user
-"INSERT INTO video_ratings_by_user (videoid, userid, rating)"
-"VALUES ( 99051fe9-6a9c-46c2-b949-38ef78858dd0,9761d3d7-7fbd-4269-9988-6cfd4e188678 ,3);",
-
-"INSERT INTO video_ratings_by_user (videoid, userid, rating)"
-"VALUES ( 99051fe9-6a9c-46c2-b949-38ef78858dd0,9761d3d7-7fbd-4269-9988-6cfd4e188678 ,5);",
-
-"INSERT INTO video_ratings_by_user (videoid, userid, rating)"
-"VALUES ( 99051fe9-6a9c-46c2-b949-38ef78858dd0,9761d3d7-7fbd-4269-9988-6cfd4e188678 ,4);",
-
-# videos_by_tag
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('cats',99051fe9-6a9c-46c2-b949-38ef78858dd0,'2012-05-25 08:30:29','2012-06-01 08:00:00','My funny cat',"
-"        '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('piano',99051fe9-6a9c-46c2-b949-38ef78858dd0, '2012-05-25 08:30:29','2012-06-01 08:00:00','My funny cat',"
-"        '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('lol',99051fe9-6a9c-46c2-b949-38ef78858dd0, '2012-05-25 08:30:29','2012-06-01 08:00:00','My funny cat',"
-"        '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('dogs',b3a76c6b-7c7f-4af6-964f-803a9283c401, '2012-08-30 16:50:00','2012-08-30 16:50:00','Now my dog plays piano!',"
-"        '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('piano',b3a76c6b-7c7f-4af6-964f-803a9283c401, '2012-08-30 16:50:00','2012-08-30 16:50:00','Now my dog plays piano!',"
-"        '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('lol',b3a76c6b-7c7f-4af6-964f-803a9283c401, '2012-08-30 16:50:00','2012-08-30 16:50:00','Now my dog plays piano!',"
-"        '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('database',0c3f7e87-f6b6-41d2-9668-2b64d117102c, '2012-09-03 10:30:00','2013-05-02 12:30:29','An Introduction to Database Systems',"
-"        '/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('relational',0c3f7e87-f6b6-41d2-9668-2b64d117102c, '2012-09-03 10:30:00','2013-05-02 12:30:29','An Introduction to Database Systems',"
-"        '/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('book',0c3f7e87-f6b6-41d2-9668-2b64d117102c, '2012-09-03 10:30:00','2013-05-02 12:30:29','An Introduction to Database Systems',"
-"        '/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('database',416a5ddc-00a5-49ed-adde-d99da9a27c0c, '2012-12-01 11:29:00','2012-12-01 11:29:00','Intro to CAP theorem',"
-"        '/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('cap',416a5ddc-00a5-49ed-adde-d99da9a27c0c, '2012-12-01 11:29:00','2012-12-01 11:29:00','Intro to CAP theorem',"
-"        '/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('brewer',416a5ddc-00a5-49ed-adde-d99da9a27c0c, '2012-12-01 11:29:00','2012-12-01 11:29:00','Intro to CAP theorem',"
-"        '/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('cassandra',06049cbb-dfed-421f-b889-5f649a0de1ed, '2013-05-02 12:30:29','2013-05-02 12:30:29','The data model is dead. Long live the data model.',"
-"        'http://www.youtube.com/watch?v=px6U2n74q3g');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('data model',06049cbb-dfed-421f-b889-5f649a0de1ed, '2013-05-02 12:30:29','2013-05-02 12:30:29','The data model is dead. Long live the data model.',"
-"        'http://www.youtube.com/watch?v=px6U2n74q3g');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('relational',06049cbb-dfed-421f-b889-5f649a0de1ed, '2013-05-02 12:30:29','2013-05-02 12:30:29','The data model is dead. Long live the data model.',"
-"        'http://www.youtube.com/watch?v=px6U2n74q3g');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('instruction',06049cbb-dfed-421f-b889-5f649a0de1ed, '2013-05-02 12:30:29','2013-05-02 12:30:29','The data model is dead. Long live the data model.',"
-"        'http://www.youtube.com/watch?v=px6U2n74q3g');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('cassandra',873ff430-9c23-4e60-be5f-278ea2bb21bd, '2013-05-16 16:50:00','2013-05-16 16:50:00','Become a Super Modeler',"
-"        'http://www.youtube.com/watch?v=qphhxujn5Es');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('data model',873ff430-9c23-4e60-be5f-278ea2bb21bd, '2013-05-16 16:50:00','2013-05-16 16:50:00','Become a Super Modeler',"
-"        'http://www.youtube.com/watch?v=qphhxujn5Es');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('relational',873ff430-9c23-4e60-be5f-278ea2bb21bd, '2013-05-16 16:50:00','2013-05-16 16:50:00','Become a Super Modeler',"
-"        'http://www.youtube.com/watch?v=qphhxujn5Es');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('instruction',873ff430-9c23-4e60-be5f-278ea2bb21bd, '2013-05-16 16:50:00','2013-05-16 16:50:00','Become a Super Modeler',"
-"        'http://www.youtube.com/watch?v=qphhxujn5Es');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('cassandra',49f64d40-7d89-4890-b910-dbf923563a33, '2013-06-11 11:00:00','2013-06-11 11:00:00','The World''s Next Top Data Model',"
-"        'http://www.youtube.com/watch?v=HdJlsOZVGwM');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('data model',49f64d40-7d89-4890-b910-dbf923563a33, '2013-06-11 11:00:00','2013-06-11 11:00:00','The World''s Next Top Data Model',"
-"        'http://www.youtube.com/watch?v=HdJlsOZVGwM');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('examples',49f64d40-7d89-4890-b910-dbf923563a33, '2013-06-11 11:00:00','2013-06-11 11:00:00','The World''s Next Top Data Model',"
-"        'http://www.youtube.com/watch?v=HdJlsOZVGwM');",
-
-"INSERT INTO videos_by_tag (tag, videoid, tagged_date, added_date, name, preview_image_location)"
-"VALUES ('instruction',49f64d40-7d89-4890-b910-dbf923563a33, '2013-06-11 11:00:00','2013-06-11 11:00:00','The World''s Next Top Data Model',"
-"        'http://www.youtube.com/watch?v=HdJlsOZVGwM');",
-
-# Video Comments. One for each side of the view.
-# Insert in pairs
-# This is done using the logged batch command to group our operations to ensure both actions are eventually taken.
-"BEGIN BATCH"
-"   INSERT INTO comments_by_video (videoid, userid, commentid, comment)"
-"   VALUES (99051fe9-6a9c-46c2-b949-38ef78858dd0,d0f60aa8-54a9-4840-b70c-fe562b68842b,now(), 'Worst. Video. Ever.');"
-"   INSERT INTO comments_by_video (videoid, userid, commentid, comment)"
-"   VALUES (99051fe9-6a9c-46c2-b949-38ef78858dd0,d0f60aa8-54a9-4840-b70c-fe562b68842b,now(), 'Worst. Video. Ever.');"
-"APPLY BATCH;",
-
-"BEGIN BATCH"
-"   INSERT INTO comments_by_video (videoid, userid, commentid, comment)"
-"   VALUES (99051fe9-6a9c-46c2-b949-38ef78858dd0,522b1fe2-2e36-4cef-a667-cd4237d08b89,now(), 'It is amazing');"
-"   INSERT INTO comments_by_video (videoid, userid, commentid, comment)"
-"   VALUES (99051fe9-6a9c-46c2-b949-38ef78858dd0,522b1fe2-2e36-4cef-a667-cd4237d08b89,now(), 'It is amazing');"
-"APPLY BATCH;",
+# videos_by_tag: (tag, videoid, tagged_date, added_date, name, preview_image_location)
+for tags, videoid, tagged_date, added_date, name, preview in [
+    (('cats', 'piano', 'lol'), FUNNY_CAT, datetime(2012, 5, 25, 8, 30, 29), datetime(2012, 6, 1, 8, 0),
+     'My funny cat', '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401'),
+    (('dogs', 'piano', 'lol'), DOG_PIANO, datetime(2012, 8, 30, 16, 50), datetime(2012, 8, 30, 16, 50),
+     'Now my dog plays piano!', '/us/vid/b3/b3a76c6b-7c7f-4af6-964f-803a9283c401'),
+    (('database', 'relational', 'book'), DB_INTRO, datetime(2012, 9, 3, 10, 30), datetime(2013, 5, 2, 12, 30, 29),
+     'An Introduction to Database Systems', '/us/vid/0c/0c3f7e87-f6b6-41d2-9668-2b64d117102c'),
+    (('database', 'cap', 'brewer'), CAP_THEOREM, datetime(2012, 12, 1, 11, 29), datetime(2012, 12, 1, 11, 29),
+     'Intro to CAP theorem', '/us/vid/41/416a5ddc-00a5-49ed-adde-d99da9a27c0c'),
+    (('cassandra', 'data model', 'relational', 'instruction'), DATA_MODEL_DEAD, datetime(2013, 5, 2, 12, 30, 29),
+     datetime(2013, 5, 2, 12, 30, 29), 'The data model is dead. Long live the data model.',
+     'http://www.youtube.com/watch?v=px6U2n74q3g'),
+    (('cassandra', 'data model', 'relational', 'instruction'), SUPER_MODELER, datetime(2013, 5, 16, 16, 50),
+     datetime(2013, 5, 16, 16, 50), 'Become a Super Modeler', 'http://www.youtube.com/watch?v=qphhxujn5Es'),
+    (('cassandra', 'data model', 'examples', 'instruction'), NEXT_TOP_MODEL, datetime(2013, 6, 11, 11, 0),
+     datetime(2013, 6, 11, 11, 0), "The World's Next Top Data Model", 'http://www.youtube.com/watch?v=HdJlsOZVGwM'),
+]:
+    for tag in tags:
+        insert_rows.append(('videos_by_tag', (tag, videoid, added_date, name, preview, tagged_date)))
+
+# Video Comments. One for each side of the view, sharing the same timeuuid.
+# The batcher writes each pair in a logged batch so both sides are eventually applied.
+for videoid, userid, comment in [
+    (FUNNY_CAT, TCODD, 'Worst. Video. Ever.'),
+    (FUNNY_CAT, CDATE, 'It is amazing'),
+]:
+    commentid = uuid.uuid1()
+    insert_rows.append(('comments_by_video', (videoid, commentid, userid, comment)))
+    insert_rows.append(('comments_by_user', (userid, commentid, videoid, comment)))
 
 # Video events
-"INSERT INTO video_event (videoid, userid, event, event_timestamp, video_timestamp)"
-"VALUES (99051fe9-6a9c-46c2-b949-38ef78858dd0,d0f60aa8-54a9-4840-b70c-fe562b68842b,'start',now(),0);",
-"INSERT INTO video_event (videoid, userid, event, event_timestamp, video_timestamp)"
-"VALUES (99051fe9-6a9c-46c2-b949-38ef78858dd0,d0f60aa8-54a9-4840-b70c-fe562b68842b,'stop',now(),30000);",
-"INSERT INTO video_event (videoid, userid, event, event_timestamp, video_timestamp)"
-"VALUES (99051fe9-6a9c-46c2-b949-38ef78858dd0,d0f60aa8-54a9-4840-b70c-fe562b68842b,'start',now(),3000);",
-"INSERT INTO video_event (videoid, userid, event, event_timestamp, video_timestamp)"
-"VALUES (99051fe9-6a9c-46c2-b949-38ef78858dd0,d0f60aa8-54a9-4840-b70c-fe562b68842b,'stop',now(),230000);"
-]
+for event, video_timestamp in [('start', 0), ('stop', 30000), ('start', 3000), ('stop', 230000)]:
+    insert_rows.append(('video_event', (FUNNY_CAT, TCODD, uuid.uuid1(), event, video_timestamp)))
 
 # Main function to establish connection and run CQL
 if __name__ == "__main__":
     session = create_cassandra_connection()
     if session:
-        execute_cql_statements(session, cql_statements)
-        execute_cql_insert_statements(session, cql_insert_statements)
+        # Per-statement latency metrics when KILLRVIDEO_METRICS names an output directory
+        instrumentation = instrument_from_env(session)
+        # Create or update the schema in place; existing tables and data are kept
+        applied, problems = migrate_schema(session, cql_statements + (BUCKETED_CQL if BUCKET_GRANULARITY else []),
+                                           managed=sasi_statements + location_view_statements)
+        # A keyspace from before the table had the view, which the migration has just replaced
+        if not problems and not LOCATION_VIEW and \
+                any(step.kind == 'view' and step.name == 'videos_by_location' for step in applied):
+            print(reconcile_locations(session, repair=True).summary())
+        if not problems:
+            # Reads through this session's cache and tag index see each write once it is applied
+            cache = CachedReader(session)
+            tags = load_tag_index(session)
+            execute_cql_insert_statements(session, insert_rows, listeners=[cache.on_write],
+                                          written_listeners=[cache.on_written, tags.on_write])
+        if instrumentation:
+            instrumentation.close()
         session.shutdown()
+        if problems:
+            raise SystemExit(1)
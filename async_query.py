@@ -0,0 +1,75 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class QuerySpec:
+    name: str
+    statement: object
+    params: object = None
+
+
+@dataclass
+class QueryResult:
+    spec: QuerySpec
+    rows: list = field(default_factory=list)
+    latency: float = 0.0
+    error: Exception = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+# Bridge a driver ResponseFuture into an asyncio future, following every page of the result.
+# Driver callbacks fire on its event-loop thread, so results are handed back with call_soon_threadsafe.
+def execute_async_rows(session, statement, params=None, loop=None):
+    loop = loop or asyncio.get_running_loop()
+    result = loop.create_future()
+    rows = []
+
+    def resolve(value, is_error=False):
+        if result.done():
+            return
+        if is_error:
+            result.set_exception(value)
+        else:
+            result.set_result(value)
+
+    response_future = session.execute_async(statement, params)
+
+    def on_page(page):
+        rows.extend(page)
+        if response_future.has_more_pages:
+            response_future.start_fetching_next_page()
+        else:
+            loop.call_soon_threadsafe(resolve, rows)
+
+    def on_error(error):
+        loop.call_soon_threadsafe(resolve, error, True)
+
+    response_future.add_callbacks(on_page, on_error)
+    return result
+
+
+# Run independent queries concurrently with at most `concurrency` requests in flight.
+# Results come back in the order of `specs`, each with its own latency.
+async def run_queries_async(session, specs, concurrency=8):
+    slots = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def run_one(spec):
+        async with slots:
+            start = time.perf_counter()
+            try:
+                rows = await execute_async_rows(session, spec.statement, spec.params, loop)
+                return QueryResult(spec, rows, time.perf_counter() - start)
+            except Exception as e:
+                return QueryResult(spec, [], time.perf_counter() - start, e)
+
+    return await asyncio.gather(*(run_one(spec) for spec in specs))
+
+
+def run_queries(session, specs, concurrency=8):
+    return asyncio.run(run_queries_async(session, specs, concurrency))
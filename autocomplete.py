@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+
+from paging import iter_rows
+
+# Tag autocomplete served from memory. tags_by_letter is read once into a trie whose nodes each
+# keep their top-K completions by popularity (number of videos carrying the tag), so a prefix
+# query is a walk of len(prefix) nodes plus a slice. New tags and new tagged videos from the
+# write path update only the nodes along that tag's path.
+
+ALL_TAGS = "SELECT first_letter, tag FROM tags_by_letter"
+TAG_VIDEO_COUNT = "SELECT count(*) FROM videos_by_tag WHERE tag = ?"
+
+
+class _Node:
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children = {}
+        # Up to top_k tags under this prefix, ordered by (-weight, tag)
+        self.top = []
+
+
+class TagIndex:
+    def __init__(self, top_k=10, max_tagged=100000):
+        self.top_k = top_k
+        self.weights = {}
+        self.root = _Node()
+        # Tags whose video count could not be read by load_tag_index: tag -> error
+        self.load_errors = {}
+        self._lock = threading.Lock()
+        # The most recent max_tagged (tag, videoid) pairs counted from the write path, so a row
+        # written again soon after (a retry, a re-upsert) counts once
+        self.max_tagged = max_tagged
+        self._tagged = OrderedDict()
+
+    def __len__(self):
+        return len(self.weights)
+
+    def __contains__(self, tag):
+        return tag in self.weights
+
+    def _rank(self, tag):
+        return (-self.weights[tag], tag)
+
+    # Weights only ever grow, so a tag already in a node's top list can only move up and a tag
+    # outside it can only enter; neither case needs the rest of the subtree. complete() reads
+    # node.top without the lock, so the list is replaced with an updated copy, never changed in place.
+    def _offer(self, node, tag):
+        top = node.top
+        if tag not in top:
+            if len(top) >= self.top_k:
+                if self._rank(tag) >= self._rank(top[-1]):
+                    return
+                top = top[:-1]
+            top = top + [tag]
+        node.top = sorted(top, key=self._rank)
+
+    # Add a tag if it is new and raise its weight by `delta`
+    def add(self, tag, delta=0):
+        with self._lock:
+            self.weights[tag] = self.weights.get(tag, 0) + delta
+            node = self.root
+            self._offer(node, tag)
+            for char in tag.lower():
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = _Node()
+                node = child
+                self._offer(node, tag)
+
+    # Most popular tags starting with `prefix` (case-insensitive), best first
+    def complete(self, prefix, limit=10):
+        node = self.root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.top[:min(limit, self.top_k)]
+
+    # Count one more video for a tag, once per (tag, videoid) among the recently counted pairs
+    def add_video(self, tag, videoid):
+        with self._lock:
+            if (tag, videoid) in self._tagged:
+                self._tagged.move_to_end((tag, videoid))
+                return
+            self._tagged[(tag, videoid)] = None
+            if len(self._tagged) > self.max_tagged:
+                self._tagged.popitem(last=False)
+        self.add(tag, 1)
+
+    # Written listener for app1.execute_cql_insert_statements(written_listeners=...), so a tag is
+    # offered once its row is applied
+    def on_write(self, table, params):
+        if table == 'tags_by_letter':
+            self.add(params[1])
+        elif table == 'videos_by_tag':
+            self.add_video(params[0], params[1])
+
+
+# Build the index from tags_by_letter; with `weights`, each tag is weighted by its videos_by_tag
+# partition size, counted concurrently with `concurrency` reads in flight. A tag whose count
+# cannot be read is indexed with weight 0 and listed in the index's load_errors.
+def load_tag_index(session, top_k=10, weights=True, concurrency=32, fetch_size=1000):
+    tags = [row.tag for row in iter_rows(session, ALL_TAGS, fetch_size=fetch_size)]
+    counts = dict.fromkeys(tags, 0)
+    errors = {}
+    if weights and tags:
+        statement = session.prepare(TAG_VIDEO_COUNT)
+        slots = threading.Semaphore(concurrency)
+
+        def counted(rows, tag):
+            counts[tag] = rows[0].count if rows else 0
+            slots.release()
+
+        def failed(error, tag):
+            errors[tag] = error
+            slots.release()
+
+        for tag in tags:
+            slots.acquire()
+            future = session.execute_async(statement, (tag,))
+            future.add_callbacks(counted, failed, callback_args=(tag,), errback_args=(tag,))
+        for _ in range(concurrency):
+            slots.acquire()
+    index = TagIndex(top_k)
+    for tag, count in counts.items():
+        index.add(tag, count)
+    index.load_errors = errors
+    if errors:
+        tag, error = next(iter(errors.items()))
+        print(f"Error counting videos for {len(errors)} of {len(tags)} tags, first {tag!r}: {error}")
+    return index
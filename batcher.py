@@ -0,0 +1,284 @@
+import time
+from collections import Counter, OrderedDict
+
+from cassandra.query import BatchStatement, BatchType
+
+from buckets import BUCKET_INDEX_FANOUT, BUCKET_INDEX_TABLES
+from encoding_jobs import upload_rows
+from loader import BulkLoader, COUNTER_UPDATES, bind_columns, partition_key
+from ratings import RATING_TABLES, RatingIngest
+from locations import location_deletes, location_rows
+from user_lookups import lookup_rows
+
+# Tables whose rows must be written together atomically: key table -> (partner table, shared column).
+# Whichever of the two rows arrives first is held until the other, with the same value in the shared
+# column, arrives, and both go out in one LOGGED batch. Rows that never find their partner are batched
+# like any other.
+ATOMIC_PAIRS = {
+    "comments_by_video": ("comments_by_user", "commentid"),
+    "comments_by_video_bucketed": ("comments_by_user", "commentid"),
+}
+# Partner table -> shared column
+ATOMIC_PARTNERS = {partner: column for partner, column in ATOMIC_PAIRS.values()}
+
+# Tables whose rows imply rows in other tables: the row and everything derived from it go out
+# together in one LOGGED batch
+FANOUT = {
+    "users": lookup_rows,
+    "videos": location_rows,
+    "uploaded_videos_by_jobid": upload_rows,
+    **BUCKET_INDEX_FANOUT,
+}
+# Derived tables whose rows repeat across many source rows (one bucket index row per bucket). Each
+# distinct row is sent once, with the first source row that implies it; a source row with nothing
+# new to derive is batched like any other.
+DEDUPED_TABLES = BUCKET_INDEX_TABLES
+# Fan-out tables whose derived rows move when the row changes: table -> function of the session
+# returning a function of the row's params that gives the (table, statement, params) deletes of
+# the derived rows it replaces, sent in the same batch
+FANOUT_DELETES = {
+    "videos": location_deletes,
+}
+
+
+# Rough serialized size of a bound row, close enough to keep batches under the server's warn threshold
+def estimate_size(params):
+    size = 0
+    for value in params:
+        if isinstance(value, (str, bytes)):
+            size += len(value) + 4
+        elif isinstance(value, (set, frozenset, list, tuple)):
+            size += estimate_size(value) + 4
+        elif isinstance(value, dict):
+            size += estimate_size(value.keys()) + estimate_size(value.values()) + 4
+        else:
+            size += 16
+    return size
+
+
+class BatchMetrics:
+    def __init__(self):
+        self.single_statements = 0
+        self.batches = Counter()
+        self.batch_sizes = Counter()
+        self.partitions_per_batch = Counter()
+        self.ratings = None
+
+    def record(self, batch_type, rows, partitions):
+        if rows == 1:
+            self.single_statements += 1
+            return
+        self.batches[batch_type] += 1
+        self.batch_sizes[rows] += 1
+        self.partitions_per_batch[partitions] += 1
+
+    @property
+    def mean_batch_size(self):
+        total = sum(self.batch_sizes.values())
+        return sum(size * n for size, n in self.batch_sizes.items()) / total if total else 0.0
+
+    def summary(self):
+        kinds = ", ".join(f"{n} {kind.lower()}" for kind, n in sorted(self.batches.items()))
+        summary = (f"Batches: {kinds or 'none'}; {self.single_statements} single statements; "
+                   f"mean batch size {self.mean_batch_size:.1f} rows; "
+                   f"partitions per batch {dict(sorted(self.partitions_per_batch.items()))}")
+        if self.ratings is not None and (self.ratings.updates or self.ratings.rating_rows):
+            summary += "\n" + self.ratings.summary()
+        return summary
+
+
+def column_value(table, params, column):
+    return params[bind_columns(table).index(column)]
+
+
+# Groups writes by (table, partition key) into UNLOGGED batches. Each batch stays on a single partition,
+# so it is applied as one mutation on one replica set and never touches the batchlog.
+class PartitionBatcher:
+    def __init__(self, session, concurrency=64, max_batch_rows=50, max_batch_bytes=5 * 1024,
+                 max_buffered_rows=10000, listeners=(), fanout=FANOUT, loader=None, written_listeners=()):
+        self.loader = loader if loader is not None else BulkLoader(session, concurrency)
+        self.fanout = fanout
+        # Called with (table, params) for every row handed to the batcher, before it is sent
+        self.listeners = list(listeners)
+        # Called with (table, params) for every row once its write has been applied, e.g. cache
+        # invalidation; rows can wait in a buffer (or a rating flush) well after add() returns
+        self.loader.written_listeners.extend(written_listeners)
+        self.max_batch_rows = max_batch_rows
+        self.max_batch_bytes = max_batch_bytes
+        self.max_buffered_rows = max_buffered_rows
+        self.metrics = BatchMetrics()
+        # Rating writes share the loader but coalesce counter increments per video instead of batching
+        self.ratings = RatingIngest(loader=self.loader, flush_interval=None, max_pending=max_buffered_rows)
+        self.metrics.ratings = self.ratings.metrics
+        self._groups = OrderedDict()
+        self._buffered = 0
+        # (partner table, shared value) -> (is key-table side, rows) waiting for the other side, oldest first
+        self._pending_atomic = OrderedDict()
+        self._session = session
+        self._deletes = {}
+        # Rows of DEDUPED_TABLES already sent, the most recent max_buffered_rows of them
+        self._sent_derived = OrderedDict()
+
+    @property
+    def report(self):
+        return self.loader.report
+
+    def add(self, table, params):
+        pair = self._pair(table, params)
+        derived = self._derived(table, params)
+        if pair is None:
+            deletes = self._replaced(table, params)
+            if derived or deletes:
+                self.add_atomic([(table, params)] + derived, deletes=deletes)
+                return
+        self.loader.report.rows += 1 + len(derived)
+        for listener in self.listeners:
+            listener(table, params)
+            for row in derived:
+                listener(*row)
+        if table in RATING_TABLES:
+            self.ratings.add(table, params)
+            return
+        if pair is not None:
+            # The row's derived rows wait with it and go out in the pair's batch
+            self._hold(pair[0], pair[1], [(table, params)] + derived)
+            return
+        self._batch(table, params)
+
+    # The slot a row of an ATOMIC_PAIRS pair waits in, and whether it is the key-table side
+    def _pair(self, table, params):
+        pair = ATOMIC_PAIRS.get(table)
+        if pair is not None:
+            partner, column = pair
+            return (partner, column_value(table, params, column)), True
+        column = ATOMIC_PARTNERS.get(table)
+        if column is not None:
+            return (table, column_value(table, params, column)), False
+        return None
+
+    # Hold one side of a pair until the other arrives, in either order; the pair goes out key-table
+    # rows first. A second row for the same side sends the one already waiting.
+    def _hold(self, slot, is_key, rows):
+        waiting = self._pending_atomic.get(slot)
+        if waiting is not None:
+            if waiting[0] != is_key:
+                del self._pending_atomic[slot]
+                self.add_atomic(rows + waiting[1] if is_key else waiting[1] + rows, counted=True)
+                return
+            self._send_unpaired(slot)
+        self._pending_atomic[slot] = (is_key, rows)
+        if len(self._pending_atomic) > self.max_buffered_rows:
+            self._send_unpaired(next(iter(self._pending_atomic)))
+
+    # Add a row to its partition's UNLOGGED batch
+    def _batch(self, table, params):
+        key = (table, partition_key(table, params))
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = [[], 0]
+        size = estimate_size(params)
+        if group[0] and (len(group[0]) >= self.max_batch_rows or group[1] + size > self.max_batch_bytes):
+            self._flush_group(key)
+            group = self._groups[key] = [[], 0]
+        group[0].append(params)
+        group[1] += size
+        self._buffered += 1
+        if self._buffered >= self.max_buffered_rows:
+            self.flush()
+
+    # Rows derived from a row through the fan-out, less the DEDUPED_TABLES rows already sent
+    def _derived(self, table, params):
+        fanout = self.fanout.get(table)
+        if fanout is None:
+            return []
+        rows = []
+        for row in fanout(params):
+            if row[0] in DEDUPED_TABLES:
+                if row in self._sent_derived:
+                    self._sent_derived.move_to_end(row)
+                    continue
+                self._sent_derived[row] = None
+                if len(self._sent_derived) > self.max_buffered_rows:
+                    self._sent_derived.popitem(last=False)
+            rows.append(row)
+        return rows
+
+    # Deletes of the derived rows a fan-out row replaces (FANOUT_DELETES). A failed read leaves
+    # the old rows for reconcile_locations rather than holding up the write.
+    def _replaced(self, table, params):
+        make = FANOUT_DELETES.get(table)
+        if make is None or table not in self.fanout:
+            return ()
+        deletes = self._deletes.get(table)
+        if deletes is None:
+            deletes = self._deletes[table] = make(self._session)
+        try:
+            return deletes(params)
+        except Exception as e:
+            print(f"Error reading the current {table} row before writing it: {e}")
+            return ()
+
+    # Multi-table rows that must all apply or none: the only place a LOGGED batch is used.
+    # `deletes` are (table, statement, params) for derived rows the new ones replace.
+    def add_atomic(self, rows, counted=False, deletes=()):
+        if not counted:
+            self.loader.report.rows += len(rows)
+            for listener in self.listeners:
+                for table, params in rows:
+                    listener(table, params)
+        batch = BatchStatement(batch_type=BatchType.LOGGED)
+        for _, statement, params in deletes:
+            batch.add(statement, params)
+        for table, params in rows:
+            batch.add(self.loader.statement(table), params)
+        label = "+".join(table for table, _ in rows)
+        partitions = len({(table, partition_key(table, params)) for table, params in rows})
+        self.metrics.record("LOGGED", len(rows), partitions)
+        self.loader.submit(label, batch, rows=len(rows), payload=rows)
+
+    def _flush_group(self, key):
+        table = key[0]
+        rows = self._groups.pop(key)[0]
+        self._buffered -= len(rows)
+        statement = self.loader.statement(table)
+        if len(rows) == 1:
+            self.metrics.record("SINGLE", 1, 1)
+            self.loader.submit(table, statement, rows[0])
+            return
+        batch_type = BatchType.COUNTER if table in COUNTER_UPDATES else BatchType.UNLOGGED
+        batch = BatchStatement(batch_type=batch_type)
+        for params in rows:
+            batch.add(statement, params)
+        self.metrics.record(batch_type.name, len(rows), 1)
+        self.loader.submit(table, batch, rows=len(rows), payload=[(table, params) for params in rows])
+
+    def flush(self):
+        for key in list(self._groups):
+            self._flush_group(key)
+
+    # Flush everything, including an atomic row whose partner never arrived, and wait for completion
+    def close(self):
+        for waiting in list(self._pending_atomic):
+            self._send_unpaired(waiting)
+        self.flush()
+        self.ratings.close()
+
+    def _send_unpaired(self, waiting):
+        rows = self._pending_atomic.pop(waiting)[1]
+        if len(rows) > 1:
+            self.add_atomic(rows, counted=True)
+            return
+        self._batch(*rows[0])
+
+
+# Write a (table, params) row stream through the partition batcher
+def write_batched(session, rows, concurrency=64, max_batch_rows=50, listeners=(), fanout=FANOUT, loader=None,
+                  written_listeners=()):
+    batcher = PartitionBatcher(session, concurrency, max_batch_rows, listeners=listeners, fanout=fanout,
+                               loader=loader, written_listeners=written_listeners)
+    start = time.perf_counter()
+    for table, params in rows:
+        batcher.add(table, params)
+    batcher.close()
+    batcher.report.elapsed = time.perf_counter() - start
+    return batcher.report, batcher.metrics
@@ -0,0 +1,439 @@
+import argparse
+import gc
+import json
+import os
+import pickle
+import platform
+import random
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from cassandra.cluster import EXEC_PROFILE_DEFAULT
+from cassandra.query import named_tuple_factory, tuple_factory
+
+from columnar import columnar_factory
+from datagen import GeneratorConfig, generate_rows, generate_videos, stable_id
+from ingest import AdaptiveLoader
+from loader import BulkLoader, load_rows
+from memsession import MemorySession, killrvideo_session
+from paging import iter_rows
+from scan import ScanReport, scan_table
+
+DEFAULT_BASELINE = os.path.join('bench', 'baseline.json')
+
+# Read patterns demonstrated by query.py, one per access path
+READ_PATTERNS = {
+    'full_scan': ('SELECT * FROM users', lambda ctx: ()),
+    'partition_lookup': ('SELECT firstname, lastname FROM users WHERE userid = ?', lambda ctx: (ctx.user(),)),
+    'collection_projection': ('SELECT tags FROM videos WHERE videoid = ?', lambda ctx: (ctx.video(),)),
+    'clustering_order': ('SELECT name, videoid, added_date FROM user_videos WHERE userid = ? '
+                         'ORDER BY added_date DESC', lambda ctx: (ctx.uploader(),)),
+    'clustering_range': ('SELECT name, videoid, added_date FROM user_videos WHERE userid = ? '
+                         'AND added_date > ? AND added_date < ? ORDER BY added_date ASC',
+                         lambda ctx: (ctx.uploader(),) + ctx.date_range()),
+    'counter_read': ('SELECT rating_counter, rating_total FROM video_rating WHERE videoid = ?',
+                     lambda ctx: (ctx.video(),)),
+    'tag_lookup': ('SELECT videoid, tagged_date FROM videos_by_tag WHERE tag = ?', lambda ctx: (ctx.tag(),)),
+    'dateof_projection': ('SELECT userid, comment, dateOf(commentid) FROM comments_by_video WHERE videoid = ?',
+                          lambda ctx: (ctx.video(),)),
+    'limit_read': ('SELECT dateOf(event_timestamp), event, video_timestamp FROM video_event '
+                   'WHERE videoid = ? AND userid = ? LIMIT 5', lambda ctx: ctx.watch_session()),
+}
+
+
+# Query 1 and Queries 6-8 from query.py, parameterised over the generated dataset
+DECODE_QUERIES = {
+    'query_1': READ_PATTERNS['full_scan'],
+    'query_6': ('SELECT name, videoid, added_date FROM user_videos WHERE userid = ?', lambda ctx: (ctx.uploader(),)),
+    'query_7': READ_PATTERNS['clustering_order'],
+    'query_8': READ_PATTERNS['clustering_range'],
+}
+ROW_FACTORIES = {'named': named_tuple_factory, 'columnar': columnar_factory}
+
+
+# Supplies parameters for each pattern from the seeded synthetic dataset
+class BenchContext:
+    def __init__(self, config, seed=7):
+        self.config = config
+        self.rng = random.Random(seed)
+        self.uploaders = []
+        self.tags = []
+        self.sessions = []
+
+    def observe(self, table, params):
+        if table == 'user_videos' and len(self.uploaders) < 1000:
+            self.uploaders.append(params[0])
+        elif table == 'tags_by_letter' and len(self.tags) < 1000:
+            self.tags.append(params[1])
+        elif table == 'video_event' and len(self.sessions) < 1000:
+            self.sessions.append((params[0], params[1]))
+
+    def user(self):
+        return stable_id(self.config.seed, 'user', self.rng.randrange(self.config.users))
+
+    def video(self):
+        return stable_id(self.config.seed, 'video', self.rng.randrange(self.config.videos))
+
+    def uploader(self):
+        return self.rng.choice(self.uploaders)
+
+    def tag(self):
+        return self.rng.choice(self.tags)
+
+    def watch_session(self):
+        return self.rng.choice(self.sessions)
+
+    def date_range(self):
+        start = self.config.start_date + timedelta(days=self.rng.randrange(self.config.days))
+        return start, start + timedelta(days=90)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, operations=None):
+    values = sorted(latencies)
+    operations = len(values) if operations is None else operations
+    return {
+        'operations': operations,
+        'p50_ms': round(percentile(values, 0.50) * 1000, 4),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 4),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 4),
+        'throughput_ops': round(operations / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+# Time `iterations` synchronous executions of one read pattern
+def bench_read(session, ctx, name, iterations):
+    cql, params_for = READ_PATTERNS[name]
+    statement = session.prepare(cql)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        params = params_for(ctx)
+        t0 = time.perf_counter()
+        session.execute(statement, params).all()
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+# Decode cost of the driver's named tuples versus columnar pages. Each query's raw rows are fetched
+# once and pickled, so every run decodes freshly built values as the driver would off the wire.
+# Throughput is rows through the row factory per second; retained_kb is what the decoded result
+# keeps alive once the raw rows are gone.
+def bench_row_factories(session, ctx, iterations):
+    raw = session.execution_profile_clone_update(EXEC_PROFILE_DEFAULT, row_factory=tuple_factory)
+    results = {}
+    for name, (cql, params_for) in DECODE_QUERIES.items():
+        statement = session.prepare(cql)
+        count = max(1, iterations // 50) if name == 'query_1' else iterations
+        pages = []
+        for _ in range(count):
+            result = session.execute(statement, params_for(ctx), execution_profile=raw)
+            pages.append(pickle.dumps((result.column_names, list(result)), protocol=pickle.HIGHEST_PROTOCOL))
+        rows = sum(len(pickle.loads(page)[1]) for page in pages)
+        for factory_name, factory in ROW_FACTORIES.items():
+            loaded = [pickle.loads(page) for page in pages]
+            start = time.perf_counter()
+            for names, page_rows in loaded:
+                factory(names, page_rows)
+            elapsed = time.perf_counter() - start
+            del loaded
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            decoded = [factory(*pickle.loads(page)) for page in pages]
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            del decoded
+            results[f"{name}.{factory_name}"] = {
+                'operations': rows,
+                'throughput_ops': round(rows / elapsed, 1) if elapsed else 0.0,
+                'retained_kb': round(retained / 1024, 1),
+                'bytes_per_row': round(retained / rows, 1) if rows else 0.0,
+            }
+    return results
+
+
+# Same pattern with `concurrency` requests in flight through execute_async
+def bench_read_concurrent(session, ctx, name, iterations, concurrency):
+    cql, params_for = READ_PATTERNS[name]
+    statement = session.prepare(cql)
+    slots = threading.Semaphore(concurrency)
+    latencies = []
+    lock = threading.Lock()
+
+    def done(_, t0):
+        with lock:
+            latencies.append(time.perf_counter() - t0)
+        slots.release()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        params = params_for(ctx)
+        slots.acquire()
+        t0 = time.perf_counter()
+        future = session.execute_async(statement, params)
+        future.add_callbacks(done, done, callback_args=(t0,), errback_args=(t0,))
+    for _ in range(concurrency):
+        slots.acquire()
+    return summarize(latencies, time.perf_counter() - start)
+
+
+# Write patterns from app1.py: per-row inserts, per-partition batches and counter updates
+def bench_writes(session, config, concurrency):
+    from batcher import write_batched
+    results = {}
+    write_config = GeneratorConfig(seed=config.seed + 1, users=max(1, config.users // 10),
+                                   videos=max(1, config.videos // 10))
+
+    for name, writer in (
+        ('insert_rows', lambda rows: load_rows(session, rows, concurrency)),
+        ('insert_batched', lambda rows: write_batched(session, rows, concurrency)[0]),
+    ):
+        start = time.perf_counter()
+        report = writer(generate_rows(write_config))
+        elapsed = time.perf_counter() - start
+        results[name] = {'operations': report.rows, 'errors': report.failed,
+                         'throughput_ops': round(report.rows / elapsed, 1) if elapsed else 0.0}
+
+    loader = BulkLoader(session, 1)
+    statement = loader.statement('video_rating')
+    latencies = []
+    rng = random.Random(config.seed)
+    start = time.perf_counter()
+    for _ in range(1000):
+        videoid = stable_id(config.seed, 'video', rng.randrange(config.videos))
+        t0 = time.perf_counter()
+        session.execute(statement, (1, rng.randint(1, 5), videoid))
+        latencies.append(time.perf_counter() - t0)
+    results['counter_update'] = summarize(latencies, time.perf_counter() - start)
+    return results
+
+
+# Session whose videos_by_location is the materialized view (`view`) or the app-maintained table
+def _location_session(view, latency, jitter):
+    from app1 import cql_statements, location_table_statements, location_view_statements
+    session = MemorySession()
+    both = location_table_statements + location_view_statements
+    for statement in [s for s in cql_statements if s not in both] + \
+            (location_view_statements if view else location_table_statements):
+        session.execute(statement)
+    session.latency, session.jitter = latency, jitter
+    return session
+
+
+# Write throughput of videos_by_location maintained by the server's view versus the batcher's
+# fan-out: inserting new videos, then moving a tenth of them to a new location
+def bench_locations(config, latency, jitter, concurrency):
+    from batcher import FANOUT, write_batched
+    from locations import SET_LOCATION, VideoLocations, reconcile_locations
+    rows = [(table, params) for table, params in generate_videos(config) if table == 'videos']
+    moves = rows[::10]
+    results = {}
+    for name, view in (('view', True), ('app', False)):
+        session = _location_session(view, latency, jitter)
+        fanout = {table: f for table, f in FANOUT.items() if not (view and table == 'videos')}
+        start = time.perf_counter()
+        report, _ = write_batched(session, rows, concurrency, fanout=fanout)
+        elapsed = time.perf_counter() - start
+        results[f"{name}_insert"] = {'operations': len(rows), 'errors': report.failed,
+                                     'throughput_ops': round(len(rows) / elapsed, 1) if elapsed else 0.0}
+
+        latencies = []
+        locations = VideoLocations(session)
+        update = session.prepare(SET_LOCATION)
+        start = time.perf_counter()
+        for _, params in moves:
+            t0 = time.perf_counter()
+            if view:
+                session.execute(update, (f"/eu{params[4]}", params[0]))
+            else:
+                locations.move(params[0], f"/eu{params[4]}")
+            latencies.append(time.perf_counter() - t0)
+        results[f"{name}_move"] = summarize(latencies, time.perf_counter() - start)
+
+        session.latency = session.jitter = 0.0
+        check = reconcile_locations(session)
+        results[f"{name}_insert"]['drift'] = check.drift
+        session.shutdown()
+    return results
+
+
+# Query 1 as one paged query walking the ring against a token-range scan with `concurrency` ranges
+# in flight. Every page pays the request latency, so some is always injected here. The in-memory
+# store has no token index and checks every key per range, so the ring is cut into no more ranges
+# than there are readers.
+def bench_scan(session, latency, jitter, concurrency, fetch_size=100):
+    saved = session.latency, session.jitter
+    session.latency, session.jitter = max(latency, 0.001), jitter
+    results = {}
+    try:
+        start = time.perf_counter()
+        rows = sum(1 for _ in iter_rows(session, READ_PATTERNS['full_scan'][0], fetch_size=fetch_size))
+        elapsed = time.perf_counter() - start
+        results['paged'] = {'operations': rows, 'elapsed_ms': round(elapsed * 1000, 1),
+                            'throughput_ops': round(rows / elapsed, 1) if elapsed else 0.0}
+        report = ScanReport()
+        rows = sum(1 for _ in scan_table(session, 'users', splits=concurrency, concurrency=concurrency,
+                                         fetch_size=fetch_size, report=report))
+        results['parallel'] = {'operations': rows, 'elapsed_ms': round(report.elapsed * 1000, 1),
+                               'throughput_ops': round(rows / report.elapsed, 1) if report.elapsed else 0.0,
+                               'retries': report.retries}
+    finally:
+        session.latency, session.jitter = saved
+    return results
+
+
+# Loading into a node that sheds requests beyond `concurrency` in flight, from a client allowed four
+# times that: a fixed window turns the excess into errors, the adaptive one backs off and retries.
+# Shedding needs requests to overlap, so some latency is always injected here.
+def bench_backpressure(config, latency, jitter, concurrency):
+    rows = list(generate_videos(config))
+    results = {}
+    for name, loader_class in (('fixed', BulkLoader), ('adaptive', AdaptiveLoader)):
+        session = killrvideo_session(max(latency, 0.001), jitter, load_demo_rows=False)
+        session.capacity = concurrency
+        report = loader_class(session, concurrency * 4).load(rows)
+        results[name] = {'operations': report.rows, 'errors': report.failed,
+                         'retries': getattr(report, 'retries', 0), 'shed': session.shed,
+                         'throughput_ops': round((report.rows - report.failed) / report.elapsed, 1)
+                         if report.elapsed else 0.0}
+        session.shutdown()
+    return results
+
+
+def run_suite(users=200, videos=1000, iterations=500, latency=0.0, jitter=0.0, concurrency=32, patterns=None):
+    config = GeneratorConfig(users=users, videos=videos)
+    ctx = BenchContext(config)
+    session = killrvideo_session(load_demo_rows=False)
+
+    def observed():
+        for table, params in generate_rows(config):
+            ctx.observe(table, params)
+            yield table, params
+
+    load_rows(session, observed())
+    session.latency, session.jitter = latency, jitter
+
+    results = {}
+    for name in patterns or READ_PATTERNS:
+        # Full scans are orders of magnitude heavier than point reads; sample them less
+        count = max(1, iterations // 50) if name == 'full_scan' else iterations
+        results[f"read.{name}"] = bench_read(session, ctx, name, count)
+        results[f"read.{name}.concurrent"] = bench_read_concurrent(session, ctx, name, count, concurrency)
+    for name, summary in bench_scan(session, latency, jitter, concurrency).items():
+        results[f"scan.users.{name}"] = summary
+    for name, summary in bench_row_factories(session, ctx, iterations).items():
+        results[f"decode.{name}"] = summary
+    for name, summary in bench_writes(session, config, concurrency).items():
+        results[f"write.{name}"] = summary
+    for name, summary in bench_locations(config, latency, jitter, concurrency).items():
+        results[f"write.location_{name}"] = summary
+    for name, summary in bench_backpressure(config, latency, jitter, concurrency).items():
+        results[f"write.backpressure_{name}"] = summary
+    session.shutdown()
+
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'users': users, 'videos': videos, 'iterations': iterations,
+            'latency_ms': latency * 1000, 'jitter': jitter, 'concurrency': concurrency,
+        },
+        'results': results,
+    }
+
+
+# Run parameters that change what the numbers mean; runs that differ in any of them are not comparable
+COMPARABLE_META = ('users', 'videos', 'iterations', 'latency_ms', 'jitter', 'concurrency')
+
+
+# "name: baseline -> current" for each comparable parameter the two runs disagree on
+def meta_mismatches(baseline, current):
+    before, now = baseline.get('meta', {}), current['meta']
+    return [f"{key}: {before.get(key)} -> {now.get(key)}" for key in COMPARABLE_META if before.get(key) != now.get(key)]
+
+
+# Percent change of every metric against a saved baseline; positive is slower for latencies
+def compare(baseline, current, threshold=0.10):
+    regressions = []
+    lines = []
+    for name, metrics in sorted(current['results'].items()):
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            lines.append(f"  {name}: new")
+            continue
+        for metric, value in sorted(metrics.items()):
+            old = before.get(metric)
+            if not isinstance(old, (int, float)) or not old or metric in ('operations', 'errors', 'drift', 'retries', 'shed'):
+                continue
+            change = (value - old) / old
+            lower_is_better = metric.endswith(('_ms', '_kb')) or metric == 'bytes_per_row'
+            worse = change > threshold if lower_is_better else change < -threshold
+            marker = ' REGRESSION' if worse else ''
+            lines.append(f"  {name}.{metric}: {old} -> {value} ({change:+.1%}){marker}")
+            if worse:
+                regressions.append(f"{name}.{metric}")
+    return lines, regressions
+
+
+def print_results(report):
+    print(f"{'pattern':40} {'ops':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/sec':>11}")
+    for name, metrics in report['results'].items():
+        print(f"{name:40} {metrics['operations']:>7} {metrics.get('p50_ms', ''):>9} "
+              f"{metrics.get('p95_ms', ''):>9} {metrics.get('p99_ms', ''):>9} {metrics['throughput_ops']:>11}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark killrvideo access patterns against the in-memory session")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--videos', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="injected per-request latency")
+    parser.add_argument('--jitter', type=float, default=0.0, help="latency jitter as a fraction, e.g. 0.2")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--pattern', action='append', choices=sorted(READ_PATTERNS))
+    parser.add_argument('--save', metavar='PATH', nargs='?', const=DEFAULT_BASELINE,
+                        help=f"write results as a JSON baseline (default {DEFAULT_BASELINE})")
+    parser.add_argument('--compare', metavar='PATH', nargs='?', const=DEFAULT_BASELINE,
+                        help=f"diff results against a JSON baseline (default {DEFAULT_BASELINE})")
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.users, args.videos, args.iterations, args.latency_ms / 1000, args.jitter,
+                       args.concurrency, args.pattern)
+    print_results(report)
+
+    status = 0
+    if args.compare and os.path.exists(args.compare):
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        mismatches = meta_mismatches(baseline, report)
+        if mismatches:
+            print(f"\nNot comparing with {args.compare}: it was run with different parameters ({', '.join(mismatches)})")
+            status = 1
+        else:
+            lines, regressions = compare(baseline, report, args.threshold)
+            print(f"\nCompared with {args.compare}:")
+            print("\n".join(lines))
+            if regressions:
+                print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+                status = 1
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,201 @@
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from cassandra.util import datetime_from_uuid1
+
+from loader import INSERT_COLUMNS
+
+# Optional time-bucketed layout for the two unbounded time series. A bucket ('2013-05-02' for day,
+# '2013-05-02T13' for hour) joins the partition key, so a viral video spreads over one partition per
+# bucket instead of growing a single partition forever. Writes are routed with route_rows, and each
+# bucketed row is written with a row in its table's bucket index (batcher.FANOUT), so reads fan out
+# over the buckets that hold rows rather than every bucket in a time range, and stop once a LIMIT
+# is satisfied.
+
+GRANULARITIES = {
+    'day': (timedelta(days=1), '%Y-%m-%d'),
+    'hour': (timedelta(hours=1), '%Y-%m-%dT%H'),
+}
+
+# LIMIT bound when the caller asked for everything in the range
+_NO_LIMIT = 2 ** 31 - 1
+
+# source: the unbucketed table; key: partition key without the bucket; time: the timeuuid column;
+# index: the table listing, per key, the buckets that hold rows
+BucketedTable = namedtuple('BucketedTable', 'name source key time index')
+
+BUCKETED_TABLES = {
+    'comments_by_video': BucketedTable('comments_by_video_bucketed', 'comments_by_video', ('videoid',), 'commentid',
+                                       'comments_by_video_buckets'),
+    'video_event': BucketedTable('video_event_bucketed', 'video_event', ('videoid', 'userid'), 'event_timestamp',
+                                 'video_event_buckets'),
+}
+
+# Same columns and clustering as the source tables, with the bucket added to the partition key
+BUCKETED_CQL = [
+    "CREATE TABLE comments_by_video_bucketed ("
+    "   videoid uuid,"
+    "   bucket text,"
+    "   commentid timeuuid,"
+    "   userid uuid,"
+    "   comment text,"
+    "   PRIMARY KEY ((videoid, bucket), commentid)"
+    ") WITH CLUSTERING ORDER BY (commentid DESC);",
+
+    "CREATE TABLE video_event_bucketed ("
+    "   videoid uuid,"
+    "   userid uuid,"
+    "   bucket text,"
+    "   preview_image_location text static,"
+    "   event varchar,"
+    "   event_timestamp timeuuid,"
+    "   video_timestamp bigint,"
+    "   PRIMARY KEY ((videoid, userid, bucket), event_timestamp, event)"
+    ") WITH CLUSTERING ORDER BY (event_timestamp DESC, event ASC);",
+
+    # Bucket labels sort in time order, so each index partition lists its buckets newest first
+    "CREATE TABLE comments_by_video_buckets ("
+    "   videoid uuid,"
+    "   bucket text,"
+    "   PRIMARY KEY (videoid, bucket)"
+    ") WITH CLUSTERING ORDER BY (bucket DESC);",
+
+    "CREATE TABLE video_event_buckets ("
+    "   videoid uuid,"
+    "   userid uuid,"
+    "   bucket text,"
+    "   PRIMARY KEY ((videoid, userid), bucket)"
+    ") WITH CLUSTERING ORDER BY (bucket DESC);",
+]
+
+
+def _granularity(granularity):
+    try:
+        return GRANULARITIES[granularity]
+    except KeyError:
+        raise ValueError(f"Unknown bucket granularity {granularity!r}; use one of {sorted(GRANULARITIES)}")
+
+
+# Bucket label for a datetime or a timeuuid
+def bucket_for(moment, granularity='day'):
+    if not isinstance(moment, datetime):
+        moment = datetime_from_uuid1(moment)
+    return moment.strftime(_granularity(granularity)[1])
+
+
+# Bucket labels covering [start, end], newest first to match the DESC clustering order
+def bucket_range(start, end, granularity='day'):
+    step, fmt = _granularity(granularity)
+    if granularity == 'day':
+        moment = datetime(end.year, end.month, end.day)
+    else:
+        moment = datetime(end.year, end.month, end.day, end.hour)
+    labels = []
+    while moment + step > start:
+        labels.append(moment.strftime(fmt))
+        moment -= step
+    return labels
+
+
+# Start of the bucket with a label
+def bucket_start(label, granularity='day'):
+    return datetime.strptime(label, _granularity(granularity)[1])
+
+
+# Function of a bucketed row's params giving its bucket index row, for batcher.FANOUT. Every row
+# in a bucket gives the same index row; the batcher sends each one once.
+def index_rows(bucketed):
+    columns = INSERT_COLUMNS[bucketed.name]
+    positions = [columns.index(column) for column in bucketed.key + ('bucket',)]
+
+    def rows(params):
+        return [(bucketed.index, tuple(params[i] for i in positions))]
+    return rows
+
+
+BUCKET_INDEX_FANOUT = {bucketed.name: index_rows(bucketed) for bucketed in BUCKETED_TABLES.values()}
+BUCKET_INDEX_TABLES = {bucketed.index for bucketed in BUCKETED_TABLES.values()}
+
+
+# Rewrite (table, params) rows for the source tables into their bucketed tables; the bucket is
+# appended to the params, matching loader.INSERT_COLUMNS for the bucketed tables
+def route_rows(rows, granularity='day'):
+    for table, params in rows:
+        bucketed = BUCKETED_TABLES.get(table)
+        if bucketed is None:
+            yield table, params
+            continue
+        moment = params[INSERT_COLUMNS[table].index(bucketed.time)]
+        yield bucketed.name, tuple(params) + (bucket_for(moment, granularity),)
+
+
+class BucketedReader:
+    def __init__(self, session, granularity='day', concurrency=8):
+        self.session = session
+        self.granularity = granularity
+        self.concurrency = concurrency
+        self._statements = {}
+
+    def _statement(self, bucketed, columns):
+        key = (bucketed.name, columns)
+        statement = self._statements.get(key)
+        if statement is None:
+            where = " AND ".join(f"{column} = ?" for column in bucketed.key + ('bucket',))
+            statement = self._statements[key] = self.session.prepare(
+                f"SELECT {columns} FROM {bucketed.name} WHERE {where} "
+                f"AND {bucketed.time} >= minTimeuuid(?) AND {bucketed.time} <= maxTimeuuid(?) LIMIT ?")
+        return statement
+
+    def _index_statement(self, bucketed):
+        statement = self._statements.get(bucketed.index)
+        if statement is None:
+            where = " AND ".join(f"{column} = ?" for column in bucketed.key)
+            statement = self._statements[bucketed.index] = self.session.prepare(
+                f"SELECT bucket FROM {bucketed.index} WHERE {where} AND bucket >= ? AND bucket <= ?")
+        return statement
+
+    # Labels of the buckets holding rows for `key` between start and end (no start: all of them),
+    # newest first, from the bucket index
+    def buckets(self, bucketed, key, start=None, end=None, consistency_level=None):
+        first = bucket_for(start, self.granularity) if start is not None else ''
+        bound = self._index_statement(bucketed).bind(tuple(key) + (first, bucket_for(end, self.granularity)))
+        if consistency_level is not None:
+            bound.consistency_level = consistency_level
+        return [row.bucket for row in self.session.execute(bound)]
+
+    # Rows of one logical partition between start and end, newest first. The buckets that hold
+    # rows are read `concurrency` at a time walking back from `end`; buckets cover disjoint time
+    # ranges, so appending them newest bucket first is already clustering order. Older buckets are
+    # not read once `limit` rows are in hand.
+    def read(self, source, key, start=None, end=None, limit=None, columns='*', consistency_level=None):
+        bucketed = BUCKETED_TABLES[source]
+        end = end or datetime.now(timezone.utc).replace(tzinfo=None)
+        labels = self.buckets(bucketed, key, start, end, consistency_level)
+        if not labels:
+            return []
+        start = start or bucket_start(labels[-1], self.granularity)
+        statement = self._statement(bucketed, columns)
+        rows = []
+        for i in range(0, len(labels), self.concurrency):
+            wanted = _NO_LIMIT if limit is None else limit - len(rows)
+            futures = []
+            for label in labels[i:i + self.concurrency]:
+                bound = statement.bind(tuple(key) + (label, start, end, wanted))
+                if consistency_level is not None:
+                    bound.consistency_level = consistency_level
+                futures.append(self.session.execute_async(bound))
+            for future in futures:
+                rows.extend(future.result())
+            if limit is not None and len(rows) >= limit:
+                return rows[:limit]
+        return rows
+
+    # Query 11 against the bucketed layout
+    def comments_for_video(self, videoid, start=None, end=None, limit=None):
+        return self.read('comments_by_video', (videoid,), start, end, limit,
+                         'userid, comment, dateOf(commentid)')
+
+    # Query 12 against the bucketed layout
+    def events_for_session(self, videoid, userid, start=None, end=None, limit=None):
+        return self.read('video_event', (videoid, userid), start, end, limit,
+                         'dateOf(event_timestamp), event, video_timestamp')
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import OrderedDict
+
+from loader import partition_key
+
+# Seconds a cached row stays fresh, per table. Counters change most often, so they expire first.
+DEFAULT_TTLS = {
+    "users": 300.0,
+    "videos": 300.0,
+    "video_rating": 10.0,
+}
+DEFAULT_NEGATIVE_TTL = 30.0
+
+# Marks a key that was looked up and does not exist
+_MISSING = object()
+
+LOOKUPS = {
+    "users": "SELECT * FROM users WHERE userid = ?",
+    "videos": "SELECT * FROM videos WHERE videoid = ?",
+    "video_rating": "SELECT rating_counter, rating_total FROM video_rating WHERE videoid = ?",
+}
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+# Bounded LRU map whose entries also expire after a per-entry TTL
+class LRUTTLCache:
+    def __init__(self, maxsize=10000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Returns (found, value); an expired entry counts as a miss
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return False, None
+            value, expires = entry
+            if expires <= self.clock():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if value is _MISSING:
+                self.stats.negative_hits += 1
+            else:
+                self.stats.hits += 1
+            return True, value
+
+    def put(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, self.clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Read-through cache over the hot single-partition lookups (Queries 2-5 through
+# query.QueryRegistry, and 9). Keys are (table, partition key); writes invalidate through on_write.
+class CachedReader:
+    def __init__(self, session, maxsize=10000, ttls=None, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 clock=time.monotonic):
+        self.session = session
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.negative_ttl = negative_ttl
+        self.cache = LRUTTLCache(maxsize, clock)
+        self._statements = {}
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+    def _lookup(self, table, key):
+        cache_key = (table, key)
+        found, value = self.cache.get(cache_key)
+        if found:
+            return None if value is _MISSING else value
+
+        statement = self._statements.get(table)
+        if statement is None:
+            statement = self._statements[table] = self.session.prepare(LOOKUPS[table])
+        row = self.session.execute(statement, key).one()
+        if row is None:
+            self.cache.put(cache_key, _MISSING, self.negative_ttl)
+        else:
+            self.cache.put(cache_key, row, self.ttls[table])
+        return row
+
+    # The row of `table` (a key of LOOKUPS) with partition key `key`, or None
+    def get(self, table, key):
+        return self._lookup(table, tuple(key))
+
+    def get_user(self, userid):
+        return self._lookup("users", (userid,))
+
+    def get_video(self, videoid):
+        return self._lookup("videos", (videoid,))
+
+    def get_video_rating(self, videoid):
+        return self._lookup("video_rating", (videoid,))
+
+    def invalidate(self, table, key):
+        self.cache.invalidate((table, tuple(key)))
+
+    # Write-path hooks for app1.execute_cql_insert_statements: pass on_write as a listener and
+    # on_written as a written listener. A row can sit in a batch, or a counter increment in a rating
+    # flush, for a while after it is handed over; a read in that window would cache the old value for
+    # a whole TTL, so the entry is dropped again once the write has been applied.
+    def on_write(self, table, params):
+        if table in LOOKUPS:
+            self.invalidate(table, partition_key(table, params))
+
+    def on_written(self, table, params):
+        self.on_write(table, params)
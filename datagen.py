@@ -0,0 +1,248 @@
+import argparse
+import gzip
+import json
+import os
+import random
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from cassandra.util import uuid_from_time
+
+from loader import INSERT_COLUMNS, COUNTER_UPDATES
+
+# Namespace for deriving stable ids from (seed, kind, index) without keeping them in memory
+DATAGEN_NAMESPACE = uuid.UUID('6b1c4f0e-3d1a-4f5e-9a57-2f6f2d1c9e10')
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'te', 'su', 'no', 'vi', 'da', 'ze', 'po', 'ly', 'qu', 'fe', 'gi', 'ho']
+FIRSTNAMES = ['Ted', 'Chris', 'Patrick', 'Ada', 'Grace', 'Edsger', 'Barbara', 'Donald', 'Leslie', 'Jim']
+LASTNAMES = ['Codd', 'Date', 'McFadin', 'Lovelace', 'Hopper', 'Dijkstra', 'Liskov', 'Knuth', 'Lamport', 'Gray']
+
+
+@dataclass
+class GeneratorConfig:
+    seed: int = 42
+    users: int = 1000
+    videos: int = 5000
+    tags: int = 2000
+    tags_per_video: int = 4
+    comments_per_video: int = 3
+    ratings_per_video: int = 5
+    sessions_per_video: int = 2
+    # Zipf exponents: 0 is uniform, larger values concentrate on the first ranks
+    tag_skew: float = 1.1
+    uploader_skew: float = 1.2
+    start_date: datetime = datetime(2012, 1, 1)
+    days: int = 730
+
+
+# Draw a 0-based rank in [0, n) from an approximate Zipf(s) distribution in O(1) memory
+# by inverting the continuous power-law CDF.
+def zipf_rank(rng, n, s):
+    if n <= 1:
+        return 0
+    u = rng.random()
+    if s <= 0:
+        return int(u * n)
+    if abs(s - 1.0) < 1e-9:
+        rank = n ** u
+    else:
+        a = 1.0 - s
+        rank = ((n ** a - 1.0) * u + 1.0) ** (1.0 / a)
+    return min(int(rank) - 1, n - 1) if rank >= 1 else 0
+
+
+def stable_id(seed, kind, index):
+    return uuid.uuid5(DATAGEN_NAMESPACE, f"{seed}:{kind}:{index}")
+
+
+def entity_rng(seed, kind, index):
+    return random.Random(f"{seed}:{kind}:{index}")
+
+
+def tag_name(index):
+    # Base-16 syllable spelling: every index maps to a distinct pronounceable tag
+    word = ''
+    while True:
+        word = SYLLABLES[index % len(SYLLABLES)] + word
+        index //= len(SYLLABLES)
+        if index == 0:
+            return word
+
+
+def _timeuuid(when, rng):
+    return uuid_from_time(when, node=rng.getrandbits(48), clock_seq=rng.getrandbits(14))
+
+
+def generate_users(config, start=0, stop=None):
+    stop = config.users if stop is None else stop
+    for i in range(start, stop):
+        rng = entity_rng(config.seed, 'user', i)
+        userid = stable_id(config.seed, 'user', i)
+        firstname = rng.choice(FIRSTNAMES)
+        lastname = rng.choice(LASTNAMES)
+        email = f"{firstname.lower()}.{lastname.lower()}{i}@example.com"
+        created = config.start_date + timedelta(seconds=rng.randrange(config.days * 86400))
+        yield ('user_credentials', (email, f"{rng.getrandbits(128):032x}", userid))
+        yield ('users', (userid, firstname, lastname, email, created))
+
+
+# Emit one video with its denormalised copies, plus the comments, ratings and watch events that hang off it.
+# `seen_tags` tracks which tags already have a tags_by_letter row; it is bounded by the tag vocabulary.
+def generate_video(config, i, seen_tags=None):
+    rng = entity_rng(config.seed, 'video', i)
+    videoid = stable_id(config.seed, 'video', i)
+    uploader = stable_id(config.seed, 'user', zipf_rank(rng, config.users, config.uploader_skew))
+    added = config.start_date + timedelta(seconds=rng.randrange(config.days * 86400))
+    tags = set()
+    while len(tags) < min(config.tags_per_video, config.tags):
+        tags.add(tag_name(zipf_rank(rng, config.tags, config.tag_skew)))
+    name = ' '.join(sorted(tags)).capitalize() + f" #{i}"
+    location = f"/us/vid/{videoid.hex[:2]}/{videoid}"
+    metadata = [(480, 640, frozenset({'1000kbs', '400kbs'}), 'MP4')]
+
+    yield ('videos', (videoid, uploader, name, f"Generated video {i}", location, 1,
+                      {'10': location}, tags, metadata, added))
+    yield ('user_videos', (uploader, added, videoid, name, location))
+    yield ('latest_videos', (added.strftime('%Y-%m-%d'), added, videoid, name, location))
+    for tag in sorted(tags):
+        yield ('videos_by_tag', (tag, videoid, added, name, location, added))
+        if seen_tags is None or tag not in seen_tags:
+            if seen_tags is not None:
+                seen_tags.add(tag)
+            yield ('tags_by_letter', (tag[0], tag))
+
+    for _ in range(config.comments_per_video):
+        commenter = stable_id(config.seed, 'user', rng.randrange(config.users))
+        commentid = _timeuuid(added + timedelta(seconds=rng.randrange(30 * 86400)), rng)
+        comment = f"Comment on {name}"
+        yield ('comments_by_video', (videoid, commentid, commenter, comment))
+        yield ('comments_by_user', (commenter, commentid, videoid, comment))
+
+    for _ in range(config.ratings_per_video):
+        rater = stable_id(config.seed, 'user', rng.randrange(config.users))
+        rating = rng.randint(1, 5)
+        yield ('video_rating', (1, rating, videoid))
+        yield ('video_ratings_by_user', (videoid, rater, rating))
+
+    for _ in range(config.sessions_per_video):
+        viewer = stable_id(config.seed, 'user', rng.randrange(config.users))
+        started = added + timedelta(seconds=rng.randrange(30 * 86400))
+        position = rng.randrange(0, 60000)
+        watched = rng.randrange(1000, 600000)
+        yield ('video_event', (videoid, viewer, _timeuuid(started, rng), 'start', position))
+        yield ('video_event', (videoid, viewer, _timeuuid(started + timedelta(milliseconds=watched), rng),
+                               'stop', position + watched))
+
+
+def generate_videos(config, start=0, stop=None):
+    stop = config.videos if stop is None else stop
+    seen_tags = set()
+    for i in range(start, stop):
+        yield from generate_video(config, i, seen_tags)
+
+
+# Full dataset as a lazy stream of (table, params) rows, ready for app1.execute_cql_insert_statements
+def generate_rows(config):
+    yield from generate_users(config)
+    yield from generate_videos(config)
+
+
+# Tagged JSON so uuids, timestamps, sets and UDT tuples survive the round trip to disk
+def encode_value(value):
+    if isinstance(value, uuid.UUID):
+        return {'$uuid': str(value)}
+    if isinstance(value, datetime):
+        return {'$ts': value.isoformat()}
+    if isinstance(value, (set, frozenset)):
+        return {'$set': [encode_value(v) for v in sorted(value, key=repr)]}
+    if isinstance(value, tuple):
+        return {'$tuple': [encode_value(v) for v in value]}
+    if isinstance(value, list):
+        return [encode_value(v) for v in value]
+    if isinstance(value, dict):
+        return {'$map': [[encode_value(k), encode_value(v)] for k, v in value.items()]}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if isinstance(value, dict):
+        if '$uuid' in value:
+            return uuid.UUID(value['$uuid'])
+        if '$ts' in value:
+            return datetime.fromisoformat(value['$ts'])
+        if '$set' in value:
+            return frozenset(decode_value(v) for v in value['$set'])
+        if '$tuple' in value:
+            return tuple(decode_value(v) for v in value['$tuple'])
+        if '$map' in value:
+            return {decode_value(k): decode_value(v) for k, v in value['$map']}
+    return value
+
+
+# Stream rows into one gzip-compressed JSON-lines file per table
+def write_rows(rows, directory, compresslevel=6):
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    counts = {}
+    try:
+        for table, params in rows:
+            out = files.get(table)
+            if out is None:
+                path = os.path.join(directory, f"{table}.jsonl.gz")
+                out = files[table] = gzip.open(path, 'wt', encoding='utf-8', compresslevel=compresslevel)
+                counts[table] = 0
+            out.write(json.dumps(encode_value(list(params)), separators=(',', ':')))
+            out.write('\n')
+            counts[table] += 1
+    finally:
+        for out in files.values():
+            out.close()
+    return counts
+
+
+# Stream rows back from a directory written by write_rows
+def read_rows(directory):
+    for table in list(INSERT_COLUMNS) + list(COUNTER_UPDATES):
+        path = os.path.join(directory, f"{table}.jsonl.gz")
+        if not os.path.exists(path):
+            continue
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield (table, tuple(decode_value(json.loads(line))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic killrvideo dataset")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--videos', type=int, default=5000)
+    parser.add_argument('--tags', type=int, default=2000)
+    parser.add_argument('--tag-skew', type=float, default=1.1)
+    parser.add_argument('--uploader-skew', type=float, default=1.2)
+    parser.add_argument('--out', help="write gzip JSON-lines files here instead of loading into Cassandra")
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    config = GeneratorConfig(seed=args.seed, users=args.users, videos=args.videos, tags=args.tags,
+                             tag_skew=args.tag_skew, uploader_skew=args.uploader_skew)
+    if args.out:
+        counts = write_rows(generate_rows(config), args.out)
+        for table, count in sorted(counts.items()):
+            print(f"{table}: {count} rows")
+        return
+
+    # Through the batcher's fan-out, so users and videos get their users_by_* and videos_by_location
+    # rows like any other write and the consistency checkers see no drift
+    from app1 import create_cassandra_connection, execute_cql_insert_statements
+    session = create_cassandra_connection()
+    if session:
+        session.set_keyspace('killrvideo')
+        execute_cql_insert_statements(session, generate_rows(config), args.concurrency)
+        session.shutdown()
+
+
+if __name__ == "__main__":
+    main()
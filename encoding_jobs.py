@@ -0,0 +1,344 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from buckets import bucket_for, bucket_range
+from loader import INSERT_COLUMNS
+
+# Consumer for encoding_job_notifications. Each job keeps a high-water mark (the newest status_date
+# it has applied, plus the etags seen at that instant), and a poll only reads rows at or after it with
+# a clustering-range predicate, so the cost of a poll follows the number of active jobs and new
+# notifications rather than the history. Jobs in a terminal state are no longer polled, and are
+# dropped once they have been terminal for a grace period. Marks and states are checkpointed to a
+# local JSON file so a restart picks up where the last run stopped.
+#
+# A job is followed from the moment its upload row is written when the writer runs on_written, and
+# otherwise from the next discovery, which reads uploaded_jobs_by_day for the days since the last
+# one rather than every job ever uploaded.
+
+# Job states as reported by the encoding service, and the moves allowed between them. Notifications
+# can skip states (a missed poll, a fast job), so any forward move is accepted.
+TRANSITIONS = {
+    None: {'Queued', 'Scheduled', 'Processing', 'Finished', 'Error', 'Canceling', 'Canceled'},
+    'Queued': {'Scheduled', 'Processing', 'Finished', 'Error', 'Canceling', 'Canceled'},
+    'Scheduled': {'Processing', 'Finished', 'Error', 'Canceling', 'Canceled'},
+    'Processing': {'Finished', 'Error', 'Canceling', 'Canceled'},
+    'Canceling': {'Canceled', 'Error'},
+}
+TERMINAL_STATES = {'Finished', 'Error', 'Canceled'}
+
+NEW_NOTIFICATIONS = ("SELECT status_date, etag, newstate, oldstate FROM encoding_job_notifications "
+                     "WHERE jobid = ? AND status_date >= ?")
+ALL_NOTIFICATIONS = "SELECT status_date, etag, newstate, oldstate FROM encoding_job_notifications WHERE jobid = ?"
+JOBS_ADDED = "SELECT added_date, jobid FROM uploaded_jobs_by_day WHERE added_day = ? AND added_date >= ?"
+
+CHECKPOINT_VERSION = 1
+
+
+# uploaded_jobs_by_day row for an uploaded_videos_by_jobid row, in the column order of
+# loader.INSERT_COLUMNS (see batcher.FANOUT). An upload without a date gets none.
+def upload_rows(params):
+    values = dict(zip(INSERT_COLUMNS['uploaded_videos_by_jobid'], params))
+    if values['jobid'] is None or values['added_date'] is None:
+        return []
+    return [('uploaded_jobs_by_day', (bucket_for(values['added_date'], 'day'), values['added_date'], values['jobid']))]
+
+
+class Job:
+    def __init__(self, jobid, state=None, status_date=None, etags=(), done_at=None):
+        self.jobid = jobid
+        self.state = state
+        # High-water mark: the newest status_date applied and the etags already seen at that instant
+        self.status_date = status_date
+        self.etags = set(etags)
+        # Wall-clock time (time.time()) the job reached a terminal state, for pruning
+        self.done_at = done_at
+
+    @property
+    def done(self):
+        return self.state in TERMINAL_STATES
+
+    def to_json(self):
+        return {'state': self.state, 'etags': sorted(self.etags), 'done_at': self.done_at,
+                'status_date': self.status_date.isoformat() if self.status_date else None}
+
+    @classmethod
+    def from_json(cls, jobid, data):
+        status_date = datetime.fromisoformat(data['status_date']) if data.get('status_date') else None
+        job = cls(jobid, data.get('state'), status_date, data.get('etags', ()), data.get('done_at'))
+        # Terminal jobs from a checkpoint written before done_at was kept start their grace period now
+        if job.done and job.done_at is None:
+            job.done_at = time.time()
+        return job
+
+
+class PollReport:
+    def __init__(self):
+        self.jobs = 0
+        self.notifications = 0
+        self.transitions = Counter()
+        self.rejected = 0
+        self.errors = 0
+        self.discovered = 0
+        self.pruned = 0
+        self.elapsed = 0.0
+
+    def summary(self):
+        moves = ", ".join(f"{n} {old or 'new'}->{new}" for (old, new), n in sorted(
+            self.transitions.items(), key=lambda item: (item[0][0] or '', item[0][1])))
+        return (f"Polled {self.jobs} jobs in {self.elapsed:.2f}s: {self.notifications} new notifications, "
+                f"{self.discovered} jobs discovered, {self.pruned} pruned, {self.rejected} rejected, "
+                f"{self.errors} errors"
+                + (f"; {moves}" if moves else ""))
+
+
+# Polls active jobs `batch_size` at a time on `workers` threads. Notifications are applied to the
+# state machine on the polling thread in status_date order, so listeners never run concurrently.
+# The upload path should register() each new job; discovery is the fallback for jobs it missed.
+class JobNotificationConsumer:
+    def __init__(self, session, checkpoint_path=None, workers=4, batch_size=64, interval=5.0,
+                 discover_every=12, listeners=(), retain=3600.0, discover_days=7):
+        self.session = session
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.interval = interval
+        # Look in uploaded_jobs_by_day for jobs nobody registered every this many polls; 0 never
+        self.discover_every = discover_every
+        # Days back the first discovery (with no cursor yet) looks
+        self.discover_days = discover_days
+        # Seconds a terminal job is kept (and answers state()) before it is dropped
+        self.retain = retain
+        # Called with (job, old_state, new_state, status_date) after each accepted transition
+        self.listeners = list(listeners)
+        self.jobs = {}
+        # Discovery cursor: the newest added_date registered and the jobs added at that instant
+        self.discovered_through = None
+        self.discovered_at = set()
+        self.last_report = None
+        self.polls = 0
+        self._new = session.prepare(NEW_NOTIFICATIONS)
+        self._all = session.prepare(ALL_NOTIFICATIONS)
+        self._added = session.prepare(JOBS_ADDED)
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="job-poll")
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            self.load_checkpoint()
+
+    # Start following a job, e.g. straight after the upload that created it
+    def register(self, jobid):
+        with self._lock:
+            if jobid in self.jobs:
+                return False
+            self.jobs[jobid] = Job(jobid)
+            return True
+
+    # Written listener for the upload path (app1.execute_cql_insert_statements): follows each job
+    # as soon as its uploaded_videos_by_jobid row is applied
+    def on_written(self, table, params):
+        if table == 'uploaded_videos_by_jobid':
+            self.register(params[INSERT_COLUMNS[table].index('jobid')])
+
+    def state(self, jobid):
+        job = self.jobs.get(jobid)
+        return job.state if job is not None else None
+
+    @property
+    def active(self):
+        with self._lock:
+            return [job for job in self.jobs.values() if not job.done]
+
+    # Register jobs uploaded since the discovery cursor, reading uploaded_jobs_by_day one day at a
+    # time from the cursor's day to today. Jobs before the cursor were registered by an earlier
+    # discovery and may since have been pruned, so they are not picked up again.
+    def discover(self, now=None):
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        through = self.discovered_through or now - timedelta(days=self.discover_days)
+        seen = self.discovered_at if self.discovered_through else set()
+        newest, at_newest = self.discovered_through, set(seen)
+        found = 0
+        for day in reversed(bucket_range(through, now, 'day')):
+            for row in self.session.execute(self._added, (day, through)):
+                if row.added_date == through and row.jobid in seen:
+                    continue
+                if self.register(row.jobid):
+                    found += 1
+                if newest is None or row.added_date > newest:
+                    newest, at_newest = row.added_date, {row.jobid}
+                elif row.added_date == newest:
+                    at_newest.add(row.jobid)
+        self.discovered_through, self.discovered_at = newest, at_newest
+        return found
+
+    # Drop jobs that have been terminal for longer than `retain`
+    def prune(self, now=None):
+        cutoff = (now if now is not None else time.time()) - self.retain
+        with self._lock:
+            expired = [jobid for jobid, job in self.jobs.items()
+                       if job.done and job.done_at is not None and job.done_at <= cutoff]
+            for jobid in expired:
+                del self.jobs[jobid]
+        return len(expired)
+
+    # New notifications for a batch of jobs as (job, rows oldest first); queries for the whole batch
+    # are in flight together
+    def _read_batch(self, jobs):
+        futures = [(job, self.session.execute_async(self._new, (job.jobid, job.status_date))
+                    if job.status_date is not None else self.session.execute_async(self._all, (job.jobid,)))
+                   for job in jobs]
+        results = []
+        for job, future in futures:
+            try:
+                rows = list(future.result())
+            except Exception as e:
+                print(f"Error reading notifications for job {job.jobid}: {e}")
+                results.append((job, None))
+                continue
+            rows.sort(key=lambda row: (row.status_date, row.etag))
+            results.append((job, [row for row in rows
+                                  if row.status_date != job.status_date or row.etag not in job.etags]))
+        return results
+
+    def _apply(self, job, row, report):
+        report.notifications += 1
+        if row.status_date != job.status_date:
+            job.status_date = row.status_date
+            job.etags = set()
+        job.etags.add(row.etag)
+        old = job.state
+        if row.newstate not in TRANSITIONS.get(old, ()):
+            report.rejected += 1
+            print(f"Ignoring notification {row.etag} for job {job.jobid}: {old} -> {row.newstate}")
+            return
+        if old is not None and row.oldstate not in (None, old):
+            print(f"Job {job.jobid} went {row.oldstate} -> {row.newstate} but was last seen {old}")
+        job.state = row.newstate
+        if job.done:
+            job.done_at = time.time()
+        report.transitions[(old, row.newstate)] += 1
+        for listener in self.listeners:
+            try:
+                listener(job, old, row.newstate, row.status_date)
+            except Exception as e:
+                print(f"Error in job listener {getattr(listener, '__qualname__', listener)}: {e}")
+
+    def poll_once(self):
+        report = PollReport()
+        start = time.perf_counter()
+        if self.discover_every and self.polls % self.discover_every == 0:
+            try:
+                report.discovered = self.discover()
+            except Exception as e:
+                print(f"Error discovering encoding jobs: {e}")
+        self.polls += 1
+        active = self.active
+        report.jobs = len(active)
+        batches = [active[i:i + self.batch_size] for i in range(0, len(active), self.batch_size)]
+        for results in self._pool.map(self._read_batch, batches):
+            for job, rows in results:
+                if rows is None:
+                    report.errors += 1
+                    continue
+                for row in rows:
+                    self._apply(job, row, report)
+        report.pruned = self.prune()
+        if report.notifications or report.discovered or report.pruned:
+            self.save_checkpoint()
+        report.elapsed = time.perf_counter() - start
+        self.last_report = report
+        return report
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        with self._lock:
+            data = {'version': CHECKPOINT_VERSION, 'saved': datetime.now().isoformat(timespec='seconds'),
+                    'jobs': {str(jobid): job.to_json() for jobid, job in self.jobs.items()},
+                    'discovered_through': (self.discovered_through.isoformat()
+                                           if self.discovered_through else None),
+                    'discovered_at': sorted(str(jobid) for jobid in self.discovered_at)}
+        tmp = self.checkpoint_path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as out:
+                json.dump(data, out, separators=(',', ':'))
+            os.replace(tmp, self.checkpoint_path)
+        except OSError as e:
+            print(f"Error writing checkpoint {self.checkpoint_path}: {e}")
+
+    def load_checkpoint(self):
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != CHECKPOINT_VERSION:
+            print(f"Ignoring checkpoint {self.checkpoint_path}: version {data.get('version')}")
+            return
+        with self._lock:
+            self.jobs = {jobid: Job.from_json(jobid, job) for jobid, job in data['jobs'].items()}
+            through = data.get('discovered_through')
+            self.discovered_through = datetime.fromisoformat(through) if through else None
+            self.discovered_at = set(data.get('discovered_at', ()))
+
+    def _run_periodically(self):
+        while True:
+            try:
+                report = self.poll_once()
+                if report.notifications or report.errors:
+                    print(report.summary())
+            except Exception as e:
+                print(f"Error polling encoding job notifications: {e}")
+            if self._stopped.wait(self.interval):
+                return
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_periodically, name="job-notifications", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._pool.shutdown()
+        self.save_checkpoint()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Follow encoding job notifications")
+    parser.add_argument('--checkpoint', default='encoding-jobs.checkpoint.json')
+    parser.add_argument('--interval', type=float, default=5.0)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--retain', type=float, default=3600.0, help="seconds to keep finished jobs")
+    parser.add_argument('--once', action='store_true', help="poll once and exit")
+    parser.add_argument('--embedded', metavar='DIR', help="read an embedded store instead of the cluster")
+    args = parser.parse_args(argv)
+
+    from app1 import create_cassandra_connection
+    session = create_cassandra_connection(args.embedded)
+    if session is None:
+        return 1
+    session.set_keyspace('killrvideo')
+    consumer = JobNotificationConsumer(session, args.checkpoint, args.workers, interval=args.interval,
+                                       retain=args.retain)
+    try:
+        if args.once:
+            print(consumer.poll_once().summary())
+        else:
+            consumer.start()
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        consumer.stop()
+        session.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
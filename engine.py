@@ -0,0 +1,377 @@
+import glob
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import threading
+
+from memsession import (AlterTable, AlterType, CreateFunction, CreateIndex, CreateTable, CreateType, CreateView,
+                        DropIndex, DropView, Keyspace, MemoryDatabase, MemorySession, MemoryTable)
+
+# Statements that change the schema and are replayed on open
+_DDL = (CreateTable, CreateType, CreateView, CreateIndex, DropIndex, CreateFunction, AlterTable, AlterType)
+
+# An embedded, single-node wide-column store for the killrvideo schema. Writes go to a per-table
+# commit log and memtable; full memtables are flushed to immutable segment files sorted by token,
+# which are memory-mapped for reads and periodically compacted. The CQL front end is the same
+# parser/executor as memsession.py, so MemorySession works on top of it unchanged.
+
+SEGMENT_MAGIC = b'KVSEG001'
+_FOOTER = struct.Struct('>QQ')
+_RECORD = struct.Struct('>I')
+
+
+# All writes to one partition within one memtable or segment. Rows map clustering key to a dict
+# of cells, or to None for a row tombstone; `deleted` shadows everything older for the partition.
+class PartitionUpdate:
+    __slots__ = ('deleted', 'static', 'rows')
+
+    def __init__(self, deleted=False, static=None, rows=None):
+        self.deleted = deleted
+        self.static = static or {}
+        self.rows = rows or {}
+
+    def apply(self, newer):
+        if newer.deleted:
+            self.deleted = True
+            self.static = {}
+            self.rows = {}
+        self.static.update(newer.static)
+        for ck, row in newer.rows.items():
+            current = self.rows.get(ck)
+            if row is None or current is None:
+                self.rows[ck] = None if row is None else dict(row)
+            else:
+                current.update(row)
+
+    def __reduce__(self):
+        return (PartitionUpdate, (self.deleted, self.static, self.rows))
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise IOError(f"{path} is not a segment file")
+        index_offset, index_length = _FOOTER.unpack_from(self._map, len(self._map) - _FOOTER.size)
+        self.index = {pk: (offset, length) for pk, offset, length
+                      in pickle.loads(self._map[index_offset:index_offset + index_length])}
+
+    def __contains__(self, pk):
+        return pk in self.index
+
+    def get(self, pk):
+        entry = self.index.get(pk)
+        if entry is None:
+            return None
+        offset, length = entry
+        return pickle.loads(self._map[offset:offset + length])
+
+    def keys(self):
+        return self.index.keys()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    # Write (pk, PartitionUpdate) pairs, already in token order, to an immutable segment file
+    @staticmethod
+    def write(path, partitions):
+        tmp = path + '.tmp'
+        index = []
+        with open(tmp, 'wb') as f:
+            f.write(SEGMENT_MAGIC)
+            offset = len(SEGMENT_MAGIC)
+            for pk, update in partitions:
+                blob = pickle.dumps(update, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(blob)
+                index.append((pk, offset, len(blob)))
+                offset += len(blob)
+            blob = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(blob)
+            f.write(_FOOTER.pack(offset, len(blob)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+# Append-only log of mutations that are only in the memtable; replayed on open, emptied on flush
+class CommitLog:
+    def __init__(self, path, sync=False):
+        self.path = path
+        self.sync = sync
+        self._file = open(path, 'ab')
+
+    def replay(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        pos = 0
+        while pos + _RECORD.size <= len(data):
+            (length,) = _RECORD.unpack_from(data, pos)
+            start = pos + _RECORD.size
+            if start + length > len(data):
+                break  # torn final record from a crash mid-write
+            yield pickle.loads(data[start:start + length])
+            pos = start + length
+
+    def append(self, record):
+        blob = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(_RECORD.pack(len(blob)) + blob)
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+    def truncate(self):
+        self._file.truncate(0)
+        self._file.seek(0)
+
+    def close(self):
+        self._file.close()
+
+
+# Storage for one table with the same interface as memsession.MemoryTable
+class LSMTable(MemoryTable):
+    def __init__(self, schema, directory, memtable_limit=10000, max_segments=8, sync=False):
+        self.schema = schema
+        self._tokens = {}
+        self._ring = None
+        self.directory = directory
+        self.memtable_limit = memtable_limit
+        self.max_segments = max_segments
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        for leftover in glob.glob(os.path.join(directory, '*.tmp')):
+            os.remove(leftover)
+        self.segments = [Segment(path) for path in sorted(glob.glob(os.path.join(directory, 'segment-*.db')))]
+        self._next_segment = 1 + max((self._segment_number(s.path) for s in self.segments), default=0)
+        self.memtable = {}
+        self._memtable_rows = 0
+        self.log = CommitLog(os.path.join(directory, 'commitlog.bin'), sync)
+        for record in self.log.replay():
+            self._apply(*record)
+
+    @staticmethod
+    def _segment_number(path):
+        return int(os.path.basename(path)[len('segment-'):-len('.db')])
+
+    def _apply(self, op, pk, ck=None, values=None, static_values=None):
+        update = self.memtable.get(pk)
+        if update is None:
+            if self._ring is not None and not any(pk in segment for segment in self.segments):
+                self._ring = None
+            update = self.memtable[pk] = PartitionUpdate()
+        if op == 'delete_partition':
+            update.apply(PartitionUpdate(deleted=True))
+        elif op == 'delete_row':
+            update.rows[ck] = None
+        else:
+            update.static.update(static_values)
+            if ck is not None:
+                update.apply(PartitionUpdate(rows={ck: values}))
+        self._memtable_rows += 1
+
+    def _write(self, *record):
+        with self.lock:
+            self.log.append(record)
+            self._apply(*record)
+            if self._memtable_rows >= self.memtable_limit:
+                self.flush()
+
+    def upsert(self, pk, ck, values, static_values):
+        self._write('upsert', pk, ck, values, static_values)
+
+    def delete(self, pk, ck=None):
+        if pk is None:
+            self.truncate()
+        elif ck is None:
+            self._write('delete_partition', pk)
+        else:
+            self._write('delete_row', pk, ck)
+
+    def truncate(self):
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+                os.remove(segment.path)
+            self.segments = []
+            self.memtable = {}
+            self._memtable_rows = 0
+            self._ring = None
+            self.log.truncate()
+
+    # Fold every layer for one partition, oldest segment first and the memtable last
+    def _merged(self, pk):
+        merged = None
+        with self.lock:
+            layers = [segment.get(pk) for segment in self.segments if pk in segment]
+            if pk in self.memtable:
+                layers.append(self.memtable[pk])
+        for update in layers:
+            if merged is None:
+                merged = PartitionUpdate()
+            merged.apply(update)
+        return merged
+
+    def get_row(self, pk, ck):
+        merged = self._merged(pk)
+        if merged is None:
+            return None
+        return merged.rows.get(ck)
+
+    def read(self, pk, reverse=False):
+        merged = self._merged(pk)
+        if merged is None:
+            return
+        rows = [(ck, row) for ck, row in merged.rows.items() if row is not None]
+        if not rows:
+            if merged.static:
+                yield None, {}, merged.static
+            return
+        rows.sort(key=lambda item: self.clustering_sort_key(item[0]), reverse=reverse)
+        for ck, row in rows:
+            yield ck, row, merged.static
+
+    # Partitions in token order, as a full-table scan on Cassandra returns them
+    def partition_keys(self):
+        with self.lock:
+            keys = set(self.memtable)
+            for segment in self.segments:
+                keys.update(segment.keys())
+        return sorted(keys, key=self.token)
+
+    def _token_ordered(self, partitions):
+        return sorted(partitions.items(), key=lambda item: self.token(item[0]))
+
+    def flush(self):
+        with self.lock:
+            if not self.memtable:
+                return
+            path = os.path.join(self.directory, f"segment-{self._next_segment:08d}.db")
+            self._next_segment += 1
+            Segment.write(path, self._token_ordered(self.memtable))
+            self.segments.append(Segment(path))
+            self.memtable = {}
+            self._memtable_rows = 0
+            self.log.truncate()
+            if len(self.segments) > self.max_segments:
+                self.compact()
+
+    # Merge every segment into one. With nothing older left to shadow, tombstones are dropped.
+    def compact(self):
+        with self.lock:
+            if len(self.segments) < 2:
+                return
+            merged = {}
+            for segment in self.segments:
+                for pk in segment.keys():
+                    current = merged.get(pk)
+                    if current is None:
+                        current = merged[pk] = PartitionUpdate()
+                    current.apply(segment.get(pk))
+            live = {}
+            for pk, update in merged.items():
+                rows = {ck: row for ck, row in update.rows.items() if row is not None}
+                if rows or update.static:
+                    live[pk] = PartitionUpdate(False, update.static, rows)
+            path = os.path.join(self.directory, f"segment-{self._next_segment:08d}.db")
+            self._next_segment += 1
+            Segment.write(path, self._token_ordered(live))
+            old, self.segments = self.segments, [Segment(path)]
+            self._ring = None
+            for segment in old:
+                segment.close()
+                os.remove(segment.path)
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.log.close()
+            for segment in self.segments:
+                segment.close()
+
+
+class EmbeddedDatabase(MemoryDatabase):
+    def __init__(self, directory, memtable_limit=10000, max_segments=8, sync=False):
+        super().__init__()
+        self.directory = directory
+        self.memtable_limit = memtable_limit
+        self.max_segments = max_segments
+        self.sync = sync
+        os.makedirs(directory, exist_ok=True)
+        self._schema_path = os.path.join(directory, 'schema.pickle')
+        self._ddl = []
+        if os.path.exists(self._schema_path):
+            with open(self._schema_path, 'rb') as f:
+                self._ddl = pickle.load(f)
+            for statement in self._ddl:
+                super().execute(statement)
+
+    def new_table(self, schema):
+        return LSMTable(schema, os.path.join(self.directory, 'tables', schema.name),
+                        self.memtable_limit, self.max_segments, self.sync)
+
+    def create_table(self, schema):
+        existing = self.tables.get(schema.name)
+        if existing is not None:
+            existing.close()
+        super().create_table(schema)
+
+    def execute(self, statement, params=(), fetch_size=None, paging_state=None):
+        result = super().execute(statement, params, fetch_size, paging_state)
+        kind = type(statement)
+        if kind is DropView:
+            self._forget_view(statement.name)
+        elif kind in _DDL or (kind is Keyspace and statement.action == 'create'):
+            self._record_ddl(statement)
+        return result
+
+    # The schema is kept as the list of DDL statements that built it, replayed on open
+    def _record_ddl(self, statement=None):
+        if statement is not None:
+            self._ddl.append(statement)
+        tmp = self._schema_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self._ddl, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._schema_path)
+
+    # A dropped view leaves the DDL log rather than being replayed after it, since a table created
+    # later under the same name keeps its files in the same directory
+    def _forget_view(self, name):
+        self._ddl = [statement for statement in self._ddl
+                     if not (type(statement) is CreateView and statement.name == name)]
+        self._record_ddl()
+
+    def drop_view(self, statement):
+        table = self.tables.get(statement.name)
+        super().drop_view(statement)
+        if table is not None and statement.name not in self.tables:
+            table.close()
+            shutil.rmtree(table.directory, ignore_errors=True)
+
+    def drop_tables(self):
+        for table in self.tables.values():
+            table.close()
+        super().drop_tables()
+        shutil.rmtree(os.path.join(self.directory, 'tables'), ignore_errors=True)
+        self._ddl = []
+        if os.path.exists(self._schema_path):
+            os.remove(self._schema_path)
+
+    def flush(self):
+        with self.lock:
+            for table in self.tables.values():
+                table.flush()
+
+    def close(self):
+        with self.lock:
+            for table in self.tables.values():
+                table.close()
+
+
+# A driver-shaped session over an embedded store kept in `directory`
+def open_session(directory, latency=0.0, jitter=0.0, memtable_limit=10000, max_segments=8, sync=False):
+    database = EmbeddedDatabase(directory, memtable_limit, max_segments, sync)
+    return MemorySession(database, latency=latency, jitter=jitter)
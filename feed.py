@@ -0,0 +1,125 @@
+import heapq
+import json
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from paging import Page, decode_cursor, encode_cursor, fetch_page
+
+# Homepage feed over latest_videos, which holds one partition per upload day ('2013-05-02'),
+# newest first within the day. A page reads several days concurrently, k-way merges them with
+# a heap and hands back a cursor that resumes right after the last video returned.
+
+DAY_FORMAT = '%Y-%m-%d'
+EPOCH = datetime(1970, 1, 1)
+
+LATEST_VIDEOS = ("SELECT yyyymmdd, added_date, videoid, name, preview_image_location FROM latest_videos "
+                 "WHERE yyyymmdd = ? AND added_date <= ?")
+
+
+# Feed order: added_date DESC, then videoid ASC as in the table's clustering order
+def _feed_key(item):
+    row = item[1]
+    return (EPOCH - row.added_date, row.videoid)
+
+
+# A cursor resumes after `row` of `day`, or at the start of `day` when there is no row
+def _encode(day, row=None):
+    position = [day.strftime(DAY_FORMAT)]
+    if row is not None:
+        position += [row.added_date.isoformat(), str(row.videoid)]
+    return encode_cursor(json.dumps(position).encode('utf-8'))
+
+
+def _decode(cursor):
+    day, *position = json.loads(decode_cursor(cursor).decode('utf-8'))
+    day = datetime.strptime(day, DAY_FORMAT).date()
+    if not position:
+        return day, datetime.max, None
+    added_date, videoid = position
+    return day, datetime.fromisoformat(added_date), uuid.UUID(videoid)
+
+
+class LatestVideosFeed:
+    # window: day partitions kept in flight at once; max_days: how far back one page may look;
+    # oldest: the first upload day, before which every day is known to be empty
+    def __init__(self, session, window=3, max_days=90, oldest=None):
+        self.session = session
+        self.window = window
+        self.max_days = max_days
+        self.oldest = oldest.date() if isinstance(oldest, datetime) else oldest
+        self._statement = None
+
+    def _fetch(self, day, before, fetch_size):
+        if self._statement is None:
+            self._statement = self.session.prepare(LATEST_VIDEOS)
+        params = (day.strftime(DAY_FORMAT), before)
+        bound = self._statement.bind(params)
+        bound.fetch_size = fetch_size
+        return params, self.session.execute_async(bound)
+
+    # One page of up to `limit` videos, newest first. Pass the returned Page.cursor to continue. A
+    # page that looks back max_days without filling up comes back short, with a cursor at the next
+    # day it did not read; the cursor is None only once the days before `oldest` are reached.
+    def page(self, limit=10, cursor=None, today=None):
+        if cursor:
+            start_day, before, after = _decode(cursor)
+        else:
+            start_day = today or datetime.now(timezone.utc).date()
+            before, after = datetime.max, None
+        if isinstance(start_day, datetime):
+            start_day = start_day.date()
+        # Days this page may read, newest first; oldest_read is the last one handed out
+        oldest_read = None
+
+        def next_day():
+            nonlocal oldest_read
+            day = start_day if oldest_read is None else oldest_read - timedelta(days=1)
+            if (start_day - day).days >= self.max_days or (self.oldest is not None and day < self.oldest):
+                return None
+            oldest_read = day
+            return day
+
+        in_flight = deque()
+        for day in iter(next_day, None):
+            in_flight.append((day,) + self._fetch(day, before if day == start_day else datetime.max, limit))
+            if len(in_flight) == self.window:
+                break
+
+        streams = []
+        available = 0
+        while in_flight:
+            day, params, future = in_flight.popleft()
+            result = future.result()
+            rows = list(result.current_rows)
+            if day == start_day and after is not None:
+                # Videos sharing the cursor's added_date up to the cursor were already returned
+                rows = [row for row in rows if not (row.added_date == before and row.videoid <= after)]
+            available += len(rows)
+            streams.append(self._stream(day, rows, params, result.paging_state, limit))
+            # Slide the window one day further back only while what has arrived cannot fill the page
+            if available < limit:
+                day = next_day()
+                if day is not None:
+                    in_flight.append((day,) + self._fetch(day, datetime.max, limit))
+
+        items = []
+        for day, row in heapq.merge(*streams, key=_feed_key):
+            items.append(row)
+            if len(items) == limit:
+                return Page(items, _encode(day, row))
+        next_unread = (oldest_read or start_day + timedelta(days=1)) - timedelta(days=1)
+        if self.oldest is not None and next_unread < self.oldest:
+            return Page(items, None)
+        return Page(items, _encode(next_unread))
+
+    # A day's rows as (day, row): the page already fetched, then later pages only if the merge asks
+    def _stream(self, day, rows, params, paging_state, fetch_size):
+        for row in rows:
+            yield day, row
+        cursor = encode_cursor(paging_state)
+        while cursor:
+            page = fetch_page(self.session, self._statement, params, fetch_size, cursor)
+            for row in page:
+                yield day, row
+            cursor = page.cursor
@@ -0,0 +1,258 @@
+import argparse
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from cassandra import OperationTimedOut, Timeout, Unavailable
+from cassandra.cluster import NoHostAvailable
+from cassandra.protocol import OverloadedErrorMessage
+
+from datagen import decode_value, encode_value
+from loader import BulkLoader, COUNTER_UPDATES, LoadReport
+
+# High-rate ingestion that backs off instead of failing. The in-flight window grows by one request
+# per window of successes and halves when the cluster reports congestion (AIMD, as in TCP), so the
+# loader settles just under what the cluster can take. Writes that fail with a transient error are
+# retried after a jittered, exponentially growing delay; writes that keep failing, or cannot be
+# retried safely, are appended to a dead-letter file that replay_dead_letters can send again later.
+
+# The cluster is saturated: shrink the window
+CONGESTION_ERRORS = (Timeout, OperationTimedOut, OverloadedErrorMessage)
+# Worth sending again once the cluster recovers
+RETRYABLE_ERRORS = CONGESTION_ERRORS + (Unavailable, NoHostAvailable)
+# Refused by the coordinator before anything was applied, so safe to resend even when not idempotent
+REJECTED_ERRORS = (OverloadedErrorMessage, Unavailable)
+
+
+# Counter increments are not idempotent: a timed-out increment may have been applied, so sending it
+# again could count it twice. `table` is a loader label, "+"-joined for multi-table batches.
+def idempotent(table):
+    return not any(name in COUNTER_UPDATES for name in table.split("+"))
+
+
+class IngestReport(LoadReport):
+    def __init__(self):
+        super().__init__()
+        self.retries = 0
+        self.dead_lettered = 0
+        self.decreases = 0
+        self.window = 0.0
+        self.min_window = None
+        self.max_window = 0.0
+        self.dead_letter = None
+
+    def track_window(self, window):
+        self.window = window
+        self.min_window = window if self.min_window is None else min(self.min_window, window)
+        self.max_window = max(self.max_window, window)
+
+    def summary(self):
+        line = (f"Backpressure: window {self.window:.0f} (range {self.min_window or 0:.0f}-{self.max_window:.0f}), "
+                f"{self.decreases} decreases, {self.retries} retries, {self.dead_lettered} rows dead-lettered")
+        if self.dead_lettered and self.dead_letter:
+            line += f" to {self.dead_letter}"
+        return super().summary() + "\n" + line
+
+
+# BulkLoader with an adaptive window, a retry queue and a dead-letter file. Requests waiting in the
+# retry queue count against the window, so a struggling cluster slows the producer down as well.
+class AdaptiveLoader(BulkLoader):
+    report_class = IngestReport
+
+    def __init__(self, session, concurrency=64, statements=None, min_concurrency=2, max_concurrency=512,
+                 max_attempts=5, base_delay=0.05, max_delay=5.0, dead_letter=None, seed=None):
+        super().__init__(session, concurrency, statements)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # JSON-lines path that permanently failed rows are appended to; None just counts them
+        self.dead_letter = dead_letter
+        self.window = float(concurrency)
+        self._cv = threading.Condition()
+        self._in_flight = 0
+        # Submitted requests not yet written or given up on, including those waiting to retry
+        self._outstanding = 0
+        # (due, seq, request) heap of requests waiting out their backoff
+        self._retries = []
+        self._seq = itertools.count()
+        # Bumped on every decrease; a failure from a request sent before the latest decrease says
+        # nothing new about the cluster and does not shrink the window again
+        self._epoch = 0
+        self._rng = random.Random(seed)
+        self._retry_thread = None
+        self._dead_letter_lock = threading.Lock()
+        self.report.dead_letter = dead_letter
+        self.report.track_window(self.window)
+
+    def load(self, rows):
+        report = super().load(rows)
+        report.dead_letter = self.dead_letter
+        report.track_window(self.window)
+        return report
+
+    def submit(self, table, statement, params=None, rows=1, payload=None):
+        if payload is None and params is not None:
+            payload = [(table, params)]
+        with self._cv:
+            while self._in_flight + len(self._retries) >= int(self.window):
+                self._cv.wait()
+            self._in_flight += 1
+            self._outstanding += 1
+        self._send((table, statement, params, rows, payload, 1))
+
+    # request: (table, statement, params, rows, payload, attempt); its window slot is already taken
+    def _send(self, request):
+        epoch = self._epoch
+        try:
+            future = self.session.execute_async(request[1], request[2])
+        except Exception as e:
+            self._on_failure(e, request, epoch)
+            return
+        future.add_callbacks(self._on_written, self._on_failure,
+                             callback_args=(request,), errback_args=(request, epoch))
+
+    def _on_written(self, _, request):
+        with self._cv:
+            self._in_flight -= 1
+            self._outstanding -= 1
+            self.window = min(self.max_concurrency, self.window + 1.0 / self.window)
+            self.report.add_written(request[0], request[3], request[4])
+            self.report.track_window(self.window)
+            self._cv.notify_all()
+        self._notify_written(request[4])
+
+    def _on_failure(self, error, request, epoch):
+        table, statement, params, rows, payload, attempt = request
+        retry = attempt < self.max_attempts and (
+            isinstance(error, REJECTED_ERRORS) or isinstance(error, RETRYABLE_ERRORS) and idempotent(table))
+        with self._cv:
+            self._in_flight -= 1
+            if isinstance(error, CONGESTION_ERRORS) and epoch == self._epoch:
+                self.window = max(float(self.min_concurrency), self.window / 2)
+                self._epoch += 1
+                self.report.decreases += 1
+                self.report.track_window(self.window)
+            if retry:
+                # Full jitter: a uniform delay up to the exponential cap, so requests that failed
+                # together do not all come back together
+                delay = self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                heapq.heappush(self._retries, (time.monotonic() + delay, next(self._seq),
+                                               (table, statement, params, rows, payload, attempt + 1)))
+                self.report.retries += 1
+                if self._retry_thread is None:
+                    self._retry_thread = threading.Thread(target=self._run_retries, name="ingest-retry",
+                                                          daemon=True)
+                    self._retry_thread.start()
+            else:
+                self._outstanding -= 1
+                self.report.add_errors(table, rows, error, payload)
+                self.report.dead_lettered += len(payload) if payload else rows
+            self._cv.notify_all()
+        if not retry:
+            self._write_dead_letter(error, request)
+
+    # Send queued retries as they come due and the window has room; exits once the queue is empty
+    def _run_retries(self):
+        while True:
+            with self._cv:
+                while True:
+                    if not self._retries:
+                        self._retry_thread = None
+                        return
+                    wait = self._retries[0][0] - time.monotonic()
+                    if wait <= 0 and self._in_flight < int(self.window):
+                        request = heapq.heappop(self._retries)[2]
+                        self._in_flight += 1
+                        break
+                    self._cv.wait(wait if wait > 0 else None)
+            self._send(request)
+
+    def _write_dead_letter(self, error, request):
+        if not self.dead_letter:
+            return
+        table, statement, params, rows, payload, attempt = request
+        entry = {'time': datetime.now(timezone.utc).isoformat(), 'error': f"{type(error).__name__}: {error}",
+                 'attempts': attempt}
+        if payload:
+            lines = [dict(entry, table=name, params=encode_value(list(values))) for name, values in payload]
+        else:
+            lines = [dict(entry, table=table, cql=getattr(statement, 'query_string', str(statement)))]
+        try:
+            with self._dead_letter_lock, open(self.dead_letter, 'a', encoding='utf-8') as out:
+                for line in lines:
+                    out.write(json.dumps(line, separators=(',', ':')))
+                    out.write('\n')
+        except OSError as e:
+            print(f"Error writing dead letter {self.dead_letter}: {e}")
+
+    # Block until every submitted request has been written or dead-lettered
+    def drain(self):
+        with self._cv:
+            while self._outstanding:
+                self._cv.wait()
+
+
+# (table, params) rows from a dead-letter file. Entries without bound rows (plain CQL) are skipped.
+def read_dead_letters(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if 'params' in entry:
+                yield (entry['table'], tuple(decode_value(entry['params'])))
+
+
+# Send dead-lettered rows again, one statement per row. Rows from a LOGGED batch lose their
+# atomicity here. An upsert that did land the first time is just written again, but a counter
+# update is not idempotent: a write that timed out may have been applied, and replaying it would
+# count it twice. Counter updates are therefore left out unless `counters` says they were not
+# applied (e.g. after checking the totals).
+def replay_dead_letters(session, path, concurrency=64, dead_letter=None, counters=False):
+    skipped = {}
+
+    def rows():
+        for table, params in read_dead_letters(path):
+            if not counters and not idempotent(table):
+                skipped[table] = skipped.get(table, 0) + 1
+                continue
+            yield table, params
+
+    loader = AdaptiveLoader(session, concurrency, dead_letter=dead_letter)
+    report = loader.load(rows())
+    for table, count in sorted(skipped.items()):
+        print(f"Skipped {count} {table} counter updates that may already be applied; "
+              f"replay them with --counters only if they were not")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay rows from an ingestion dead-letter file")
+    parser.add_argument('path')
+    parser.add_argument('--embedded', metavar='DIR', help="replay into an embedded store instead of the cluster")
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--dead-letter', help="file for rows that fail again (default: <path>.failed)")
+    parser.add_argument('--counters', action='store_true',
+                        help="also replay counter updates; only if they are known not to have been applied")
+    args = parser.parse_args(argv)
+
+    from app1 import create_cassandra_connection
+    session = create_cassandra_connection(args.embedded)
+    if session is None:
+        return 1
+    session.set_keyspace('killrvideo')
+    try:
+        report = replay_dead_letters(session, args.path, args.concurrency, args.dead_letter or args.path + '.failed',
+                                     args.counters)
+    finally:
+        session.shutdown()
+    print(report.summary())
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
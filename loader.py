@@ -0,0 +1,234 @@
+import threading
+import time
+from collections import Counter
+
+# Column order used when binding parameter tuples for each killrvideo table
+INSERT_COLUMNS = {
+    "user_credentials": ("email", "password", "userid"),
+    "users": ("userid", "firstname", "lastname", "email", "created_date"),
+    # Query tables kept in step with users by user_lookups.py
+    "users_by_email": ("email", "userid", "firstname", "lastname", "created_date"),
+    "users_by_lastname_prefix": ("prefix", "lastname_key", "userid", "firstname", "lastname", "email",
+                                 "created_date"),
+    "users_by_signup_day": ("signup_day", "created_date", "userid", "firstname", "lastname", "email"),
+    "videos": ("videoid", "userid", "name", "description", "location", "location_type",
+               "preview_thumbnails", "tags", "metadata", "added_date"),
+    # Written alongside videos by locations.py in place of the materialized view
+    "videos_by_location": ("location", "videoid", "userid", "added_date"),
+    "user_videos": ("userid", "added_date", "videoid", "name", "preview_image_location"),
+    "latest_videos": ("yyyymmdd", "added_date", "videoid", "name", "preview_image_location"),
+    "video_ratings_by_user": ("videoid", "userid", "rating"),
+    "videos_by_tag": ("tag", "videoid", "added_date", "name", "preview_image_location", "tagged_date"),
+    "tags_by_letter": ("first_letter", "tag"),
+    "comments_by_video": ("videoid", "commentid", "userid", "comment"),
+    "comments_by_user": ("userid", "commentid", "videoid", "comment"),
+    "video_event": ("videoid", "userid", "event_timestamp", "event", "video_timestamp"),
+    # Written by watch_stats.py
+    "video_watch_stats": ("videoid", "sessions", "completed", "completion_rate", "total_watch_ms", "mean_watch_ms",
+                          "median_watch_ms", "duration_ms", "watch_time_histogram", "dropoff_histogram",
+                          "computed_at"),
+    "uploaded_videos": ("videoid", "userid", "name", "description", "tags", "added_date", "jobid"),
+    "uploaded_videos_by_jobid": ("jobid", "videoid", "userid", "name", "description", "tags", "added_date"),
+    # Written alongside uploaded_videos_by_jobid by encoding_jobs.py
+    "uploaded_jobs_by_day": ("added_day", "added_date", "jobid"),
+    "encoding_job_notifications": ("jobid", "status_date", "etag", "newstate", "oldstate"),
+    # Optional time-bucketed layout from buckets.py: the source table's columns plus the bucket
+    "comments_by_video_bucketed": ("videoid", "commentid", "userid", "comment", "bucket"),
+    "video_event_bucketed": ("videoid", "userid", "event_timestamp", "event", "video_timestamp", "bucket"),
+    "comments_by_video_buckets": ("videoid", "bucket"),
+    "video_event_buckets": ("videoid", "userid", "bucket"),
+}
+
+# Partition key columns of each table, used to group writes that land on the same replica set
+PARTITION_KEYS = {
+    "user_credentials": ("email",),
+    "users": ("userid",),
+    "users_by_email": ("email",),
+    "users_by_lastname_prefix": ("prefix",),
+    "users_by_signup_day": ("signup_day",),
+    "videos": ("videoid",),
+    "videos_by_location": ("location",),
+    "user_videos": ("userid",),
+    "latest_videos": ("yyyymmdd",),
+    "video_rating": ("videoid",),
+    "video_ratings_by_user": ("videoid",),
+    "videos_by_tag": ("tag",),
+    "tags_by_letter": ("first_letter",),
+    "comments_by_video": ("videoid",),
+    "comments_by_user": ("userid",),
+    "video_event": ("videoid", "userid"),
+    "video_watch_stats": ("videoid",),
+    "uploaded_videos": ("videoid",),
+    "uploaded_videos_by_jobid": ("jobid",),
+    "uploaded_jobs_by_day": ("added_day",),
+    "encoding_job_notifications": ("jobid",),
+    "comments_by_video_bucketed": ("videoid", "bucket"),
+    "video_event_bucketed": ("videoid", "userid", "bucket"),
+    "comments_by_video_buckets": ("videoid",),
+    "video_event_buckets": ("videoid", "userid"),
+}
+
+# Counter tables cannot be INSERTed, so they get an UPDATE with increments bound as parameters
+COUNTER_UPDATES = {
+    "video_rating": "UPDATE video_rating SET rating_counter = rating_counter + ?, "
+                    "rating_total = rating_total + ? WHERE videoid = ?",
+}
+
+
+# Build the parameterised CQL for one table
+def insert_cql(table):
+    if table in COUNTER_UPDATES:
+        return COUNTER_UPDATES[table]
+    columns = INSERT_COLUMNS[table]
+    placeholders = ", ".join("?" for _ in columns)
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+
+# Bound-parameter order of a table's write statement
+def bind_columns(table):
+    if table == "video_rating":
+        return ("rating_counter", "rating_total", "videoid")
+    return INSERT_COLUMNS[table]
+
+
+# Partition key value of a (table, params) row
+def partition_key(table, params):
+    columns = bind_columns(table)
+    return tuple(params[columns.index(column)] for column in PARTITION_KEYS[table])
+
+
+# Prepare one statement per table, once, so the server never re-parses a write
+def prepare_statements(session, tables=None):
+    if tables is None:
+        tables = list(INSERT_COLUMNS) + list(COUNTER_UPDATES)
+    return {table: session.prepare(insert_cql(table)) for table in tables}
+
+
+class LoadReport:
+    def __init__(self):
+        self.rows = 0
+        self.written = Counter()
+        self.errors = Counter()
+        self.first_errors = {}
+        self.elapsed = 0.0
+
+    @property
+    def failed(self):
+        return sum(self.errors.values())
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    # A multi-table batch is submitted under its "+"-joined table names; split its rows back
+    # onto the member tables so the report stays per table
+    def tables(self, label, rows, payload=None):
+        if "+" not in label or not payload:
+            return {label: rows}
+        return Counter(table for table, _ in payload)
+
+    def add_written(self, label, rows, payload=None):
+        self.written.update(self.tables(label, rows, payload))
+
+    def add_errors(self, label, rows, error, payload=None):
+        for table, count in self.tables(label, rows, payload).items():
+            self.errors[table] += count
+            self.first_errors.setdefault(table, f"{type(error).__name__}: {error}")
+
+    def summary(self):
+        lines = [f"Loaded {self.rows - self.failed}/{self.rows} rows in {self.elapsed:.2f}s "
+                 f"({self.rows_per_sec:.0f} rows/sec)"]
+        for table in sorted(set(self.written) | set(self.errors)):
+            line = f"  {table}: {self.written[table]} written, {self.errors[table]} errors"
+            if table in self.first_errors:
+                line += f" (first error: {self.first_errors[table]})"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+# Writes (table, params) rows through prepared statements with a bounded number of requests in flight.
+# A failed write is counted against its table and loading carries on with the next row.
+class BulkLoader:
+    report_class = LoadReport
+
+    def __init__(self, session, concurrency=64, statements=None):
+        self.session = session
+        self.concurrency = concurrency
+        self.statements = statements if statements is not None else {}
+        self.report = self.report_class()
+        # Called with (table, params) for every row once the server has applied its write
+        self.written_listeners = []
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+
+    def statement(self, table):
+        statement = self.statements.get(table)
+        if statement is None:
+            statement = self.statements[table] = self.session.prepare(insert_cql(table))
+        return statement
+
+    def _on_success(self, _, table, rows, payload=None):
+        with self._lock:
+            self.report.add_written(table, rows, payload)
+        self._notify_written(payload)
+        self._slots.release()
+
+    # Runs on the driver's event loop thread, so listeners must be quick
+    def _notify_written(self, payload):
+        for listener in self.written_listeners:
+            for table, params in payload or ():
+                try:
+                    listener(table, params)
+                except Exception as e:
+                    print(f"Error in write listener {getattr(listener, '__qualname__', listener)}: {e}")
+
+    def _record_error(self, error, table, rows, payload=None):
+        with self._lock:
+            self.report.add_errors(table, rows, error, payload)
+
+    def _on_error(self, error, table, rows, payload=None):
+        self._record_error(error, table, rows, payload)
+        self._slots.release()
+
+    # Send one statement (or batch carrying `rows` rows), blocking while the in-flight window is full.
+    # `payload` is the (table, params) rows behind a batch, for loaders that keep failed writes and
+    # for written_listeners.
+    def submit(self, table, statement, params=None, rows=1, payload=None):
+        if payload is None and params is not None:
+            payload = [(table, params)]
+        self._slots.acquire()
+        try:
+            future = self.session.execute_async(statement, params)
+        except Exception as e:
+            self._on_error(e, table, rows, payload)
+            return
+        future.add_callbacks(self._on_success, self._on_error,
+                             callback_args=(table, rows, payload), errback_args=(table, rows, payload))
+
+    # Block until every submitted request has completed
+    def drain(self):
+        for _ in range(self.concurrency):
+            self._slots.acquire()
+        for _ in range(self.concurrency):
+            self._slots.release()
+
+    def load(self, rows):
+        self.report = report = self.report_class()
+        start = time.perf_counter()
+        for table, params in rows:
+            report.rows += 1
+            try:
+                statement = self.statement(table)
+            except Exception as e:
+                self._record_error(e, table, 1)
+                continue
+            self.submit(table, statement, params)
+        self.drain()
+        report.elapsed = time.perf_counter() - start
+        return report
+
+
+# Plain row-per-statement load. Rows go only to the tables named, with none of the derived rows
+# the batcher's fan-out writes (see app1.execute_cql_insert_statements).
+def load_rows(session, rows, concurrency=64):
+    return BulkLoader(session, concurrency).load(rows)
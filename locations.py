@@ -0,0 +1,243 @@
+import threading
+import time
+from collections import Counter
+
+from cassandra.query import BatchStatement, BatchType
+
+from loader import BulkLoader, INSERT_COLUMNS, insert_cql
+from scan import scan_table
+
+# videos_by_location as a plain table kept in step by the application instead of a materialized
+# view. A video's location row goes out in the same LOGGED batch as the videos row
+# (batcher.FANOUT); moving a video deletes the old location row and writes the new one in one
+# batch. Either way the video's current location is read first, as the view did on the server.
+
+VIDEO_ROW = "SELECT videoid, userid, location, added_date FROM videos WHERE videoid = ?"
+SET_LOCATION = "UPDATE videos SET location = ? WHERE videoid = ?"
+DELETE_LOCATION = "DELETE FROM videos_by_location WHERE location = ? AND videoid = ?"
+LOCATION_ROW = ("SELECT location, videoid, userid, added_date FROM videos_by_location "
+                "WHERE location = ? AND videoid = ?")
+BY_LOCATION = "SELECT location, videoid, userid, added_date FROM videos_by_location WHERE location = ? LIMIT ?"
+
+# LIMIT bound when the caller asked for everything
+_NO_LIMIT = 2 ** 31 - 1
+
+
+# videos_by_location row for a videos row, in the column order of loader.INSERT_COLUMNS
+def location_rows(params):
+    values = dict(zip(INSERT_COLUMNS['videos'], params))
+    if values['location'] is None:
+        return []
+    return [('videos_by_location', tuple(values[c] for c in INSERT_COLUMNS['videos_by_location']))]
+
+
+# Deletes a videos write needs next to its location_rows: the video's current videos_by_location
+# row when the write moves it elsewhere, as (table, statement, params). Returns the function
+# batcher.FANOUT_DELETES expects, with its statements prepared on first use.
+def location_deletes(session):
+    statements = []
+
+    def deletes(params):
+        if not statements:
+            statements.extend((session.prepare(VIDEO_ROW), session.prepare(DELETE_LOCATION)))
+        read, delete = statements
+        values = dict(zip(INSERT_COLUMNS['videos'], params))
+        current = session.execute(read, (values['videoid'],)).one()
+        if current is None or current.location is None or current.location == values['location']:
+            return []
+        return [('videos_by_location', delete, (current.location, values['videoid']))]
+    return deletes
+
+
+def _location_row(video):
+    return (video.location, video.videoid, video.userid, video.added_date)
+
+
+class VideoLocations:
+    def __init__(self, session):
+        self.session = session
+        self._statements = {}
+
+    def _statement(self, cql):
+        statement = self._statements.get(cql)
+        if statement is None:
+            statement = self._statements[cql] = self.session.prepare(cql)
+        return statement
+
+    # Change a video's location. `current` is the video's row (videoid, userid, location, added_date)
+    # when the caller already has it; otherwise it is read first. Returns False for an unknown video.
+    def move(self, videoid, location, current=None):
+        if current is None:
+            current = self.session.execute(self._statement(VIDEO_ROW), (videoid,)).one()
+            if current is None:
+                return False
+        batch = BatchStatement(batch_type=BatchType.LOGGED)
+        batch.add(self._statement(SET_LOCATION), (location, videoid))
+        if current.location is not None and current.location != location:
+            batch.add(self._statement(DELETE_LOCATION), (current.location, videoid))
+        if location is not None:
+            batch.add(self._statement(insert_cql('videos_by_location')),
+                      (location, videoid, current.userid, current.added_date))
+        self.session.execute(batch)
+        return True
+
+    def videos_at(self, location, limit=None):
+        return list(self.session.execute(self._statement(BY_LOCATION),
+                                         (location, _NO_LIMIT if limit is None else limit)))
+
+
+class ReconcileReport:
+    def __init__(self):
+        self.videos = 0
+        self.checked = 0
+        self.missing = 0
+        self.mismatched = 0
+        self.stale = 0
+        self.repaired = 0
+        self.elapsed = 0.0
+
+    @property
+    def drift(self):
+        return self.missing + self.mismatched + self.stale
+
+    def summary(self):
+        return (f"videos_by_location: {self.checked} rows checked against {self.videos} videos in "
+                f"{self.elapsed:.2f}s; {self.missing} missing, {self.mismatched} mismatched, "
+                f"{self.stale} stale, {self.repaired} videos repaired")
+
+
+# Compare videos with videos_by_location without holding either table in memory. Each table is
+# streamed over `splits` token ranges with `concurrency` ranges in flight, and each row is probed
+# by key in the other: videos finds missing and mismatched location rows, videos_by_location finds
+# stale ones. A drifted video is re-read from videos before it is repaired, so a write that raced
+# with the scan is not undone.
+def reconcile_locations(session, repair=False, splits=64, concurrency=8, fetch_size=1000):
+    report = ReconcileReport()
+    start = time.perf_counter()
+    # videoid -> stale locations the scan found for it
+    drifted = {}
+
+    def located_videos():
+        for video in scan_table(session, 'videos', 'videoid, userid, location, added_date', splits, concurrency,
+                                fetch_size):
+            report.videos += 1
+            if video.location is not None:
+                yield video
+
+    def check_video(video, located):
+        if located is None:
+            report.missing += 1
+        elif tuple(located) != _location_row(video):
+            report.mismatched += 1
+        else:
+            return
+        drifted.setdefault(video.videoid, [])
+
+    def check_located(located, video):
+        report.checked += 1
+        if video is None or video.location != located.location:
+            report.stale += 1
+            drifted.setdefault(located.videoid, []).append(located.location)
+
+    _probe(session, located_videos(), session.prepare(LOCATION_ROW),
+           lambda video: (video.location, video.videoid), check_video, concurrency)
+    _probe(session, scan_table(session, 'videos_by_location', 'location, videoid, userid, added_date', splits,
+                               concurrency, fetch_size),
+           session.prepare(VIDEO_ROW), lambda located: (located.videoid,), check_located, concurrency)
+
+    if repair and drifted:
+        report.repaired = _repair(session, drifted, concurrency)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+# Calls check(row, found) for every row of `rows`, with `found` the row `statement` returns for
+# key(row), or None. Up to `concurrency` reads are in flight; checks run one at a time on the
+# driver's callback threads.
+def _probe(session, rows, statement, key, check, concurrency):
+    slots = threading.Semaphore(concurrency)
+    lock = threading.Lock()
+    errors = []
+
+    def on_success(found, row):
+        with lock:
+            check(row, found[0] if found else None)
+        slots.release()
+
+    def on_error(error, row):
+        errors.append((row, error))
+        slots.release()
+
+    for row in rows:
+        slots.acquire()
+        future = session.execute_async(statement, key(row))
+        future.add_callbacks(on_success, on_error, callback_args=(row,), errback_args=(row,))
+    for _ in range(concurrency):
+        slots.acquire()
+    for _ in range(concurrency):
+        slots.release()
+    if errors:
+        row, error = errors[0]
+        raise RuntimeError(f"{len(errors)} reads failed, first for {key(row)}: {error}")
+
+
+# Rewrite each drifted video's location row from a fresh read of videos, deleting the stale rows
+# the scan found unless the video has since moved back there
+def _repair(session, drifted, concurrency):
+    loader = BulkLoader(session, concurrency)
+    read = session.prepare(VIDEO_ROW)
+    delete = session.prepare(DELETE_LOCATION)
+    insert = loader.statement('videos_by_location')
+    repaired = 0
+    for videoid, stale in drifted.items():
+        video = session.execute(read, (videoid,)).one()
+        location = video.location if video is not None else None
+        for seen in stale:
+            if seen != location:
+                loader.submit('videos_by_location', delete, (seen, videoid))
+        if location is not None:
+            loader.submit('videos_by_location', insert, _location_row(video))
+        repaired += 1
+    loader.drain()
+    return repaired
+
+
+# Runs reconcile_locations every `interval` seconds on a daemon thread
+class LocationReconciler:
+    def __init__(self, session, interval=3600.0, repair=True, splits=64, concurrency=8):
+        self.session = session
+        self.interval = interval
+        self.repair = repair
+        self.splits = splits
+        self.concurrency = concurrency
+        self.last_report = None
+        self.passes = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        try:
+            report = reconcile_locations(self.session, self.repair, self.splits, self.concurrency)
+        except Exception as e:
+            self.passes['failed'] += 1
+            print(f"Error reconciling videos_by_location: {e}")
+            return None
+        self.passes['drifted' if report.drift else 'clean'] += 1
+        if report.drift:
+            print(report.summary())
+        self.last_report = report
+        return report
+
+    def _run_periodically(self):
+        while not self._stopped.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_periodically, name="location-reconcile", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
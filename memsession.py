@@ -0,0 +1,1877 @@
+import bisect
+import heapq
+import itertools
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, timedelta, timezone
+
+from cassandra.query import (UNSET_VALUE, BatchStatement, BoundStatement, PreparedStatement, Statement,
+                            bind_params)
+from cassandra.encoder import Encoder
+from cassandra.metadata import (ColumnMetadata, Function, IndexMetadata, KeyspaceMetadata, MaterializedViewMetadata,
+                                Metadata, Murmur3Token, TableMetadata, UserType)
+from cassandra.cluster import ExecutionProfile
+from cassandra.protocol import OverloadedErrorMessage
+from cassandra.util import SortedSet, datetime_from_uuid1, max_uuid_from_time, min_uuid_from_time
+
+# A local, in-process stand-in for cassandra.cluster.Session that understands the CQL used by
+# app1.py and query.py. It keeps everything in memory and can inject per-request latency, so
+# code written against the driver can run offline in tests, benchmarks and CI.
+
+
+class InvalidRequest(Exception):
+    pass
+
+
+# ---------------------------------------------------------------------------------------------
+# Tokenizer and parser for the CQL subset
+# ---------------------------------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+|--[^\n]*|//[^\n]*)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<uuid>[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_]*|"[^"]+")
+  | (?P<op><=|>=|!=|[=<>(),;{}:\[\].?+*-])
+""", re.X)
+
+Param = namedtuple('Param', 'index')
+Call = namedtuple('Call', 'name args')
+Token = namedtuple('Token', 'kind text')
+
+Keyspace = namedtuple('Keyspace', 'action name')
+CreateTable = namedtuple('CreateTable', 'schema if_not_exists', defaults=(False,))
+CreateType = namedtuple('CreateType', 'name fields if_not_exists', defaults=(False,))
+CreateView = namedtuple('CreateView', 'name base columns where partition_key clustering if_not_exists',
+                        defaults=(False,))
+CreateIndex = namedtuple('CreateIndex', 'name table target using if_not_exists')
+DropIndex = namedtuple('DropIndex', 'name if_exists')
+DropView = namedtuple('DropView', 'name if_exists')
+CreateFunction = namedtuple('CreateFunction', 'name arguments returns language body called_on_null replace')
+AlterTable = namedtuple('AlterTable', 'table column ctype')
+AlterType = namedtuple('AlterType', 'name field ctype')
+Noop = namedtuple('Noop', 'kind')
+Insert = namedtuple('Insert', 'table columns values if_not_exists', defaults=(False,))
+Update = namedtuple('Update', 'table assignments where')
+# conditions is None for a plain DELETE, [] for IF EXISTS and the IF conditions otherwise
+Delete = namedtuple('Delete', 'table where conditions', defaults=(None,))
+Select = namedtuple('Select', 'table selectors where order limit')
+Batch = namedtuple('Batch', 'kind statements')
+# A statement from a driver BatchStatement, carrying its own bound values
+Bound = namedtuple('Bound', 'statement params')
+
+
+def tokenize(cql):
+    tokens = []
+    pos = 0
+    while pos < len(cql):
+        match = _TOKEN_RE.match(cql, pos)
+        if match is None:
+            raise InvalidRequest(f"Unexpected character {cql[pos]!r} in: {cql}")
+        pos = match.end()
+        kind = match.lastgroup
+        if kind != 'space':
+            tokens.append(Token(kind, match.group(kind)))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, cql):
+        self.cql = cql
+        self.tokens = tokenize(cql)
+        self.pos = 0
+        self.params = itertools.count()
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else Token('eof', '')
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def at(self, *words):
+        return all(self.peek(i).text.lower() == word.lower() for i, word in enumerate(words))
+
+    def accept(self, *words):
+        if self.at(*words):
+            self.pos += len(words)
+            return True
+        return False
+
+    def expect(self, *words):
+        if not self.accept(*words):
+            raise InvalidRequest(f"Expected {' '.join(words)!r} near {self.peek().text!r} in: {self.cql}")
+
+    def ident(self):
+        token = self.next()
+        if token.kind != 'ident':
+            raise InvalidRequest(f"Expected identifier near {token.text!r} in: {self.cql}")
+        if token.text.startswith('"'):
+            return token.text[1:-1]
+        return token.text.lower()
+
+    # keyspace-qualified names collapse to the table name; the stand-in has a single namespace
+    def name(self):
+        name = self.ident()
+        if self.accept('.'):
+            name = self.ident()
+        return name
+
+    def skip_to_end(self):
+        self.pos = len(self.tokens)
+
+    # Skip trailing clauses the stand-in ignores (USING TTL, IF NOT EXISTS) up to the statement end
+    def skip_clause(self):
+        while self.peek().kind != 'eof' and self.peek().text != ';' and not self.at('apply', 'batch'):
+            self.next()
+
+    # --- types ---
+
+    def cql_type(self):
+        name = self.ident()
+        if name == 'frozen':
+            self.expect('<')
+            inner = self.cql_type()
+            self.expect('>')
+            return inner
+        if name in ('set', 'list'):
+            self.expect('<')
+            inner = self.cql_type()
+            self.expect('>')
+            return (name, inner)
+        if name == 'map':
+            self.expect('<')
+            key = self.cql_type()
+            self.expect(',')
+            value = self.cql_type()
+            self.expect('>')
+            return ('map', key, value)
+        return name
+
+    # --- values ---
+
+    def value(self):
+        token = self.peek()
+        if token.text == '?':
+            self.next()
+            return Param(next(self.params))
+        if token.text == '-':
+            self.next()
+            return -self.value()
+        if token.kind == 'string':
+            self.next()
+            return token.text[1:-1].replace("''", "'")
+        if token.kind == 'uuid':
+            self.next()
+            return uuid.UUID(token.text)
+        if token.kind == 'number':
+            self.next()
+            text = token.text
+            return float(text) if ('.' in text or 'e' in text.lower()) else int(text)
+        if token.text == '{':
+            return self._brace_literal()
+        if token.text == '[':
+            self.next()
+            items = self._items(']')
+            return list(items)
+        if token.text == '(':
+            self.next()
+            return tuple(self._items(')'))
+        if token.kind == 'ident':
+            word = token.text.lower()
+            if word in ('true', 'false'):
+                self.next()
+                return word == 'true'
+            if word == 'null':
+                self.next()
+                return None
+            if self.peek(1).text == '(':
+                self.next()
+                self.next()
+                args = self._items(')')
+                return Call(word, tuple(args))
+        raise InvalidRequest(f"Unexpected value {token.text!r} in: {self.cql}")
+
+    def _items(self, closing):
+        items = []
+        if self.accept(closing):
+            return items
+        while True:
+            items.append(self.value())
+            if self.accept(closing):
+                return items
+            self.expect(',')
+
+    # {a, b} is a set, {'k': v} a map and {field: v} a UDT literal
+    def _brace_literal(self):
+        self.expect('{')
+        if self.accept('}'):
+            return frozenset()
+        if self.peek().kind == 'ident' and self.peek(1).text == ':':
+            fields = {}
+            while True:
+                field = self.ident()
+                self.expect(':')
+                fields[field] = self.value()
+                if self.accept('}'):
+                    return UDTLiteral(fields)
+                self.expect(',')
+        first = self.value()
+        if self.accept(':'):
+            mapping = {first: self.value()}
+            while not self.accept('}'):
+                self.expect(',')
+                key = self.value()
+                self.expect(':')
+                mapping[key] = self.value()
+            return mapping
+        items = [first]
+        while not self.accept('}'):
+            self.expect(',')
+            items.append(self.value())
+        return CollectionLiteral(items)
+
+    # --- statements ---
+
+    def statement(self):
+        if self.accept('begin'):
+            kind = 'LOGGED'
+            if self.accept('unlogged'):
+                kind = 'UNLOGGED'
+            elif self.accept('counter'):
+                kind = 'COUNTER'
+            self.expect('batch')
+            statements = []
+            while not self.accept('apply', 'batch'):
+                statements.append(self.statement())
+                self.accept(';')
+            return Batch(kind, statements)
+        if self.accept('use'):
+            return Keyspace('use', self.ident())
+        if self.accept('drop', 'keyspace'):
+            self.accept('if', 'exists')
+            return Keyspace('drop', self.ident())
+        if self.accept('drop', 'index'):
+            if_exists = self.accept('if', 'exists')
+            return DropIndex(self.name(), if_exists)
+        if self.accept('drop', 'materialized', 'view'):
+            if_exists = self.accept('if', 'exists')
+            return DropView(self.name(), if_exists)
+        if self.accept('drop'):
+            self.skip_to_end()
+            return Noop('drop')
+        if self.accept('create', 'keyspace'):
+            self.accept('if', 'not', 'exists')
+            name = self.ident()
+            self.skip_to_end()
+            return Keyspace('create', name)
+        if self.accept('create', 'table'):
+            return self._create_table()
+        if self.accept('create', 'type'):
+            return self._create_type()
+        if self.accept('create', 'materialized', 'view'):
+            return self._create_view()
+        if self.accept('create', 'index') or self.accept('create', 'custom', 'index'):
+            return self._create_index()
+        if self.accept('create', 'or', 'replace', 'function'):
+            return self._create_function(True)
+        if self.accept('create', 'function'):
+            return self._create_function(False)
+        if self.accept('alter', 'table'):
+            table = self.name()
+            self.expect('add')
+            column = self.ident()
+            return AlterTable(table, column, self.cql_type())
+        if self.accept('alter', 'type'):
+            name = self.name()
+            self.expect('add')
+            field = self.ident()
+            return AlterType(name, field, self.cql_type())
+        if self.accept('create') or self.accept('alter'):
+            # Aggregates, roles and table options: accepted, nothing to maintain in memory
+            self.skip_to_end()
+            return Noop('create')
+        if self.accept('insert', 'into'):
+            return self._insert()
+        if self.accept('update'):
+            return self._update()
+        if self.accept('delete'):
+            return self._delete()
+        if self.accept('select'):
+            return self._select()
+        if self.accept('truncate'):
+            self.accept('table')
+            return Delete(self.name(), [])
+        raise InvalidRequest(f"Unsupported statement: {self.cql}")
+
+    def _create_table(self):
+        if_not_exists = self.accept('if', 'not', 'exists')
+        name = self.name()
+        self.expect('(')
+        columns = OrderedDict()
+        statics = set()
+        primary = None
+        while True:
+            if self.accept('primary', 'key'):
+                primary = self._primary_key()
+            else:
+                column = self.ident()
+                columns[column] = self.cql_type()
+                if self.accept('static'):
+                    statics.add(column)
+                if self.accept('primary', 'key'):
+                    primary = ([column], [])
+            if self.accept(')'):
+                break
+            self.expect(',')
+        descending = set()
+        while self.accept('with') or self.accept('and'):
+            if self.accept('clustering', 'order', 'by'):
+                self.expect('(')
+                while True:
+                    column = self.ident()
+                    if self.accept('desc'):
+                        descending.add(column)
+                    else:
+                        self.accept('asc')
+                    if self.accept(')'):
+                        break
+                    self.expect(',')
+            else:
+                while self.peek().kind != 'eof' and not self.at('and') and not self.at(';'):
+                    self.next()
+        if primary is None:
+            raise InvalidRequest(f"Table {name} has no PRIMARY KEY")
+        partition_key, clustering = primary
+        return CreateTable(TableSchema(name, columns, partition_key, clustering, descending, statics), if_not_exists)
+
+    def _primary_key(self):
+        self.expect('(')
+        if self.accept('('):
+            partition_key = [self.ident()]
+            while self.accept(','):
+                partition_key.append(self.ident())
+            self.expect(')')
+        else:
+            partition_key = [self.ident()]
+        clustering = []
+        while self.accept(','):
+            clustering.append(self.ident())
+        self.expect(')')
+        return partition_key, clustering
+
+    def _create_type(self):
+        if_not_exists = self.accept('if', 'not', 'exists')
+        name = self.name()
+        self.expect('(')
+        fields = OrderedDict()
+        while True:
+            field = self.ident()
+            fields[field] = self.cql_type()
+            if self.accept(')'):
+                break
+            self.expect(',')
+        return CreateType(name, fields, if_not_exists)
+
+    def _create_view(self):
+        if_not_exists = self.accept('if', 'not', 'exists')
+        name = self.name()
+        self.expect('as', 'select')
+        columns = self._column_list_until('from')
+        base = self.name()
+        self.expect('where')
+        where = []
+        while not self.at('primary', 'key'):
+            self.next()
+        self.expect('primary', 'key')
+        partition_key, clustering = self._primary_key()
+        self.skip_to_end()
+        return CreateView(name, base, columns, where, partition_key, clustering, if_not_exists)
+
+    # CREATE [CUSTOM] INDEX [IF NOT EXISTS] [name] ON table (target) [USING 'class'] [WITH OPTIONS ...]
+    def _create_index(self):
+        if_not_exists = self.accept('if', 'not', 'exists')
+        name = None if self.at('on') else self.ident()
+        self.expect('on')
+        table = self.name()
+        self.expect('(')
+        target = self.ident()
+        if self.accept('('):
+            # values(col), keys(col), entries(col), full(col)
+            target = f"{target}({self.ident()})"
+            self.expect(')')
+        self.expect(')')
+        using = None
+        if self.accept('using'):
+            using = self.value()
+        self.skip_to_end()
+        return CreateIndex(name or default_index_name(table, target), table, target, using, if_not_exists)
+
+    def _create_function(self, replace):
+        self.accept('if', 'not', 'exists')
+        name = self.name()
+        self.expect('(')
+        arguments = OrderedDict()
+        while not self.accept(')'):
+            argument = self.ident()
+            arguments[argument] = self.cql_type()
+            self.accept(',')
+        called_on_null = self.accept('called')
+        if not called_on_null:
+            self.expect('returns', 'null')
+        self.expect('on', 'null', 'input')
+        self.expect('returns')
+        returns = self.cql_type()
+        self.expect('language')
+        language = self.ident()
+        self.expect('as')
+        body = self.value()
+        return CreateFunction(name, arguments, returns, language, body, called_on_null, replace)
+
+    def _column_list_until(self, word):
+        columns = []
+        while not self.accept(word):
+            token = self.next()
+            if token.kind == 'ident':
+                columns.append(token.text.lower())
+            elif token.text == '*':
+                columns.append('*')
+        return columns
+
+    def _insert(self):
+        table = self.name()
+        self.expect('(')
+        columns = [self.ident()]
+        while self.accept(','):
+            columns.append(self.ident())
+        self.expect(')')
+        self.expect('values')
+        self.expect('(')
+        values = self._items(')')
+        if_not_exists = self.accept('if', 'not', 'exists')
+        self.skip_clause()
+        if len(columns) != len(values):
+            raise InvalidRequest(f"Column/value count mismatch in: {self.cql}")
+        return Insert(table, columns, values, if_not_exists)
+
+    def _update(self):
+        table = self.name()
+        self.expect('set')
+        assignments = []
+        while True:
+            column = self.ident()
+            self.expect('=')
+            if self.peek().kind == 'ident' and self.peek().text.lower() == column and self.peek(1).text in '+-':
+                self.next()
+                op = self.next().text
+                assignments.append((column, op, self.value()))
+            else:
+                value = self.value()
+                if self.accept('+'):
+                    # prepend form: c = value + c
+                    self.ident()
+                    assignments.append((column, '+', value))
+                else:
+                    assignments.append((column, '=', value))
+            if not self.accept(','):
+                break
+        self.expect('where')
+        return Update(table, assignments, self._conditions())
+
+    def _delete(self):
+        while not self.accept('from'):
+            self.next()
+        table = self.name()
+        where = self._conditions() if self.accept('where') else []
+        conditions = None
+        if self.accept('if'):
+            conditions = [] if self.accept('exists') else self._conditions()
+        return Delete(table, where, conditions)
+
+    def _select(self):
+        selectors = []
+        while True:
+            if self.accept('*'):
+                selectors.append(('*', None, None))
+            else:
+                name = self.ident()
+                if self.accept('('):
+                    args = []
+                    if self.accept('*'):
+                        args.append('*')
+                        self.expect(')')
+                    elif not self.accept(')'):
+                        args.append(self.ident())
+                        while self.accept(','):
+                            args.append(self.ident())
+                        self.expect(')')
+                    alias = f"system_{name}_{'_'.join(a for a in args if a != '*')}".rstrip('_')
+                    if name == 'count':
+                        alias = 'count'
+                    if self.accept('as'):
+                        alias = self.ident()
+                    selectors.append((name, tuple(args), alias))
+                else:
+                    alias = self.ident() if self.accept('as') else name
+                    selectors.append(('column', name, alias))
+            if not self.accept(','):
+                break
+        self.expect('from')
+        table = self.name()
+        where = self._conditions() if self.accept('where') else []
+        order = None
+        if self.accept('order', 'by'):
+            column = self.ident()
+            descending = self.accept('desc')
+            if not descending:
+                self.accept('asc')
+            order = (column, descending)
+        limit = None
+        if self.accept('limit'):
+            limit = self.value()
+        self.accept('allow', 'filtering')
+        self.accept(';')
+        return Select(table, selectors, where, order, limit)
+
+    def _conditions(self):
+        conditions = []
+        while True:
+            if self.accept('token'):
+                self.expect('(')
+                columns = [self.ident()]
+                while self.accept(','):
+                    columns.append(self.ident())
+                self.expect(')')
+                column = ('token',) + tuple(columns)
+            else:
+                column = self.ident()
+            op = self.next().text.upper()
+            if op == 'IN':
+                # IN (a, b, ...) or IN ? with the whole list bound to one marker
+                value = ('in', self._items(')') if self.accept('(') else self.value())
+            else:
+                if op not in ('=', '<', '>', '<=', '>=', 'CONTAINS'):
+                    raise InvalidRequest(f"Unsupported operator {op} in: {self.cql}")
+                value = self.value()
+            conditions.append((column, op, value))
+            if not self.accept('and'):
+                return conditions
+
+
+class CollectionLiteral(list):
+    pass
+
+
+class UDTLiteral(dict):
+    pass
+
+
+def parse(cql):
+    parser = _Parser(cql)
+    statement = parser.statement()
+    parser.accept(';')
+    if parser.peek().kind != 'eof':
+        raise InvalidRequest(f"Unexpected trailing input {parser.peek().text!r} in: {cql}")
+    return statement
+
+
+# ---------------------------------------------------------------------------------------------
+# Schema, type coercion and ordering
+# ---------------------------------------------------------------------------------------------
+
+# Parsed form of a CQL type such as 'set<frozen<video_metadata>>'
+def parse_type(text):
+    return _Parser(text).cql_type()
+
+
+# Cassandra names an unnamed index <table>_<column>_idx, whatever the target function
+def default_index_name(table, target):
+    column = target[target.index('(') + 1:-1] if '(' in target else target
+    return f"{table}_{column}_idx"
+
+
+NATIVE_TYPES = {'ascii', 'bigint', 'blob', 'boolean', 'counter', 'date', 'decimal', 'double', 'duration',
+                'float', 'inet', 'int', 'smallint', 'text', 'time', 'timestamp', 'timeuuid', 'tinyint',
+                'uuid', 'varchar', 'varint'}
+
+
+# CQL spelling of a parsed type, as the driver's schema metadata reports it
+def cql_type_name(ctype, nested=False):
+    if isinstance(ctype, tuple):
+        name = f"{ctype[0]}<{', '.join(cql_type_name(t, True) for t in ctype[1:])}>"
+        return f"frozen<{name}>" if nested else name
+    if ctype == 'varchar':
+        return 'text'
+    if nested and ctype not in NATIVE_TYPES:
+        return f"frozen<{ctype}>"
+    return ctype
+
+
+class TableSchema:
+    def __init__(self, name, columns, partition_key, clustering, descending=(), statics=(), counters=None):
+        self.name = name
+        self.columns = OrderedDict(columns)
+        self.partition_key = list(partition_key)
+        self.clustering = list(clustering)
+        self.descending = set(descending)
+        self.statics = set(statics)
+        self.primary_key = self.partition_key + self.clustering
+        self._derive()
+
+    def _derive(self):
+        self.regular = [c for c in self.columns if c not in self.primary_key and c not in self.statics]
+        self.is_counter = any(t == 'counter' for t in self.columns.values())
+        # SELECT * order: partition key, clustering columns, then everything else by name
+        self.star = self.primary_key + sorted(c for c in self.columns if c not in self.primary_key)
+
+    def add_column(self, column, ctype):
+        if column in self.columns:
+            raise InvalidRequest(f"Column {column} already exists in table {self.name}")
+        self.columns[column] = ctype
+        self._derive()
+
+    def column_type(self, column):
+        try:
+            return self.columns[column]
+        except KeyError:
+            raise InvalidRequest(f"Undefined column name {column} in table {self.name}")
+
+
+class _Descending:
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __gt__(self, other):
+        return other.key > self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __le__(self, other):
+        return other.key <= self.key
+
+    def __ge__(self, other):
+        return other.key >= self.key
+
+
+# Sort key matching Cassandra's comparator for a value of the given type
+def order_key(value, ctype):
+    if ctype == 'timeuuid':
+        return (value.time, value.bytes)
+    if ctype == 'uuid':
+        return (value.version or 0, value.time if value.version == 1 else 0, value.bytes)
+    return value
+
+
+_TIMESTAMP_RE = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})(?:[ T](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?)?\s*(Z|[+-]\d{2}:?\d{2})?$")
+
+
+def parse_timestamp(text):
+    match = _TIMESTAMP_RE.match(text.strip())
+    if match is None:
+        raise InvalidRequest(f"Unable to coerce '{text}' to a timestamp")
+    year, month, day, hour, minute, second, fraction, tz = match.groups()
+    value = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+                     int((fraction or '0').ljust(6, '0')))
+    if tz and tz != 'Z':
+        sign = 1 if tz[0] == '+' else -1
+        digits = tz[1:].replace(':', '')
+        value -= sign * timedelta(hours=int(digits[:2]), minutes=int(digits[2:]))
+    return value
+
+
+_udt_classes = {}
+
+
+# UDT values are namedtuples built at CREATE TYPE time; they pickle by (name, fields) so
+# storage backends can persist them
+def udt_class(name, fields):
+    key = (name, tuple(fields))
+    cls = _udt_classes.get(key)
+    if cls is None:
+        base = namedtuple(name, list(fields))
+        cls = _udt_classes[key] = type(name, (base,), {
+            '__slots__': (),
+            '__reduce__': lambda self: (_make_udt, (key, tuple(self))),
+        })
+    return cls
+
+
+def _make_udt(key, values):
+    return udt_class(*key)(*values)
+
+
+class TypeRegistry:
+    def __init__(self):
+        self.types = {}
+
+    def define(self, name, fields):
+        self.types[name] = (OrderedDict(fields), udt_class(name, fields))
+
+    def add_field(self, name, field, ctype):
+        if name not in self.types:
+            raise InvalidRequest(f"Unknown type {name}")
+        fields = OrderedDict(self.types[name][0])
+        if field in fields:
+            raise InvalidRequest(f"Field {field} already exists in type {name}")
+        fields[field] = ctype
+        self.define(name, fields)
+
+    # Coerce a bound or literal value to the Python value the driver would return for this type
+    def coerce(self, value, ctype, nested=False):
+        if value is None:
+            return None
+        if isinstance(ctype, tuple):
+            kind = ctype[0]
+            if kind == 'set':
+                items = [self.coerce(v, ctype[1], True) for v in value]
+                return frozenset(items) if nested else SortedSet(items)
+            if kind == 'list':
+                items = [self.coerce(v, ctype[1], True) for v in value]
+                return tuple(items) if nested else items
+            if kind == 'map':
+                return {self.coerce(k, ctype[1], True): self.coerce(v, ctype[2], True)
+                        for k, v in sorted(value.items(), key=lambda kv: kv[0])}
+        if ctype in self.types:
+            fields, cls = self.types[ctype]
+            if isinstance(value, dict):
+                return cls(**{f: self.coerce(value.get(f), t, True) for f, t in fields.items()})
+            return cls(*(self.coerce(v, t, True) for v, t in zip(value, fields.values())))
+        if ctype in ('uuid', 'timeuuid'):
+            return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+        if ctype == 'timestamp':
+            if isinstance(value, datetime):
+                if value.tzinfo is not None:
+                    value = value.astimezone(timezone.utc).replace(tzinfo=None)
+                return value
+            if isinstance(value, date):
+                return datetime(value.year, value.month, value.day)
+            if isinstance(value, (int, float)):
+                return datetime(1970, 1, 1) + timedelta(milliseconds=value)
+            return parse_timestamp(str(value))
+        if ctype in ('int', 'bigint', 'counter', 'smallint', 'tinyint', 'varint'):
+            return int(value)
+        if ctype in ('double', 'float', 'decimal'):
+            return float(value)
+        if ctype == 'boolean':
+            return bool(value)
+        if ctype in ('text', 'varchar', 'ascii'):
+            return str(value)
+        return value
+
+
+# Serialized partition key bytes, as the driver builds routing keys
+def _serialize_component(value, ctype):
+    if ctype in ('uuid', 'timeuuid'):
+        return value.bytes
+    if ctype in ('text', 'varchar', 'ascii'):
+        return value.encode('utf-8')
+    if ctype == 'int':
+        return struct.pack('>i', value)
+    if ctype in ('bigint', 'counter'):
+        return struct.pack('>q', value)
+    if ctype == 'timestamp':
+        return struct.pack('>q', int((value - datetime(1970, 1, 1)).total_seconds() * 1000))
+    if ctype == 'boolean':
+        return b'\x01' if value else b'\x00'
+    return str(value).encode('utf-8')
+
+
+# Murmur3 token of a partition key, matching Cassandra's default partitioner
+def partition_token(schema, pk):
+    parts = [_serialize_component(v, schema.columns[c]) for c, v in zip(schema.partition_key, pk)]
+    if len(parts) == 1:
+        return Murmur3Token.hash_fn(parts[0])
+    return Murmur3Token.hash_fn(b''.join(struct.pack('>H', len(p)) + p + b'\x00' for p in parts))
+
+
+# ---------------------------------------------------------------------------------------------
+# Storage
+# ---------------------------------------------------------------------------------------------
+
+class Partition:
+    def __init__(self):
+        self.static = {}
+        self.rows = {}
+        # Clustering keys and their sort keys, kept in clustering order
+        self.order = []
+        self.keys = []
+
+
+# In-memory storage for one table: partition key tuple -> Partition kept in clustering order.
+# Storage backends (see engine.py) implement the same small interface.
+class MemoryTable:
+    def __init__(self, schema):
+        self.schema = schema
+        self.partitions = {}
+        self._tokens = {}
+        self._ring = None
+
+    # Token of a partition key, hashed once per key since token-range scans test every key per page
+    def token(self, pk):
+        token = self._tokens.get(pk)
+        if token is None:
+            token = self._tokens[pk] = partition_token(self.schema, pk)
+        return token
+
+    # (tokens, partition keys) of the whole table in token order, as a full-table scan on Cassandra
+    # returns them. Kept until a partition is added or removed, so each page of a scan can find
+    # where it resumes by bisecting instead of sorting the table again.
+    def ring(self):
+        ring = self._ring
+        if ring is None:
+            keys = sorted(self.partition_keys(), key=self.token)
+            ring = self._ring = ([self.token(pk) for pk in keys], keys)
+        return ring
+
+    def clustering_sort_key(self, clustering):
+        key = []
+        for column, value in zip(self.schema.clustering, clustering):
+            k = order_key(value, self.schema.columns[column])
+            key.append(_Descending(k) if column in self.schema.descending else k)
+        return tuple(key)
+
+    def _partition(self, pk, create=True):
+        partition = self.partitions.get(pk)
+        if partition is None and create:
+            partition = self.partitions[pk] = Partition()
+            self._ring = None
+        return partition
+
+    def upsert(self, pk, ck, values, static_values):
+        partition = self._partition(pk)
+        partition.static.update(static_values)
+        if ck is None:
+            return
+        row = partition.rows.get(ck)
+        if row is None:
+            sort_key = self.clustering_sort_key(ck)
+            index = bisect.bisect_left(partition.order, sort_key)
+            partition.order.insert(index, sort_key)
+            partition.keys.insert(index, ck)
+            row = partition.rows[ck] = {}
+        row.update(values)
+
+    def delete(self, pk, ck=None):
+        if pk is None:
+            self.partitions.clear()
+            self._ring = None
+            return
+        partition = self.partitions.get(pk)
+        if partition is None:
+            return
+        if ck is None:
+            del self.partitions[pk]
+            self._ring = None
+            return
+        if ck in partition.rows:
+            del partition.rows[ck]
+            index = partition.keys.index(ck)
+            del partition.order[index]
+            del partition.keys[index]
+
+    def get_row(self, pk, ck):
+        partition = self.partitions.get(pk)
+        if partition is None:
+            return None
+        return partition.rows.get(ck)
+
+    # Yield (ck, row, static) in clustering order, reversed when asked
+    def read(self, pk, reverse=False):
+        partition = self.partitions.get(pk)
+        if partition is None:
+            return
+        keys = reversed(partition.keys) if reverse else partition.keys
+        if not partition.keys and partition.static:
+            yield None, {}, partition.static
+            return
+        for ck in list(keys):
+            yield ck, partition.rows[ck], partition.static
+
+    def partition_keys(self):
+        return list(self.partitions)
+
+
+# ---------------------------------------------------------------------------------------------
+# Executor
+# ---------------------------------------------------------------------------------------------
+
+_OPS = {
+    '=': lambda a, b: a == b,
+    '<': lambda a, b: a < b,
+    '>': lambda a, b: a > b,
+    '<=': lambda a, b: a <= b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+class MemoryDatabase:
+    table_class = MemoryTable
+
+    def __init__(self):
+        self.keyspaces = set()
+        self.schemas = {}
+        self.tables = {}
+        self.views = {}
+        self.indexes = {}
+        self.functions = {}
+        self.types = TypeRegistry()
+        self.lock = threading.RLock()
+        self._row_classes = {}
+
+    def new_table(self, schema):
+        return self.table_class(schema)
+
+    def create_table(self, schema):
+        self.schemas[schema.name] = schema
+        self.tables[schema.name] = self.new_table(schema)
+
+    def table(self, name):
+        try:
+            return self.schemas[name], self.tables[name]
+        except KeyError:
+            raise InvalidRequest(f"unconfigured table {name}")
+
+    def _resolve(self, value, params, ctype=None):
+        if isinstance(value, Param):
+            try:
+                value = params[value.index]
+            except (IndexError, TypeError):
+                raise InvalidRequest("Not enough bound parameters")
+            if value is UNSET_VALUE:
+                return value
+        elif isinstance(value, Call):
+            if value.name in ('now', 'timeuuid'):
+                value = uuid.uuid1()
+            elif value.name in ('totimestamp', 'dateof') and value.args:
+                value = datetime_from_uuid1(self._resolve(value.args[0], params))
+            elif value.name in ('mintimeuuid', 'maxtimeuuid') and value.args:
+                moment = self._resolve(value.args[0], params, 'timestamp')
+                seconds = (moment - datetime(1970, 1, 1)).total_seconds()
+                value = (min_uuid_from_time if value.name == 'mintimeuuid' else max_uuid_from_time)(seconds)
+            else:
+                raise InvalidRequest(f"Unsupported function {value.name}()")
+        elif isinstance(value, tuple) and len(value) == 2 and value[0] == 'in':
+            items = self._resolve(value[1], params) if isinstance(value[1], Param) else value[1]
+            return [self._resolve(v, params, ctype) for v in items]
+        if ctype is not None:
+            return self.types.coerce(value, ctype)
+        return value
+
+    # Returns (column names, rows as tuples, paging state); only a SELECT has rows, and only a
+    # SELECT given a fetch_size is paged
+    def execute(self, statement, params=(), fetch_size=None, paging_state=None):
+        with self.lock:
+            kind = type(statement)
+            if kind is Select:
+                return self._select(statement, params, fetch_size, paging_state)
+            if kind is Insert and statement.if_not_exists:
+                return self._insert_if_not_exists(statement, params) + (None,)
+            if kind is Delete and statement.conditions is not None:
+                return self._delete_if(statement, params) + (None,)
+            if kind is Insert:
+                self._insert(statement, params)
+            elif kind is Update:
+                self._update(statement, params)
+            elif kind is Delete:
+                self._delete(statement, params)
+            elif kind is Batch:
+                for inner in statement.statements:
+                    if type(inner) is Bound:
+                        self.execute(inner.statement, inner.params)
+                    else:
+                        self.execute(inner, params)
+            elif kind is CreateTable:
+                if not (statement.if_not_exists and statement.schema.name in self.schemas):
+                    self.create_table(statement.schema)
+            elif kind is CreateType:
+                if not (statement.if_not_exists and statement.name in self.types.types):
+                    self.types.define(statement.name, statement.fields)
+            elif kind is CreateView:
+                if not (statement.if_not_exists and statement.name in self.views):
+                    self.create_view(statement)
+            elif kind is CreateIndex:
+                self.create_index(statement)
+            elif kind is DropIndex:
+                self.drop_index(statement)
+            elif kind is DropView:
+                self.drop_view(statement)
+            elif kind is CreateFunction:
+                self.create_function(statement)
+            elif kind is AlterTable:
+                self.table(statement.table)[0].add_column(statement.column, statement.ctype)
+            elif kind is AlterType:
+                self.types.add_field(statement.name, statement.field, statement.ctype)
+            elif kind is Keyspace:
+                self._keyspace(statement)
+            return [], [], None
+
+    def _keyspace(self, statement):
+        if statement.action == 'create':
+            self.keyspaces.add(statement.name)
+        elif statement.action == 'drop' and statement.name in self.keyspaces:
+            self.keyspaces.discard(statement.name)
+            self.drop_tables()
+
+    def drop_tables(self):
+        self.schemas.clear()
+        self.tables.clear()
+        self.views.clear()
+        self.indexes.clear()
+        self.functions.clear()
+        self.types = TypeRegistry()
+
+    def close(self):
+        pass
+
+    # A materialized view gets a table of its own that every write to the base table keeps in step
+    # the way Cassandra does it: read the base row first, then move the view row if its key changed
+    def create_view(self, statement):
+        base, base_table = self.table(statement.base)
+        names = list(base.columns) if '*' in statement.columns else list(statement.columns)
+        names += [c for c in statement.partition_key + statement.clustering if c not in names]
+        self.views[statement.name] = statement
+        self.create_table(TableSchema(statement.name, [(c, base.column_type(c)) for c in names],
+                                      statement.partition_key, statement.clustering))
+        if not self.tables[statement.name].partition_keys():
+            for pk in base_table.partition_keys():
+                self._update_views([statement], {}, self._base_rows(base, base_table, pk, None))
+
+    def drop_view(self, statement):
+        if statement.name not in self.views:
+            if statement.if_exists:
+                return
+            raise InvalidRequest(f"Materialized view {statement.name} doesn't exist")
+        del self.views[statement.name]
+        del self.schemas[statement.name]
+        del self.tables[statement.name]
+
+    def _views_on(self, table):
+        return [view for view in self.views.values() if view.base == table]
+
+    # Full rows (key columns included) that a write to (pk, ck) touches; ck None means the partition
+    def _base_rows(self, schema, table, pk, ck):
+        keys = dict(zip(schema.partition_key, pk))
+        if ck is not None:
+            row = table.get_row(pk, ck)
+            return {} if row is None else {ck: dict(keys, **dict(zip(schema.clustering, ck)), **row)}
+        return {rck: dict(keys, **dict(zip(schema.clustering, rck or ())), **static, **row)
+                for rck, row, static in table.read(pk)}
+
+    def _update_views(self, views, before, after):
+        for view in views:
+            schema, table = self.table(view.name)
+            for ck in before.keys() | after.keys():
+                old_key = self._view_key(schema, before.get(ck))
+                new_key = self._view_key(schema, after.get(ck))
+                if old_key is not None and old_key != new_key:
+                    table.delete(*old_key)
+                if new_key is not None:
+                    table.upsert(*new_key, {c: after[ck].get(c) for c in schema.regular}, {})
+
+    # (pk, ck) of the view row for a base row, or None when a key column is null
+    def _view_key(self, schema, values):
+        if values is None or any(values.get(c) is None for c in schema.primary_key):
+            return None
+        return self._key(schema, schema.partition_key, values), self._key(schema, schema.clustering, values)
+
+    def _writable(self, name):
+        if name in self.views:
+            raise InvalidRequest(f"Cannot directly modify a materialized view: {name}")
+        return self.table(name)
+
+    # Indexes and functions are recorded for schema metadata only; queries never use them
+    def create_index(self, statement):
+        self.table(statement.table)
+        if statement.name in self.indexes:
+            if statement.if_not_exists:
+                return
+            raise InvalidRequest(f"Index {statement.name} already exists")
+        self.indexes[statement.name] = statement
+
+    def drop_index(self, statement):
+        if statement.name not in self.indexes:
+            if statement.if_exists:
+                return
+            raise InvalidRequest(f"Index {statement.name} doesn't exist")
+        del self.indexes[statement.name]
+
+    def create_function(self, statement):
+        if statement.name in self.functions and not statement.replace:
+            raise InvalidRequest(f"Function {statement.name} already exists")
+        self.functions[statement.name] = statement
+
+    # Driver schema metadata (cluster.metadata) describing what has been created so far
+    def schema_metadata(self):
+        metadata = Metadata()
+        with self.lock:
+            for name in self.keyspaces:
+                keyspace = metadata.keyspaces[name] = KeyspaceMetadata(
+                    name, True, 'SimpleStrategy', {'replication_factor': '1'})
+                for type_name, (fields, _) in self.types.types.items():
+                    keyspace.user_types[type_name] = UserType(
+                        name, type_name, list(fields), [cql_type_name(t, True) for t in fields.values()])
+                for schema in self.schemas.values():
+                    if schema.name in self.views:
+                        continue
+                    table = keyspace.tables[schema.name] = TableMetadata(name, schema.name)
+                    for column, ctype in schema.columns.items():
+                        table.columns[column] = ColumnMetadata(table, column, cql_type_name(ctype),
+                                                               column in schema.statics, column in schema.descending)
+                    table.partition_key = [table.columns[c] for c in schema.partition_key]
+                    table.clustering_key = [table.columns[c] for c in schema.clustering]
+                for index in self.indexes.values():
+                    options = {'target': index.target}
+                    if index.using:
+                        options['class_name'] = index.using
+                    kind = 'CUSTOM' if index.using else 'COMPOSITES'
+                    keyspace.indexes[index.name] = keyspace.tables[index.table].indexes[index.name] = \
+                        IndexMetadata(name, index.table, index.name, kind, options)
+                for view in self.views.values():
+                    keyspace.views[view.name] = MaterializedViewMetadata(name, view.name, view.base, False, '', {})
+                    if view.base in keyspace.tables:
+                        keyspace.tables[view.base].views[view.name] = keyspace.views[view.name]
+                for function in self.functions.values():
+                    metadata_function = Function(
+                        name, function.name, [cql_type_name(t) for t in function.arguments.values()],
+                        list(function.arguments), cql_type_name(function.returns), function.language,
+                        function.body, function.called_on_null, False, False, [])
+                    keyspace.functions[metadata_function.signature] = metadata_function
+        return metadata
+
+    def _key(self, schema, columns, values):
+        return tuple(values[c] for c in columns)
+
+    def _insert(self, statement, params):
+        schema, table = self._writable(statement.table)
+        values = {c: self._resolve(v, params, schema.column_type(c)) for c, v in zip(statement.columns, statement.values)}
+        # An unset value leaves the column as it was instead of writing a tombstone
+        values = {c: v for c, v in values.items() if v is not UNSET_VALUE}
+        missing = [c for c in schema.primary_key if values.get(c) is None]
+        if missing:
+            raise InvalidRequest(f"Missing mandatory PRIMARY KEY part {missing[0]}")
+        pk = self._key(schema, schema.partition_key, values)
+        ck = self._key(schema, schema.clustering, values)
+        row = {c: v for c, v in values.items() if c in schema.regular}
+        static = {c: v for c, v in values.items() if c in schema.statics}
+        self._upsert(statement.table, schema, table, pk, ck, row, static)
+
+    # Lightweight transactions. The database lock makes the read and the write one step; as on
+    # Cassandra the result has an [applied] column, followed by the current row when not applied.
+    def _insert_if_not_exists(self, statement, params):
+        schema, table = self._writable(statement.table)
+        keys = {c: self._resolve(v, params, schema.column_type(c))
+                for c, v in zip(statement.columns, statement.values) if c in schema.primary_key}
+        current = self._current_row(schema, table, keys)
+        if current is not None:
+            return ['[applied]'] + list(schema.columns), [(False,) + tuple(current.get(c) for c in schema.columns)]
+        self._insert(statement, params)
+        return ['[applied]'], [(True,)]
+
+    def _delete_if(self, statement, params):
+        schema, table = self._writable(statement.table)
+        keys = {c: self._resolve(v, params, schema.column_type(c)) for c, op, v in statement.where if op == '='}
+        current = self._current_row(schema, table, keys)
+        conditions = [(column, op, self._resolve(value, params, schema.column_type(column)))
+                      for column, op, value in statement.conditions]
+        if current is None or not self._matches(schema, current, conditions):
+            columns = [column for column, _, _ in conditions]
+            return (['[applied]'] + columns,
+                    [(False,) + tuple(current.get(c) if current else None for c in columns)])
+        self._delete(statement, params)
+        return ['[applied]'], [(True,)]
+
+    # Every column of the row at a full primary key, or None when there is no such row
+    def _current_row(self, schema, table, keys):
+        missing = [c for c in schema.primary_key if keys.get(c) is None]
+        if missing:
+            raise InvalidRequest(f"Missing mandatory PRIMARY KEY part {missing[0]}")
+        pk = self._key(schema, schema.partition_key, keys)
+        ck = self._key(schema, schema.clustering, keys)
+        row = table.get_row(pk, ck)
+        if row is None:
+            return None
+        return dict(keys, **row)
+
+    def _upsert(self, name, schema, table, pk, ck, row, static):
+        views = self._views_on(name)
+        before = self._base_rows(schema, table, pk, ck) if views else None
+        table.upsert(pk, ck, row, static)
+        if views:
+            self._update_views(views, before, self._base_rows(schema, table, pk, ck))
+
+    def _update(self, statement, params):
+        schema, table = self._writable(statement.table)
+        keys = {}
+        for column, op, value in statement.where:
+            if op == '=':
+                keys[column] = self._resolve(value, params, schema.column_type(column))
+        for column in schema.partition_key:
+            if column not in keys:
+                raise InvalidRequest(f"Missing mandatory PRIMARY KEY part {column}")
+        pk = self._key(schema, schema.partition_key, keys)
+        ck = None
+        if all(c in keys for c in schema.clustering):
+            ck = self._key(schema, schema.clustering, keys)
+        current = (table.get_row(pk, ck) if ck is not None else None) or {}
+        row, static = {}, {}
+        for column, op, value in statement.assignments:
+            ctype = schema.column_type(column)
+            target = static if column in schema.statics else row
+            resolved = self._resolve(value, params, ctype)
+            if resolved is UNSET_VALUE:
+                continue
+            if op == '=':
+                target[column] = resolved
+                continue
+            if ctype == 'counter':
+                delta = int(resolved)
+                target[column] = (current.get(column) or 0) + (delta if op == '+' else -delta)
+                continue
+            delta = resolved
+            existing = current.get(column)
+            if isinstance(ctype, tuple) and ctype[0] == 'set':
+                merged = set(existing or ()) | set(delta) if op == '+' else set(existing or ()) - set(delta)
+            elif isinstance(ctype, tuple) and ctype[0] == 'map':
+                merged = dict(existing or {})
+                if op == '+':
+                    merged.update(delta)
+                else:
+                    for k in delta:
+                        merged.pop(k, None)
+            elif op == '+':
+                merged = list(existing or []) + list(delta)
+            else:
+                merged = [v for v in existing or [] if v not in delta]
+            target[column] = self.types.coerce(merged, ctype)
+        self._upsert(statement.table, schema, table, pk, ck, row, static)
+
+    def _delete(self, statement, params):
+        schema, table = self._writable(statement.table)
+        views = self._views_on(statement.table)
+        if not statement.where:
+            table.delete(None)
+            for view in views:
+                self.table(view.name)[1].delete(None)
+            return
+        keys = {c: self._resolve(v, params, schema.column_type(c)) for c, op, v in statement.where if op == '='}
+        pk = self._key(schema, schema.partition_key, keys)
+        ck = None
+        if schema.clustering and all(c in keys for c in schema.clustering):
+            ck = self._key(schema, schema.clustering, keys)
+        before = self._base_rows(schema, table, pk, ck) if views else None
+        table.delete(pk, ck)
+        if views:
+            self._update_views(views, before, {})
+
+    def _row_class(self, names):
+        cls = self._row_classes.get(names)
+        if cls is None:
+            # Renaming keeps columns such as [applied] that are not valid field names
+            cls = self._row_classes[names] = namedtuple('Row', names, rename=True)
+        return cls
+
+    # One page of a SELECT. With a fetch_size, reading stops once the page is full (and one row past
+    # it, to know whether another page follows), and the paging state records where the last row
+    # sits: its partition and clustering key, plus the rows returned so far so a LIMIT holds across
+    # pages. The next page resumes right after that row, so each page costs its own rows rather than
+    # everything before it. Without a fetch_size every row comes back at once.
+    def _select(self, statement, params, fetch_size=None, paging_state=None):
+        schema, table = self.table(statement.table)
+        pk_values = {}
+        filters = []
+        token_filters = []
+        for column, op, value in statement.where:
+            if isinstance(column, tuple):
+                token_filters.append((op, int(self._resolve(value, params))))
+                continue
+            ctype = schema.column_type(column)
+            if op == 'CONTAINS':
+                filters.append((column, op, self._resolve(value, params, ctype[1] if isinstance(ctype, tuple) else ctype)))
+                continue
+            resolved = self._resolve(value, params, ctype)
+            if column in schema.partition_key and op in ('=', 'IN'):
+                pk_values[column] = resolved if op == 'IN' else [resolved]
+            else:
+                filters.append((column, op, resolved))
+
+        if all(c in pk_values for c in schema.partition_key):
+            keys = [tuple(combo) for combo in itertools.product(*(pk_values[c] for c in schema.partition_key))]
+            if token_filters:
+                keys = self._filter_tokens(table, keys, token_filters)
+            tokens = None
+            lo, hi = 0, len(keys)
+        else:
+            tokens, keys = table.ring()
+            lo, hi = self._token_bounds(tokens, token_filters)
+            for column, values in pk_values.items():
+                filters.append((column, 'IN', values))
+
+        reverse = False
+        if statement.order is not None and schema.clustering:
+            column, descending = statement.order
+            reverse = descending != (schema.clustering[0] in schema.descending)
+
+        names, extractors, aggregate = self._selection(schema, statement.selectors)
+        limit = self._resolve(statement.limit, params) if statement.limit is not None else None
+        if aggregate:
+            count = sum(1 for _ in self._rows(schema, table, keys, lo, hi, reverse, filters))
+            return names, [(count,)], None
+
+        after = None
+        returned = 0
+        if paging_state:
+            pk, ck, returned = self._decode_position(schema, paging_state)
+            lo, after = self._resume(table, keys, tokens, lo, hi, pk, ck)
+        rows = []
+        last = None
+        more = False
+        for pk, ck, values in self._rows(schema, table, keys, lo, hi, reverse, filters, after):
+            if limit is not None and returned + len(rows) >= limit:
+                break
+            if fetch_size and len(rows) >= fetch_size:
+                more = True
+                break
+            rows.append(tuple(extract(values) for extract in extractors))
+            last = pk, ck
+        if not more:
+            return names, rows, None
+        return names, rows, self._encode_position(schema, last[0], last[1], returned + len(rows))
+
+    # Matching rows of keys[lo:hi] as (pk, ck, column values). `after` is (pk, clustering sort key) of
+    # a row already returned; the first partition then starts just past it.
+    def _rows(self, schema, table, keys, lo, hi, reverse, filters, after=None):
+        for index in range(lo, hi):
+            pk = keys[index]
+            base = dict(zip(schema.partition_key, pk))
+            skip = after[1] if after is not None and after[0] == pk else None
+            for ck, row, static in table.read(pk, reverse):
+                if skip is not None:
+                    # A partition's static-only row is its last, so nothing follows it
+                    if ck is None:
+                        break
+                    sort_key = table.clustering_sort_key(ck)
+                    if (sort_key >= skip) if reverse else (sort_key <= skip):
+                        continue
+                    skip = None
+                values = dict(base)
+                if ck is not None:
+                    values.update(zip(schema.clustering, ck))
+                values.update(static)
+                values.update(row)
+                if self._matches(schema, values, filters):
+                    yield pk, ck, values
+
+    # Index bounds in a token-ordered ring of the keys that pass every token() restriction
+    def _token_bounds(self, tokens, token_filters):
+        lo, hi = 0, len(tokens)
+        for op, bound in token_filters:
+            if op in ('>', '>='):
+                lo = max(lo, (bisect.bisect_right if op == '>' else bisect.bisect_left)(tokens, bound))
+            if op in ('<', '<='):
+                hi = min(hi, (bisect.bisect_left if op == '<' else bisect.bisect_right)(tokens, bound))
+            if op == '=':
+                lo = max(lo, bisect.bisect_left(tokens, bound))
+                hi = min(hi, bisect.bisect_right(tokens, bound))
+        return lo, max(lo, hi)
+
+    # Where the page after (pk, ck) starts: the index of pk's partition and the position inside it
+    # to read past. If pk has since been deleted, the scan picks up at the next token instead.
+    def _resume(self, table, keys, tokens, lo, hi, pk, ck):
+        if tokens is None:
+            index = keys.index(pk, lo, hi)
+        else:
+            token = table.token(pk)
+            index = bisect.bisect_left(tokens, token, lo, hi)
+            while index < hi and tokens[index] == token and keys[index] != pk:
+                index += 1
+            if index >= hi or keys[index] != pk:
+                return bisect.bisect_right(tokens, token, lo, hi), None
+        if ck is None:
+            return index + 1, None
+        return index, (pk, table.clustering_sort_key(ck))
+
+    # The paging state is JSON so it can travel as an opaque cursor; keys are decoded back through
+    # the column types
+    def _encode_position(self, schema, pk, ck, returned):
+        def encode(value):
+            if isinstance(value, bytes):
+                return value.hex()
+            if isinstance(value, (uuid.UUID, datetime, date)):
+                return str(value)
+            return value
+        return json.dumps([[encode(v) for v in pk], None if ck is None else [encode(v) for v in ck],
+                           returned]).encode()
+
+    def _decode_position(self, schema, paging_state):
+        def decode(values, columns):
+            decoded = []
+            for value, column in zip(values, columns):
+                ctype = schema.columns[column]
+                if ctype == 'timestamp':
+                    decoded.append(datetime.fromisoformat(value))
+                elif ctype == 'date':
+                    decoded.append(date.fromisoformat(value))
+                elif ctype == 'blob':
+                    decoded.append(bytes.fromhex(value))
+                else:
+                    decoded.append(self.types.coerce(value, ctype))
+            return tuple(decoded)
+        try:
+            pk, ck, returned = json.loads(paging_state)
+            return (decode(pk, schema.partition_key), None if ck is None else decode(ck, schema.clustering),
+                    returned)
+        except (ValueError, TypeError) as e:
+            raise InvalidRequest(f"Invalid paging state: {e}")
+
+    def _filter_tokens(self, table, keys, token_filters):
+        kept = []
+        for pk in keys:
+            token = table.token(pk)
+            if all(_OPS[op](token, bound) for op, bound in token_filters):
+                kept.append((token, pk))
+        kept.sort(key=lambda item: item[0])
+        return [pk for _, pk in kept]
+
+    def _matches(self, schema, values, filters):
+        for column, op, expected in filters:
+            actual = values.get(column)
+            if op == 'IN':
+                if actual not in expected:
+                    return False
+            elif op == 'CONTAINS':
+                if actual is None or expected not in actual:
+                    return False
+            else:
+                if actual is None:
+                    return False
+                ctype = schema.columns[column]
+                if not _OPS[op](order_key(actual, ctype), order_key(expected, ctype)):
+                    return False
+        return True
+
+    def _selection(self, schema, selectors):
+        names, extractors = [], []
+        aggregate = False
+        for kind, arg, alias in selectors:
+            if kind == '*':
+                for column in schema.star:
+                    names.append(column)
+                    extractors.append(lambda values, c=column: values.get(c))
+            elif kind == 'column':
+                schema.column_type(arg)
+                names.append(alias)
+                extractors.append(lambda values, c=arg: values.get(c))
+            elif kind in ('dateof', 'totimestamp'):
+                names.append(alias)
+                extractors.append(lambda values, c=arg[0]: datetime_from_uuid1(values[c]) if values.get(c) else None)
+            elif kind == 'unixtimestampof' or kind == 'tounixtimestamp':
+                names.append(alias)
+                extractors.append(lambda values, c=arg[0]: int((datetime_from_uuid1(values[c]) - datetime(1970, 1, 1))
+                                                           .total_seconds() * 1000) if values.get(c) else None)
+            elif kind == 'token':
+                names.append(alias)
+                extractors.append(lambda values: partition_token(schema, tuple(values[c] for c in schema.partition_key)))
+            elif kind == 'count':
+                names.append('count')
+                extractors.append(lambda values: 1)
+                aggregate = True
+            else:
+                raise InvalidRequest(f"Unsupported function {kind}()")
+        return tuple(names), extractors, aggregate
+
+
+# ---------------------------------------------------------------------------------------------
+# Driver-shaped session, statements, results and futures
+# ---------------------------------------------------------------------------------------------
+
+# Prepared statements subclass the driver's so they pass the isinstance checks in
+# BatchStatement.add and elsewhere, but bind raw Python values instead of serializing them.
+class MemoryPreparedStatement(PreparedStatement):
+    def __init__(self, query, parsed, query_id):
+        super().__init__([], query_id, None, query, None, 4, None, None)
+        self.parsed = parsed
+
+    def bind(self, values):
+        return MemoryBoundStatement(self, values)
+
+
+class MemoryBoundStatement(BoundStatement):
+    def __init__(self, prepared_statement, values=None):
+        Statement.__init__(self)
+        self.prepared_statement = prepared_statement
+        self.values = list(values or ())
+        self.fetch_size = None
+
+    @property
+    def routing_key(self):
+        return None
+
+
+# One page of results. Iterating goes on to read the following pages through `producer`, as the
+# driver's ResultSet fetches them synchronously.
+class MemoryResultSet:
+    def __init__(self, names, rows, row_factory, paging_state=None, producer=None):
+        self.column_names = list(names)
+        self._row_factory = row_factory
+        self._producer = producer
+        self.current_rows = row_factory(self.column_names, rows)
+        self.paging_state = paging_state
+
+    @property
+    def has_more_pages(self):
+        return self.paging_state is not None
+
+    def __iter__(self):
+        yield from self.current_rows
+        paging_state = self.paging_state
+        while paging_state is not None:
+            names, rows, paging_state = self._producer(paging_state)
+            yield from self._row_factory(list(names), rows)
+
+    def one(self):
+        return self.current_rows[0] if self.current_rows else None
+
+    def all(self):
+        return list(self)
+
+    # Only a lightweight transaction can fail to apply; its first column says whether it did
+    @property
+    def was_applied(self):
+        if self.column_names[:1] != ['[applied]'] or not self.current_rows:
+            return True
+        row = self.current_rows[0]
+        return row['[applied]'] if isinstance(row, dict) else row[0]
+
+
+class _LatencyScheduler:
+    def __init__(self):
+        self._queue = []
+        self._counter = itertools.count()
+        self._cv = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='memsession-latency', daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay, fn):
+        with self._cv:
+            heapq.heappush(self._queue, (time.perf_counter() + delay, next(self._counter), fn))
+            self._cv.notify()
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._queue:
+                    self._cv.wait()
+                due, _, fn = self._queue[0]
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    self._cv.wait(wait)
+                    continue
+                heapq.heappop(self._queue)
+            fn()
+
+
+# The part of the driver's request message a request-init listener may change before it is sent
+class RequestMessage:
+    def __init__(self, tracing=False):
+        self.tracing = tracing
+
+
+class MemoryResponseFuture:
+    def __init__(self, session, producer, fetch_size, query=None, trace=False, row_factory=None):
+        self._session = session
+        self._row_factory = row_factory or session.row_factory
+        # The statement as passed to execute_async, as on the driver's ResponseFuture
+        self.query = query
+        self.message = RequestMessage(trace)
+        self._trace_id = uuid.uuid1()
+        self._producer = producer
+        self._fetch_size = fetch_size
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._errbacks = []
+        self._result = None
+        self._error = None
+        self.has_more_pages = False
+        self._paging_state = None
+        self._request = session._admit(producer)
+
+    def _run(self):
+        try:
+            request, self._request = self._request, None
+            names, rows, paging_state = request(self._paging_state)
+            page = MemoryResultSet(names, rows, self._row_factory, paging_state, self._producer)
+            self.has_more_pages = page.has_more_pages
+            self._paging_state = page.paging_state
+        except Exception as e:
+            self._complete(None, e)
+            return
+        self._complete(page, None)
+
+    def _complete(self, result, error):
+        with self._lock:
+            self._result, self._error = result, error
+            callbacks = list(self._errbacks if error is not None else self._callbacks)
+            self._event.set()
+        for fn, args, kwargs in callbacks:
+            # As in the driver, a failing callback is reported and does not affect the request
+            try:
+                if error is not None:
+                    fn(error, *args, **kwargs)
+                else:
+                    fn(result.current_rows, *args, **kwargs)
+            except Exception as e:
+                print(f"Error in callback {getattr(fn, '__qualname__', fn)}: {e}")
+
+    def result(self, timeout=None):
+        self._event.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def add_callback(self, fn, *args, **kwargs):
+        with self._lock:
+            self._callbacks.append((fn, args, kwargs))
+            done = self._event.is_set() and self._error is None
+        if done:
+            fn(self._result.current_rows, *args, **kwargs)
+        return self
+
+    def add_errback(self, fn, *args, **kwargs):
+        with self._lock:
+            self._errbacks.append((fn, args, kwargs))
+            done = self._event.is_set() and self._error is not None
+        if done:
+            fn(self._error, *args, **kwargs)
+        return self
+
+    def add_callbacks(self, callback, errback, callback_args=(), callback_kwargs=None,
+                      errback_args=(), errback_kwargs=None):
+        self.add_callback(callback, *callback_args, **(callback_kwargs or {}))
+        self.add_errback(errback, *errback_args, **(errback_kwargs or {}))
+
+    def get_query_trace_ids(self):
+        return [self._trace_id] if self.message.tracing else []
+
+    def start_fetching_next_page(self):
+        if not self.has_more_pages:
+            raise RuntimeError("No more pages to fetch")
+        self._event.clear()
+        # Each page is a request of its own, admitted against capacity like the first
+        self._request = self._session._admit(self._producer)
+        self._session._dispatch(self._run)
+
+
+def _named_tuple_factory(session):
+    def factory(names, rows):
+        cls = session.database._row_class(tuple(names))
+        return [cls(*row) for row in rows]
+    return factory
+
+
+# Stands in for session.cluster: schema metadata and the schema-agreement knobs the driver exposes.
+# A single in-process node is always in agreement.
+class MemoryCluster:
+    def __init__(self, database):
+        self.database = database
+        self.max_schema_agreement_wait = 10
+
+    @property
+    def metadata(self):
+        return self.database.schema_metadata()
+
+    def refresh_schema_metadata(self, max_schema_agreement_wait=None):
+        pass
+
+
+class MemorySession:
+    # latency: seconds added to every request (and page); jitter: +/- fraction of that latency;
+    # capacity: async requests the node accepts at once before shedding the rest as overloaded
+    def __init__(self, database=None, latency=0.0, jitter=0.0, seed=None, capacity=None):
+        self.database = database or MemoryDatabase()
+        self.cluster = MemoryCluster(self.database)
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = capacity
+        self.shed = 0
+        self._in_flight = 0
+        self._load_lock = threading.Lock()
+        self.keyspace = None
+        self.encoder = Encoder()
+        self.row_factory = _named_tuple_factory(self)
+        self.default_fetch_size = 5000
+        self._rng = random.Random(seed)
+        self._parsed = {}
+        self._prepared = {}
+        self._scheduler = None
+        self._request_init_listeners = []
+        self.is_shutdown = False
+
+    def _delay(self):
+        if not self.latency:
+            return 0.0
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency * (1.0 + self._rng.uniform(-self.jitter, self.jitter)))
+
+    def _dispatch(self, fn):
+        delay = self._delay()
+        if delay <= 0:
+            fn()
+            return
+        if self._scheduler is None:
+            self._scheduler = _LatencyScheduler()
+        self._scheduler.call_later(delay, fn)
+
+    def _parse(self, query):
+        parsed = self._parsed.get(query)
+        if parsed is None:
+            parsed = self._parsed[query] = parse(query)
+        return parsed
+
+    def prepare(self, query, custom_payload=None, keyspace=None):
+        parsed = self._parse(query)
+        query_id = f"mem-{len(self._prepared)}".encode()
+        statement = MemoryPreparedStatement(query, parsed, query_id)
+        self._prepared[query_id] = statement
+        return statement
+
+    # Execution profiles only carry a row factory here; profile names fall back to the session's
+    def _row_factory(self, execution_profile):
+        return getattr(execution_profile, 'row_factory', None) or self.row_factory
+
+    def execution_profile_clone_update(self, ep, **kwargs):
+        profile = ExecutionProfile(row_factory=self.row_factory)
+        for name, value in kwargs.items():
+            setattr(profile, name, value)
+        return profile
+
+    # Called as fn(response_future, *args, **kwargs) for every request before it runs
+    def add_request_init_listener(self, fn, *args, **kwargs):
+        self._request_init_listeners.append((fn, args, kwargs))
+
+    def remove_request_init_listener(self, fn, *args, **kwargs):
+        self._request_init_listeners.remove((fn, args, kwargs))
+
+    def set_keyspace(self, keyspace):
+        if keyspace not in self.database.keyspaces:
+            raise InvalidRequest(f"Keyspace '{keyspace}' does not exist")
+        self.keyspace = keyspace
+
+    # Resolve any accepted statement form to (parsed statement, params, fetch_size)
+    def _plan(self, query, parameters):
+        fetch_size = getattr(query, 'fetch_size', None)
+        if not isinstance(fetch_size, int):
+            fetch_size = self.default_fetch_size
+        if isinstance(query, BatchStatement):
+            inner = []
+            for is_prepared, statement, values in query._statements_and_parameters:
+                if is_prepared:
+                    inner.append(Bound(self._prepared[statement].parsed, list(values)))
+                else:
+                    inner.append(Bound(self._parse(statement), []))
+            return Batch(query.batch_type.name if query.batch_type else 'LOGGED', inner), [], None
+        if isinstance(query, MemoryBoundStatement):
+            return query.prepared_statement.parsed, query.values, fetch_size
+        if isinstance(query, MemoryPreparedStatement):
+            return query.parsed, list(parameters or ()), fetch_size
+        if isinstance(query, PreparedStatement):
+            raise InvalidRequest("Statement was prepared on another session")
+        text = query if isinstance(query, str) else query.query_string
+        if parameters:
+            text = bind_params(text, parameters, self.encoder)
+        return self._parse(text), [], fetch_size
+
+    def _producer(self, query, parameters):
+        parsed, params, fetch_size = self._plan(query, parameters)
+        if isinstance(parsed, Keyspace) and parsed.action == 'use':
+            def use(paging_state=None):
+                self.set_keyspace(parsed.name)
+                return (), [], None
+            return use, fetch_size
+        return (lambda paging_state=None: self.database.execute(parsed, params, fetch_size, paging_state)), fetch_size
+
+    def execute(self, query, parameters=None, timeout=None, trace=False, custom_payload=None,
+                execution_profile=None, paging_state=None, host=None, execute_as=None):
+        if self._request_init_listeners:
+            # The driver's execute() goes through execute_async(), so listeners see it too
+            return self.execute_async(query, parameters, trace, execution_profile=execution_profile,
+                                      paging_state=paging_state).result()
+        producer, fetch_size = self._producer(query, parameters)
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        names, rows, next_state = producer(paging_state)
+        return MemoryResultSet(names, rows, self._row_factory(execution_profile), next_state, producer)
+
+    def execute_async(self, query, parameters=None, trace=False, custom_payload=None, timeout=None,
+                      execution_profile=None, paging_state=None, host=None, execute_as=None):
+        try:
+            producer, fetch_size = self._producer(query, parameters)
+        except Exception as e:
+            def fail(paging_state=None, error=e):
+                raise error
+            producer, fetch_size = fail, None
+        future = MemoryResponseFuture(self, producer, fetch_size, query, trace, self._row_factory(execution_profile))
+        future._paging_state = paging_state
+        for fn, args, kwargs in self._request_init_listeners:
+            fn(future, *args, **kwargs)
+        self._dispatch(future._run)
+        return future
+
+    # Count the request against capacity until it runs, or fail it the way a coordinator with a
+    # full native-transport queue does
+    def _admit(self, producer):
+        if self.capacity is None:
+            return producer
+        with self._load_lock:
+            if self._in_flight >= self.capacity:
+                self.shed += 1
+                error = OverloadedErrorMessage(OverloadedErrorMessage.error_code, "Too many in flight requests", None)
+
+                def overloaded(paging_state=None):
+                    raise error
+                return overloaded
+            self._in_flight += 1
+
+        def admitted(paging_state=None):
+            try:
+                return producer(paging_state)
+            finally:
+                with self._load_lock:
+                    self._in_flight -= 1
+        return admitted
+
+    def shutdown(self):
+        if not self.is_shutdown:
+            self.database.close()
+        self.is_shutdown = True
+
+
+# Session with the killrvideo schema from app1.py already created and USE'd
+def killrvideo_session(latency=0.0, jitter=0.0, seed=None, database=None, load_demo_rows=True):
+    from app1 import WRITE_FANOUT, cql_statements, insert_rows
+    from batcher import write_batched
+    session = MemorySession(database, latency=0.0, seed=seed)
+    for statement in cql_statements:
+        session.execute(statement)
+    if load_demo_rows:
+        write_batched(session, insert_rows, fanout=WRITE_FANOUT)
+    session.latency, session.jitter = latency, jitter
+    return session
@@ -0,0 +1,380 @@
+import atexit
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from cassandra import OperationTimedOut
+from cassandra.policies import RetryPolicy
+from cassandra.query import BatchStatement, BoundStatement
+
+# Client-side request metrics. A request-init listener on the session times every request from
+# creation to its first response into a latency histogram per normalized statement, counts
+# errors, timeouts and retries, and logs requests slower than a threshold with their trace ids.
+# A sampled fraction of requests is sent with tracing on, so slow ones among them carry a trace id.
+# Snapshots go to a Prometheus textfile and a JSON file on a timer and at shutdown. When metrics
+# are not enabled no listener is registered, so requests pay nothing.
+
+# HDR-style log-linear buckets over integer microseconds: values below 2**SUB_BUCKET_BITS are
+# exact and larger ones fall in buckets under 1/2**(SUB_BUCKET_BITS - 1) of their value wide
+SUB_BUCKET_BITS = 7
+_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+# Upper bounds, in seconds, of the Prometheus histogram buckets derived from each histogram
+PROMETHEUS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = {'p50': 0.5, 'p95': 0.95, 'p99': 0.99, 'p999': 0.999}
+METRIC_PREFIX = 'killrvideo_cql'
+
+_LITERAL_RE = re.compile(
+    r"'(?:[^']|'')*'"
+    r"|\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"
+    r"|(?<![\w.])-?\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r'\s+')
+# Bound on the raw-text -> normalized-text cache; literal-heavy ad-hoc CQL would otherwise grow it forever
+_MAX_NORMALIZED = 10000
+
+
+def _index(micros):
+    exponent = max(0, micros.bit_length() - SUB_BUCKET_BITS)
+    return (exponent * _HALF) + (micros >> exponent)
+
+
+# Highest value that lands in a bucket, as HDR histograms report percentiles
+def _highest(index):
+    if index < 2 * _HALF:
+        return index
+    exponent = index // _HALF - 1
+    return ((index - exponent * _HALF + 1) << exponent) - 1
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        micros = int(seconds * 1e6)
+        index = _index(micros)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += micros
+        self.max = max(self.max, micros)
+
+    # Latency in seconds at quantile q (0 < q <= 1)
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(_highest(index), self.max) / 1e6
+        return self.max / 1e6
+
+    # Cumulative counts at or under each bound in seconds
+    def cumulative(self, bounds):
+        ordered = sorted(self.counts.items())
+        result, seen, i = [], 0, 0
+        for bound in bounds:
+            limit = int(bound * 1e6)
+            while i < len(ordered) and _highest(ordered[i][0]) <= limit:
+                seen += ordered[i][1]
+                i += 1
+            result.append(seen)
+        return result
+
+
+class StatementStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.slow = 0
+
+    def as_dict(self):
+        latency = self.latency
+        return {
+            'requests': latency.count,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'retries': self.retries,
+            'slow': self.slow,
+            'mean_ms': round(latency.total / latency.count / 1000, 3) if latency.count else 0.0,
+            'max_ms': round(latency.max / 1000, 3),
+            **{f"{name}_ms": round(latency.quantile(q) * 1000, 3) for name, q in QUANTILES.items()},
+        }
+
+
+_normalized = {}
+
+
+# Statement text with literals replaced by ? and whitespace collapsed, so every execution of the
+# same query shape shares one histogram
+def normalize(cql):
+    text = _normalized.get(cql)
+    if text is None:
+        text = _SPACE_RE.sub(' ', _LITERAL_RE.sub('?', cql)).strip().rstrip(';').rstrip()
+        if len(_normalized) >= _MAX_NORMALIZED:
+            _normalized.clear()
+        _normalized[cql] = text
+    return text
+
+
+def statement_name(query):
+    if isinstance(query, BatchStatement):
+        return f"{query.batch_type.name if query.batch_type else 'LOGGED'} BATCH"
+    if isinstance(query, BoundStatement):
+        return normalize(query.prepared_statement.query_string)
+    return normalize(query if isinstance(query, str) else getattr(query, 'query_string', str(query)))
+
+
+class SessionMetrics:
+    # slow_threshold: seconds; slow_log: file that slow requests are appended to as JSON lines,
+    # printed when None; trace_sample: fraction of requests sent with tracing on (0 none, 1 all)
+    def __init__(self, slow_threshold=0.5, slow_log=None, trace_sample=0.0):
+        self.enabled = True
+        self.slow_threshold = slow_threshold
+        self.slow_log = slow_log
+        self.trace_sample = trace_sample
+        self.started = time.time()
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+
+    def _stats(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self.stats.setdefault(name, StatementStats())
+        return stats
+
+    # Request-init listener: runs on the calling thread before the request is sent, so tracing
+    # can still be switched on in its message
+    def on_request(self, future):
+        if not self.enabled:
+            return
+        if self.trace_sample and random.random() < self.trace_sample:
+            message = getattr(future, 'message', None)
+            if message is not None:
+                message.tracing = True
+        context = [statement_name(future.query), time.perf_counter(), future]
+        future.add_callbacks(self._on_response, self._on_error, callback_args=(context,),
+                             errback_args=(context,))
+
+    # Paged results call back again for every later page; only the first response is timed
+    def _finish(self, context):
+        if len(context) < 3:
+            return None, None, None
+        name, start, future = context
+        del context[1:]
+        elapsed = time.perf_counter() - start
+        stats = self._stats(name)
+        with self._lock:
+            stats.latency.record(elapsed)
+        return name, elapsed, future
+
+    def _on_response(self, _, context):
+        name, elapsed, future = self._finish(context)
+        if name is not None and elapsed >= self.slow_threshold:
+            self._log_slow(name, elapsed, future, None)
+
+    def _on_error(self, error, context):
+        name, elapsed, future = self._finish(context)
+        if name is None:
+            return
+        stats = self.stats[name]
+        with self._lock:
+            stats.errors += 1
+            if isinstance(error, OperationTimedOut):
+                stats.timeouts += 1
+        if elapsed >= self.slow_threshold:
+            self._log_slow(name, elapsed, future, error)
+
+    def _log_slow(self, name, elapsed, future, error):
+        stats = self.stats[name]
+        with self._lock:
+            stats.slow += 1
+        try:
+            trace_ids = [str(trace_id) for trace_id in future.get_query_trace_ids()]
+        except Exception:
+            trace_ids = []
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'statement': name,
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'trace_id': trace_ids[-1] if trace_ids else None,
+            'coordinator': str(getattr(future, 'coordinator_host', None) or '') or None,
+            'error': f"{type(error).__name__}: {error}" if error is not None else None,
+        }
+        line = json.dumps(entry)
+        with self._log_lock:
+            if self.slow_log is None:
+                print(f"Slow query: {line}")
+                return
+            try:
+                with open(self.slow_log, 'a') as f:
+                    f.write(line + '\n')
+            except OSError as e:
+                print(f"Error writing slow query log {self.slow_log}: {e}")
+
+    def count_retry(self, query, timeout):
+        stats = self._stats(statement_name(query))
+        with self._lock:
+            stats.retries += 1
+            if timeout:
+                stats.timeouts += 1
+
+    def snapshot(self):
+        with self._lock:
+            statements = {name: stats.as_dict() for name, stats in sorted(self.stats.items())}
+        return {
+            'generated': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'uptime_seconds': round(time.time() - self.started, 3),
+            'statements': statements,
+        }
+
+    def prometheus(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+
+        with self._lock:
+            stats = sorted((_label(name), stats) for name, stats in self.stats.items())
+            family('request_duration_seconds', 'histogram', "Client-side request latency per statement")
+            for label, stat in stats:
+                latency = stat.latency
+                for bound, count in zip(PROMETHEUS_BUCKETS, latency.cumulative(PROMETHEUS_BUCKETS)):
+                    lines.append(f'{METRIC_PREFIX}_request_duration_seconds_bucket{{statement="{label}",le="{bound}"}} {count}')
+                lines.append(f'{METRIC_PREFIX}_request_duration_seconds_bucket{{statement="{label}",le="+Inf"}} {latency.count}')
+                lines.append(f'{METRIC_PREFIX}_request_duration_seconds_sum{{statement="{label}"}} {latency.total / 1e6}')
+                lines.append(f'{METRIC_PREFIX}_request_duration_seconds_count{{statement="{label}"}} {latency.count}')
+            family('request_duration_quantile_seconds', 'gauge', "Latency quantiles from the HDR histogram")
+            for label, stat in stats:
+                for q in QUANTILES.values():
+                    lines.append(f'{METRIC_PREFIX}_request_duration_quantile_seconds{{statement="{label}",quantile="{q}"}} '
+                                 f'{stat.latency.quantile(q)}')
+            for field, help_text in (('errors', "Failed requests"), ('timeouts', "Client and server timeouts"),
+                                     ('retries', "Retries decided by the retry policy"),
+                                     ('slow', "Requests over the slow-query threshold")):
+                family(f"{field}_total", 'counter', help_text)
+                for label, stat in stats:
+                    lines.append(f'{METRIC_PREFIX}_{field}_total{{statement="{label}"}} {getattr(stat, field)}')
+        return "\n".join(lines) + "\n"
+
+    # Write <directory>/killrvideo.prom and killrvideo-metrics.json, each replaced atomically so
+    # a scraper never reads half a file
+    def write(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for filename, content in (('killrvideo.prom', self.prometheus()),
+                                  ('killrvideo-metrics.json', json.dumps(self.snapshot(), indent=2) + '\n')):
+            path = os.path.join(directory, filename)
+            with open(path + '.tmp', 'w') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Delegates every decision to the wrapped policy and counts the ones that retry
+class CountingRetryPolicy(RetryPolicy):
+    def __init__(self, policy, metrics):
+        self.policy = policy
+        self.metrics = metrics
+
+    def _counted(self, query, decision, timeout=False):
+        if decision[0] in (self.RETRY, self.RETRY_NEXT_HOST):
+            self.metrics.count_retry(query, timeout)
+        return decision
+
+    def on_read_timeout(self, query, *args, **kwargs):
+        return self._counted(query, self.policy.on_read_timeout(query, *args, **kwargs), True)
+
+    def on_write_timeout(self, query, *args, **kwargs):
+        return self._counted(query, self.policy.on_write_timeout(query, *args, **kwargs), True)
+
+    def on_unavailable(self, query, *args, **kwargs):
+        return self._counted(query, self.policy.on_unavailable(query, *args, **kwargs))
+
+    def on_request_error(self, query, *args, **kwargs):
+        return self._counted(query, self.policy.on_request_error(query, *args, **kwargs))
+
+
+class Instrumentation:
+    def __init__(self, session, metrics, directory=None, interval=60.0):
+        self.session = session
+        self.metrics = metrics
+        self.directory = directory
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._timer = None
+        self._closed = False
+
+    def start(self):
+        for path in (self.directory, os.path.dirname(self.metrics.slow_log or '')):
+            if path:
+                os.makedirs(path, exist_ok=True)
+        self.session.add_request_init_listener(self.metrics.on_request)
+        profiles = getattr(getattr(self.session.cluster, 'profile_manager', None), 'profiles', {})
+        for profile in profiles.values():
+            if not isinstance(profile.retry_policy, CountingRetryPolicy):
+                profile.retry_policy = CountingRetryPolicy(profile.retry_policy, self.metrics)
+        if self.directory and self.interval:
+            self._timer = threading.Thread(target=self._write_periodically, name="metrics-export", daemon=True)
+            self._timer.start()
+        atexit.register(self.close)
+        return self
+
+    def _write_periodically(self):
+        while not self._stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        if not self.directory:
+            return
+        try:
+            self.metrics.write(self.directory)
+        except OSError as e:
+            print(f"Error writing metrics to {self.directory}: {e}")
+
+    # Stop timing requests and write the final snapshot; call before session.shutdown()
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._stopped.set()
+        if self._timer is not None:
+            self._timer.join()
+        self.session.remove_request_init_listener(self.metrics.on_request)
+        self.export()
+        atexit.unregister(self.close)
+
+
+# Instrument a session; returns the started Instrumentation
+def instrument(session, directory=None, interval=60.0, slow_threshold=0.5, slow_log=None, trace_sample=0.0):
+    return Instrumentation(session, SessionMetrics(slow_threshold, slow_log, trace_sample), directory,
+                           interval).start()
+
+
+# Instrument when KILLRVIDEO_METRICS names an output directory, otherwise return None and leave the
+# session untouched. KILLRVIDEO_SLOW_MS and KILLRVIDEO_METRICS_INTERVAL tune the threshold and timer,
+# and KILLRVIDEO_TRACE_SAMPLE the fraction of requests traced (default 1%).
+def instrument_from_env(session):
+    directory = os.environ.get('KILLRVIDEO_METRICS')
+    if not directory:
+        return None
+    return instrument(session, directory,
+                      interval=float(os.environ.get('KILLRVIDEO_METRICS_INTERVAL', 60)),
+                      slow_threshold=float(os.environ.get('KILLRVIDEO_SLOW_MS', 500)) / 1000,
+                      slow_log=os.path.join(directory, 'slow-queries.log'),
+                      trace_sample=float(os.environ.get('KILLRVIDEO_TRACE_SAMPLE', 0.01)))
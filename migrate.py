@@ -0,0 +1,230 @@
+import re
+from collections import namedtuple
+
+from memsession import (CreateFunction, CreateIndex, CreateTable, CreateType, CreateView, Keyspace, cql_type_name,
+                        parse, parse_type)
+
+# Brings a keyspace up to the schema declared in app1.cql_statements without dropping it: the live
+# schema metadata is diffed against the declared DDL, and only missing or changed objects are sent.
+# The only things ever dropped are an index the application manages but no longer declares (the
+# optional SASI indexes) and a managed materialized view being replaced by a table of the same name
+# (videos_by_location). Independent statements go out together, with one schema-agreement wait per
+# dependency level.
+
+# One declared schema object; `depends` holds the (kind, name) keys it needs to exist first
+SchemaObject = namedtuple('SchemaObject', 'kind name cql parsed depends')
+# One DDL statement the migration will send
+Step = namedtuple('Step', 'kind name cql depends')
+
+_CREATE_RE = re.compile(r"^\s*CREATE\s+(KEYSPACE|TABLE|TYPE|MATERIALIZED\s+VIEW|(?:CUSTOM\s+)?INDEX)\s+"
+                        r"(?!IF\s+NOT\s+EXISTS)", re.I)
+
+
+# Add IF NOT EXISTS so a statement racing another migration is still harmless
+def idempotent(cql):
+    return _CREATE_RE.sub(lambda m: f"CREATE {m.group(1)} IF NOT EXISTS ", cql, count=1)
+
+
+# Compare types structurally, ignoring frozen<> and the varchar/text alias
+def normalize_type(ctype):
+    if isinstance(ctype, str):
+        ctype = parse_type(ctype)
+    if isinstance(ctype, tuple):
+        return (ctype[0],) + tuple(normalize_type(t) for t in ctype[1:])
+    return 'text' if ctype == 'varchar' else ctype
+
+
+def _type_dependencies(ctype, types):
+    if isinstance(ctype, tuple):
+        return {dep for inner in ctype[1:] for dep in _type_dependencies(inner, types)}
+    return {('type', ctype)} if ctype in types else set()
+
+
+# Declared schema objects in statement order; DROP and USE statements are not part of the schema
+def declared_schema(statements):
+    objects = []
+    types = set()
+    for cql in statements:
+        parsed = parse(cql)
+        kind = type(parsed)
+        if kind is Keyspace:
+            if parsed.action == 'create':
+                objects.append(SchemaObject('keyspace', parsed.name, cql, parsed, ()))
+        elif kind is CreateType:
+            depends = set()
+            for ctype in parsed.fields.values():
+                depends |= _type_dependencies(ctype, types)
+            types.add(parsed.name)
+            objects.append(SchemaObject('type', parsed.name, cql, parsed, tuple(sorted(depends))))
+        elif kind is CreateTable:
+            depends = set()
+            for ctype in parsed.schema.columns.values():
+                depends |= _type_dependencies(ctype, types)
+            objects.append(SchemaObject('table', parsed.schema.name, cql, parsed, tuple(sorted(depends))))
+        elif kind is CreateIndex:
+            objects.append(SchemaObject('index', parsed.name, cql, parsed, (('table', parsed.table),)))
+        elif kind is CreateView:
+            objects.append(SchemaObject('view', parsed.name, cql, parsed, (('table', parsed.base),)))
+        elif kind is CreateFunction:
+            objects.append(SchemaObject('function', parsed.name, cql, parsed, ()))
+    return objects
+
+
+def _diff_type(obj, live):
+    live_fields = dict(zip(live.field_names, live.field_types))
+    steps, conflicts = [], []
+    for field, ctype in obj.parsed.fields.items():
+        if field not in live_fields:
+            steps.append(f"ALTER TYPE {obj.name} ADD {field} {cql_type_name(ctype)};")
+        elif normalize_type(live_fields[field]) != normalize_type(ctype):
+            conflicts.append(f"type {obj.name} field {field} is {live_fields[field]}, declared {cql_type_name(ctype)}")
+    return steps, conflicts
+
+
+def _diff_table(obj, live):
+    schema = obj.parsed.schema
+    steps, conflicts = [], []
+    live_key = ([c.name for c in live.partition_key], [c.name for c in live.clustering_key])
+    if live_key != (schema.partition_key, schema.clustering):
+        conflicts.append(f"table {obj.name} primary key is {live_key}, declared "
+                         f"{(schema.partition_key, schema.clustering)}")
+        return steps, conflicts
+    # Clustering order is fixed when a table is created; changing it means a new table and a copy
+    live_order = [c.is_reversed for c in live.clustering_key]
+    declared_order = [c in schema.descending for c in schema.clustering]
+    if live_order != declared_order:
+        conflicts.append(f"table {obj.name} clustering order is {_clustering_order(schema.clustering, live_order)}, "
+                         f"declared {_clustering_order(schema.clustering, declared_order)}; changing it is "
+                         f"not supported in place")
+        return steps, conflicts
+    for column, ctype in schema.columns.items():
+        live_column = live.columns.get(column)
+        if live_column is None:
+            steps.append(f"ALTER TABLE {obj.name} ADD {column} {cql_type_name(ctype)};")
+        elif normalize_type(live_column.cql_type) != normalize_type(ctype):
+            conflicts.append(f"table {obj.name} column {column} is {live_column.cql_type}, "
+                             f"declared {cql_type_name(ctype)}")
+    return steps, conflicts
+
+
+def _clustering_order(columns, reversed_flags):
+    return ", ".join(f"{c} {'DESC' if r else 'ASC'}" for c, r in zip(columns, reversed_flags))
+
+
+# Diff the declared schema against the live one. Returns (steps, conflicts); conflicts are
+# changes that cannot be applied in place (primary key, clustering order or column type changes)
+# and are left alone. `managed` is DDL the application may or may not declare (app1.sasi_statements,
+# the two forms of videos_by_location): its indexes are dropped when present but missing from
+# `statements`, and its views are dropped when `statements` declares a table in their place. The
+# caller backfills such a table. Other live indexes and views are kept.
+def plan_migration(session, statements, managed=()):
+    objects = declared_schema(statements)
+    keyspace = next((obj.name for obj in objects if obj.kind == 'keyspace'), session.keyspace)
+    live = session.cluster.metadata.keyspaces.get(keyspace)
+    managed_views = {obj.name for obj in declared_schema(managed) if obj.kind == 'view'}
+    steps, conflicts = [], []
+    for obj in objects:
+        if obj.kind == 'keyspace':
+            if live is None:
+                steps.append(Step('keyspace', obj.name, idempotent(obj.cql), ()))
+            continue
+        depends = (('keyspace', keyspace),) + obj.depends
+        existing = None
+        if live is not None:
+            if obj.kind == 'type':
+                existing = live.user_types.get(obj.name)
+            elif obj.kind == 'table':
+                existing = live.tables.get(obj.name)
+            elif obj.kind == 'index':
+                existing = live.indexes.get(obj.name)
+            elif obj.kind == 'view':
+                existing = live.views.get(obj.name)
+            elif obj.kind == 'function':
+                existing = next((f for f in live.functions.values() if f.name == obj.name), None)
+        if live is not None and obj.kind == 'table' and obj.name in live.views and obj.name in managed_views:
+            steps.append(Step('view', obj.name, f"DROP MATERIALIZED VIEW IF EXISTS {keyspace}.{obj.name};",
+                              (('keyspace', keyspace),)))
+            steps.append(Step(obj.kind, obj.name, idempotent(obj.cql), depends + (('view', obj.name),)))
+        elif live is not None and obj.kind in ('table', 'view') and \
+                obj.name in (live.views if obj.kind == 'table' else live.tables):
+            # Switching between a materialized view and a table of the same name needs a DROP first
+            other = 'materialized view' if obj.kind == 'table' else 'table'
+            conflicts.append(f"{obj.kind} {obj.name} already exists as a {other}")
+        elif existing is None:
+            steps.append(Step(obj.kind, obj.name, idempotent(obj.cql), depends))
+        elif obj.kind in ('type', 'table'):
+            alters, problems = (_diff_type if obj.kind == 'type' else _diff_table)(obj, existing)
+            steps.extend(Step(obj.kind, obj.name, cql, depends) for cql in alters)
+            conflicts.extend(problems)
+        elif obj.kind == 'function' and existing.body != obj.parsed.body:
+            if obj.parsed.replace:
+                steps.append(Step(obj.kind, obj.name, obj.cql, depends))
+            else:
+                conflicts.append(f"function {obj.name} body differs and is not CREATE OR REPLACE")
+    if live is not None:
+        declared = {obj.name for obj in objects if obj.kind == 'index'}
+        for obj in declared_schema(managed):
+            if obj.kind == 'index' and obj.name not in declared and obj.name in live.indexes:
+                steps.append(Step('index', obj.name, f"DROP INDEX IF EXISTS {keyspace}.{obj.name};",
+                                  (('keyspace', keyspace),)))
+    return steps, conflicts
+
+
+# Group steps into levels: a step goes one level after the latest step it depends on
+def dependency_levels(steps):
+    level_of = {}
+    levels = []
+    for step in steps:
+        level = max((level_of[dep] + 1 for dep in step.depends if dep in level_of), default=0)
+        level_of[(step.kind, step.name)] = max(level, level_of.get((step.kind, step.name), 0))
+        while len(levels) <= level:
+            levels.append([])
+        levels[level].append(step)
+    return levels
+
+
+# Apply the migration. Per-statement schema agreement is switched off while a level is in flight,
+# then one refresh waits for agreement before the next level starts. Returns (applied steps,
+# unresolved problems); the schema only matches the declared one when there are no problems.
+def migrate_schema(session, statements, agreement_wait=None, managed=()):
+    steps, conflicts = plan_migration(session, statements, managed)
+    for conflict in conflicts:
+        print(f"Schema conflict, not migrated: {conflict}")
+    if not steps:
+        if conflicts:
+            print(f"Schema not migrated: {len(conflicts)} unresolved conflict(s)")
+        else:
+            print("Schema is up to date")
+        return [], conflicts
+
+    keyspace = next((obj.name for obj in declared_schema(statements) if obj.kind == 'keyspace'), session.keyspace)
+    cluster = session.cluster
+    original_wait = cluster.max_schema_agreement_wait
+    agreement_wait = original_wait if agreement_wait is None else agreement_wait
+    applied = []
+    cluster.max_schema_agreement_wait = 0
+    try:
+        for level, level_steps in enumerate(dependency_levels(steps)):
+            if session.keyspace != keyspace and all(step.kind != 'keyspace' for step in level_steps):
+                session.set_keyspace(keyspace)
+            futures = [(step, session.execute_async(step.cql)) for step in level_steps]
+            failed = False
+            for step, future in futures:
+                try:
+                    future.result()
+                    applied.append(step)
+                    print(f"Applied {step.kind} {step.name}: {' '.join(step.cql.split())[:80]}")
+                except Exception as e:
+                    failed = True
+                    print(f"Error applying {step.kind} {step.name}: {e}")
+            cluster.refresh_schema_metadata(max_schema_agreement_wait=agreement_wait)
+            if failed:
+                print(f"Stopped after level {level}; later levels depend on it")
+                break
+    finally:
+        cluster.max_schema_agreement_wait = original_wait
+    print(f"Applied {len(applied)} of {len(steps)} schema change(s)")
+    problems = conflicts + [f"{step.kind} {step.name} not applied" for step in steps if step not in applied]
+    if problems:
+        print(f"Schema not migrated: {len(problems)} unresolved problem(s)")
+    return applied, problems
@@ -0,0 +1,88 @@
+import base64
+import itertools
+
+from cassandra.query import PreparedStatement, SimpleStatement
+
+DEFAULT_FETCH_SIZE = 100
+
+
+class Page:
+    def __init__(self, rows, cursor):
+        self.rows = rows
+        # Opaque token for the page after this one, or None on the last page
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+# Paging-state cursors are URL-safe strings so they can travel through JSON, query strings or cookies
+def encode_cursor(paging_state):
+    if paging_state is None:
+        return None
+    return base64.urlsafe_b64encode(paging_state).decode('ascii')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    return base64.urlsafe_b64decode(cursor.encode('ascii'))
+
+
+def _paged_statement(statement, params, fetch_size):
+    if isinstance(statement, str):
+        return SimpleStatement(statement, fetch_size=fetch_size), params
+    if isinstance(statement, PreparedStatement):
+        bound = statement.bind(params or ())
+        bound.fetch_size = fetch_size
+        return bound, None
+    statement.fetch_size = fetch_size
+    return statement, params
+
+
+# Fetch exactly one page. Passing the returned page's cursor back in resumes where it stopped,
+# even from a different process, because the server-side paging state is carried in the cursor.
+# With an execution profile, the page's rows are whatever its row factory built (e.g. columnar.ColumnarPage).
+# `host` sends the request to that node as coordinator instead of the one load balancing picks.
+def fetch_page(session, statement, params=None, fetch_size=DEFAULT_FETCH_SIZE, cursor=None, execution_profile=None,
+               host=None):
+    paged, params = _paged_statement(statement, params, fetch_size)
+    if execution_profile is None:
+        result = session.execute(paged, params, paging_state=decode_cursor(cursor), host=host)
+        return Page(list(result.current_rows), encode_cursor(result.paging_state))
+    result = session.execute(paged, params, paging_state=decode_cursor(cursor), execution_profile=execution_profile,
+                             host=host)
+    return Page(result.current_rows, encode_cursor(result.paging_state))
+
+
+# Lazily yield pages; only one page of rows is held in memory at a time
+def iter_pages(session, statement, params=None, fetch_size=DEFAULT_FETCH_SIZE, cursor=None, execution_profile=None):
+    while True:
+        page = fetch_page(session, statement, params, fetch_size, cursor, execution_profile)
+        yield page
+        cursor = page.cursor
+        if cursor is None:
+            return
+
+
+def iter_rows(session, statement, params=None, fetch_size=DEFAULT_FETCH_SIZE, cursor=None):
+    for page in iter_pages(session, statement, params, fetch_size, cursor):
+        yield from page.rows
+
+
+# Print rows as an aligned table while they stream in. Column widths come from the headers and
+# the first `sample_size` rows only; later rows that are wider simply push their line out.
+def print_table_streaming(headers, rows, sample_size=50):
+    rows = iter(rows)
+    sample = list(itertools.islice(rows, sample_size))
+
+    col_widths = [max(len(str(item)) for item in col) + 2 for col in zip(headers, *sample)]
+
+    print("".join(str(item).ljust(width) for item, width in zip(headers, col_widths)))
+    print("-" * sum(col_widths))
+
+    for row in itertools.chain(sample, rows):
+        print("".join(str(item).ljust(width) for item, width in zip(row, col_widths)))
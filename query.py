@@ -1,172 +1,362 @@
-from cassandra.cluster import Cluster
-
-# Connect to Cassandra
-cluster = Cluster(['127.0.0.1'])  # Use the IP address of your Docker container if needed
-session = cluster.connect()
-
-# Use the Keyspace
-session.set_keyspace('killrvideo')
-
-# First Query
-statement_1 = 'SELECT * FROM users;'
-rows_1 = session.execute(statement_1)
-print("Query 1\nName\t\tEmail")
-for row in rows_1:
-    print(f"{row.firstname} {row.lastname}\t{row.email}")
-
-# Second Query
-statement_2 = 'SELECT firstname, lastname FROM users WHERE userid = d0f60aa8-54a9-4840-b70c-fe562b68842b;'
-rows_2 = session.execute(statement_2)
-print("\nQuery 2\nName")
-for row in rows_2:
-    print(f"{row.firstname} {row.lastname}")
-
-# Third Query
-statement_3 = 'SELECT * FROM videos WHERE videoId = 06049cbb-dfed-421f-b889-5f649a0de1ed;'
-print("\nQuery 3")
-rows_3 = session.execute(statement_3)
-for row in rows_3:
-    print(f"Video Id: {row.videoid}")
-    print(f"Description: {row.description}")
-    print(f"Location: {row.location}")
-    print(f"Location Type: {row.location_type}")
-    print(f"Name: {row.name}")
-    print(f"User Id: {row.userid}")
-    print(f"Metadata: {row.metadata}")
-    print(f"Preview Thumbnails: {row.preview_thumbnails}")
-    print(f"Tag: {row.tags}")
-
-# Fourth Query
-statement_4 = 'SELECT tags FROM videos WHERE videoid = 06049cbb-dfed-421f-b889-5f649a0de1ed;'
-print("\nQuery 4")
-rows_4 = session.execute(statement_4)
-for row in rows_4:
-    print(f"Tag: {row.tags}")
-
-# Fifth Query
-statement_5 = 'SELECT location FROM videos WHERE videoid = 06049cbb-dfed-421f-b889-5f649a0de1ed;'
-print("\nQuery 5")
-rows_5 = session.execute(statement_5)
-for row in rows_5:
-    print(f"Location: {row.location}")
-
-# Sixth Query
-statement_6 = 'SELECT name,videoID,added_date FROM user_videos WHERE userid = 522b1fe2-2e36-4cef-a667-cd4237d08b89;'
-print("\nQuery 6\n")
-
-# Define column headers
-headers = ["Video Name", "Video ID", "Add Date"]
-
-rows_6 = session.execute(statement_6)
-
-data_6 = [headers]
-for row in rows_6:
-    data_6.append([row.name, row.videoid, row.added_date])
-
-# Determine column widths
-col_widths = [max(len(str(item)) for item in col) + 2 for col in zip(*data_6)]
-
-# Print the table header with proper alignment
-print("".join(str(item).ljust(width) for item, width in zip(headers, col_widths)))
-print("-" * sum(col_widths))
-
-# Print the rows with aligned columns
-for row in data_6[1:]:  # Skip headers already printed
-    print("".join(str(item).ljust(width) for item, width in zip(row, col_widths)))
-
-# Seventh Query
-statement_7 = 'SELECT name,videoID,added_date FROM user_videos WHERE userid = 9761d3d7-7fbd-4269-9988-6cfd4e188678 ORDER BY added_date DESC;'
-print("\nQuery 7\n")
-
-rows_7 = session.execute(statement_7)
-
-data_7 = [headers]
-for row in rows_7:
-    data_7.append([row.name, row.videoid, row.added_date])
-
-# Determine column widths
-col_widths = [max(len(str(item)) for item in col) + 2 for col in zip(*data_7)]
-
-# Print the table header with proper alignment
-print("".join(str(item).ljust(width) for item, width in zip(headers, col_widths)))
-print("-" * sum(col_widths))
-
-# Print the rows with aligned columns
-for row in data_7[1:]:  # Skip headers already printed
-    print("".join(str(item).ljust(width) for item, width in zip(row, col_widths)))
-    
-# Eigth Query
-statement_8 = """
-SELECT name, videoID, added_date 
-FROM user_videos 
-WHERE userid = 9761d3d7-7fbd-4269-9988-6cfd4e188678 
-  AND added_date > '2013-05-15' 
-  AND added_date < '2013-07-01'
-ORDER BY added_date ASC;
-"""
-print("\nQuery 8\n")
-
-rows_8 = session.execute(statement_8)
-
-data_8 = [headers]
-for row in rows_8:
-    data_8.append([row.name, row.videoid, row.added_date])
-
-# Determine column widths
-col_widths = [max(len(str(item)) for item in col) + 2 for col in zip(*data_8)]
-
-# Print the table header with proper alignment
-print("".join(str(item).ljust(width) for item, width in zip(headers, col_widths)))
-print("-" * sum(col_widths))
-
-# Print the rows with aligned columns
-for row in data_8[1:]:  # Skip headers already printed
-    print("".join(str(item).ljust(width) for item, width in zip(row, col_widths)))
-    
-# Ninth Query
-statement_9 = 'SELECT rating_counter, rating_total FROM video_rating WHERE videoId = 99051fe9-6a9c-46c2-b949-38ef78858dd0;'
-rows_9 = session.execute(statement_9)
-print("\nQuery 9\nRating Counter\tRating Total")
-for row in rows_9:
-    print(f"{row.rating_counter}\t\t{row.rating_total}")
-
-# Tenth Query
-statement_10 = "SELECT videoID, tagged_date FROM videos_by_tag WHERE tag = 'lol';"
-rows_10 = session.execute(statement_10)
-print("\nQuery 10\nVideo ID\t\t\t\tTag Date")
-for row in rows_10:
-    print(f"{row.videoid}\t{row.tagged_date}")      
-
-# Eleven Query
-statement_11 = 'SELECT userid, comment, dateOf(commentid) FROM comments_by_video WHERE videoid = 99051fe9-6a9c-46c2-b949-38ef78858dd0;'
-print("\nQuery 11\n")
-
-# Define column headers
-headers_2 = ["User Id", "Comment", "Date of Comment"]
-
-rows_11 = session.execute(statement_11)
-
-data_11 = [headers_2]
-for row in rows_11:
-    data_11.append([row.userid, row.comment, row.system_dateof_commentid])
-
-# Determine column widths
-col_widths_2 = [max(len(str(item)) for item in col) + 2 for col in zip(*data_11)]
-
-# Print the table header with proper alignment
-print("".join(str(item).ljust(width) for item, width in zip(headers_2, col_widths_2)))
-print("-" * sum(col_widths_2))
-
-# Print the rows with aligned columns
-for row in data_11[1:]:  # Skip headers already printed
-    print("".join(str(item).ljust(width) for item, width in zip(row, col_widths_2)))
-
-# Twelve Query
-statement_12 = "SELECT dateOf(event_timestamp), event, video_timestamp FROM video_event WHERE videoID = 99051fe9-6a9c-46c2-b949-38ef78858dd0 AND userid= d0f60aa8-54a9-4840-b70c-fe562b68842b limit 5;"
-rows_12 = session.execute(statement_12)
-print("\nQuery 12\nEvent Timestamp\t\t\tEvent\tVideo Timestamp")
-for row in rows_12:
-    print(f"{row.system_dateof_event_timestamp}\t{row.event}\t{row.video_timestamp}")     
-
-# Close the session
-session.shutdown()
+import argparse
+import uuid
+from collections import namedtuple
+from dataclasses import dataclass
+from datetime import datetime
+
+from cassandra import ConsistencyLevel
+
+from app1 import BUCKET_GRANULARITY, create_cassandra_connection
+from async_query import QuerySpec, run_queries
+from buckets import BUCKETED_TABLES, BucketedReader
+from cache import CachedReader
+from metrics import instrument_from_env
+from paging import iter_rows, print_table_streaming
+from scan import range_cql, scan_table
+
+# The read access patterns of the killrvideo schema, each declared once with its CQL, its bind
+# parameters, a consistency level and the headers to print it under. A QueryRegistry prepares every
+# pattern when it is created, so the server parses each statement once per session rather than
+# once per request, and every read binds its values instead of splicing them into the CQL.
+
+
+@dataclass
+class AccessPattern:
+    name: str
+    cql: str
+    # (name, type) of each bind marker in order; the type is a key of PARAM_TYPES
+    params: tuple = ()
+    # One header per selected column, in select order
+    columns: tuple = ()
+    description: str = ""
+    consistency: int = ConsistencyLevel.LOCAL_ONE
+    # Set for potentially large reads that should be paged and streamed rather than fetched whole
+    fetch_size: int = None
+    # Table read with a parallel token-range scan; `cql` is then its range_cql statement
+    scan: str = None
+    # 'table' prints aligned columns; 'record' prints one "header: value" line per column
+    layout: str = 'table'
+    # Source table of buckets.BUCKETED_TABLES this reads. With bucketing on, the read goes through
+    # BucketedReader instead: the leading params are the partition key, a `limit` param is the
+    # LIMIT and `select` is the column list.
+    bucketed: str = None
+    # Selected columns as they appear in `cql`, for reads that build their own statement
+    select: str = None
+    # Table of cache.LOOKUPS whose row this selects columns of, by its whole partition key. With a
+    # CachedReader the read is served from the cached row.
+    cached: str = None
+
+
+# Parse command-line text into the value bound for each parameter type
+PARAM_TYPES = {
+    'uuid': uuid.UUID,
+    'text': str,
+    'int': int,
+    'timestamp': datetime.fromisoformat,
+}
+
+PATTERNS = {}
+
+
+def register(pattern):
+    if pattern.name in PATTERNS:
+        raise ValueError(f"Access pattern {pattern.name} is already registered")
+    PATTERNS[pattern.name] = pattern
+    return pattern
+
+
+VIDEO_HEADERS = ("Video Name", "Video ID", "Add Date")
+COMMENT_COLUMNS = 'userid, comment, dateOf(commentid)'
+VIDEO_COLUMNS = 'videoid, description, location, location_type, name, userid, metadata, preview_thumbnails, tags'
+EVENT_COLUMNS = 'dateOf(event_timestamp), event, video_timestamp'
+
+register(AccessPattern(
+    'all_users', range_cql('users', 'firstname, lastname, email'),
+    columns=("First Name", "Last Name", "Email"), fetch_size=1000, scan='users',
+    description="Every user. Rows come back in no particular order."))
+register(AccessPattern(
+    'user_by_id', 'SELECT firstname, lastname FROM users WHERE userid = ?', (('userid', 'uuid'),),
+    ("First Name", "Last Name"), "A user's name", select='firstname, lastname', cached='users'))
+register(AccessPattern(
+    'video_by_id', f'SELECT {VIDEO_COLUMNS} FROM videos WHERE videoid = ?', (('videoid', 'uuid'),),
+    ("Video Id", "Description", "Location", "Location Type", "Name", "User Id", "Metadata",
+     "Preview Thumbnails", "Tags"), "One video with all its details", layout='record',
+    select=VIDEO_COLUMNS, cached='videos'))
+register(AccessPattern(
+    'video_tags', 'SELECT tags FROM videos WHERE videoid = ?', (('videoid', 'uuid'),), ("Tags",),
+    "A video's tags", select='tags', cached='videos'))
+register(AccessPattern(
+    'video_location', 'SELECT location FROM videos WHERE videoid = ?', (('videoid', 'uuid'),), ("Location",),
+    "Where a video is stored", select='location', cached='videos'))
+register(AccessPattern(
+    'videos_by_user', 'SELECT name, videoid, added_date FROM user_videos WHERE userid = ?',
+    (('userid', 'uuid'),), VIDEO_HEADERS, "Videos a user uploaded", fetch_size=100))
+register(AccessPattern(
+    'videos_by_user_newest', 'SELECT name, videoid, added_date FROM user_videos WHERE userid = ? '
+                             'ORDER BY added_date DESC',
+    (('userid', 'uuid'),), VIDEO_HEADERS, "Videos a user uploaded, newest first", fetch_size=100))
+register(AccessPattern(
+    'videos_by_user_in_range', 'SELECT name, videoid, added_date FROM user_videos WHERE userid = ? '
+                               'AND added_date > ? AND added_date < ? ORDER BY added_date ASC',
+    (('userid', 'uuid'), ('start', 'timestamp'), ('end', 'timestamp')), VIDEO_HEADERS,
+    "Videos a user uploaded between two dates, oldest first", fetch_size=100))
+register(AccessPattern(
+    'video_rating', 'SELECT rating_counter, rating_total FROM video_rating WHERE videoid = ?',
+    (('videoid', 'uuid'),), ("Rating Counter", "Rating Total"), "A video's rating counters"))
+register(AccessPattern(
+    'videos_by_tag', 'SELECT videoid, tagged_date FROM videos_by_tag WHERE tag = ?', (('tag', 'text'),),
+    ("Video ID", "Tag Date"), "Videos carrying a tag"))
+register(AccessPattern(
+    'comments_by_video', f'SELECT {COMMENT_COLUMNS} FROM comments_by_video WHERE videoid = ?',
+    (('videoid', 'uuid'),), ("User Id", "Comment", "Date of Comment"), "Comments on a video",
+    bucketed='comments_by_video', select=COMMENT_COLUMNS))
+register(AccessPattern(
+    'video_events', f'SELECT {EVENT_COLUMNS} FROM video_event WHERE videoid = ? AND userid = ? LIMIT ?',
+    (('videoid', 'uuid'), ('userid', 'uuid'), ('limit', 'int')),
+    ("Event Timestamp", "Event", "Video Timestamp"), "A user's latest playback events on a video",
+    bucketed='video_event', select=EVENT_COLUMNS))
+
+
+# Values for a pattern's parameters from command-line text: either every value in declared order,
+# or name=value pairs in any order
+def parse_params(pattern, args):
+    names = [name for name, _ in pattern.params]
+    if args and all('=' in arg for arg in args):
+        given = dict(arg.split('=', 1) for arg in args)
+        unknown = set(given) - set(names)
+        if unknown:
+            raise ValueError(f"{pattern.name} has no parameter {', '.join(sorted(unknown))}")
+        args = [given.get(name) for name in names]
+    if len(args) != len(names) or any(arg is None for arg in args):
+        raise ValueError(f"{pattern.name} takes {len(names)} parameters: {' '.join(names) or '(none)'}")
+    return tuple(PARAM_TYPES[ctype](arg) for (_, ctype), arg in zip(pattern.params, args))
+
+
+class QueryRegistry:
+    # `consistency` overrides every pattern's own level. With a bucket granularity, the patterns
+    # over comments_by_video and video_event read their bucketed tables. With a cache.CachedReader,
+    # the patterns with `cached` are served from it unless a consistency level is asked for.
+    def __init__(self, session, patterns=None, consistency=None, bucket_granularity=BUCKET_GRANULARITY,
+                 cache=None):
+        self.session = session
+        self.patterns = dict(PATTERNS if patterns is None else patterns)
+        self.consistency = consistency
+        self.buckets = BucketedReader(session, bucket_granularity) if bucket_granularity else None
+        self.cache = cache
+        self._projections = {}
+        self.statements = {}
+        # Why each pattern that failed to prepare did, raised again whenever it is read
+        self.errors = {}
+        for pattern in self.patterns.values():
+            try:
+                statement = session.prepare(pattern.cql)
+            except Exception as e:
+                print(f"Error preparing {pattern.name}: {e}")
+                self.errors[pattern.name] = e
+                continue
+            statement.consistency_level = consistency if consistency is not None else pattern.consistency
+            self.statements[pattern.name] = statement
+
+    def pattern(self, name):
+        try:
+            return self.patterns[name]
+        except KeyError:
+            raise KeyError(f"Unknown access pattern {name}") from None
+
+    def statement(self, name):
+        if name not in self.statements:
+            raise RuntimeError(f"Access pattern {name} was not prepared: {self.errors.get(name)}") \
+                from self.errors.get(name)
+        return self.statements[name]
+
+    # A bound statement for one read of `name`, at `consistency` or the registry's level
+    def bind(self, name, params=(), consistency=None):
+        pattern = self.pattern(name)
+        statement = self.statement(name)
+        if len(params) != len(pattern.params):
+            raise ValueError(f"{name} takes {len(pattern.params)} parameters, got {len(params)}")
+        bound = statement.bind(params)
+        bound.consistency_level = self._level(pattern, consistency)
+        return bound
+
+    # Rows of one read. Scans and paged patterns stream lazily; the rest are fetched whole.
+    def rows(self, name, *params, consistency=None, **named):
+        pattern = self.pattern(name)
+        if named:
+            params = params + tuple(named[param] for param, _ in pattern.params[len(params):])
+        if self._bucketed(pattern):
+            return self._bucketed_rows(pattern, params, consistency)
+        if self._cached(pattern, consistency):
+            return self._cached_rows(pattern, params)
+        if pattern.scan is not None:
+            if params:
+                raise ValueError(f"{name} takes no parameters")
+            return scan_table(self.session, pattern.scan, fetch_size=pattern.fetch_size,
+                              statement=self.statement(name), consistency_level=consistency)
+        bound = self.bind(name, params, consistency)
+        if pattern.fetch_size is not None:
+            return iter_rows(self.session, bound, fetch_size=pattern.fetch_size)
+        return list(self.session.execute(bound))
+
+    # The first level set of the read's, the registry's and the pattern's. ANY is 0, so each is
+    # tested against None rather than for truth.
+    def _level(self, pattern, consistency=None):
+        if consistency is not None:
+            return consistency
+        return self.consistency if self.consistency is not None else pattern.consistency
+
+    def _bucketed(self, pattern):
+        return self.buckets is not None and pattern.bucketed is not None
+
+    def _cached(self, pattern, consistency=None):
+        return (self.cache is not None and pattern.cached is not None and consistency is None
+                and self.consistency is None)
+
+    # The pattern's columns of the cached row, as the one row the query would have returned
+    def _cached_rows(self, pattern, params):
+        if len(params) != len(pattern.params):
+            raise ValueError(f"{pattern.name} takes {len(pattern.params)} parameters, got {len(params)}")
+        row = self.cache.get(pattern.cached, params)
+        if row is None:
+            return []
+        projection = self._projections.get(pattern.name)
+        if projection is None:
+            projection = self._projections[pattern.name] = namedtuple(
+                'Row', [column.strip() for column in pattern.select.split(',')])
+        return [projection(*(getattr(row, column) for column in projection._fields))]
+
+    # The same read over the pattern's bucketed table, across every bucket holding rows for the key
+    def _bucketed_rows(self, pattern, params, consistency=None):
+        if len(params) != len(pattern.params):
+            raise ValueError(f"{pattern.name} takes {len(pattern.params)} parameters, got {len(params)}")
+        values = dict(zip((param for param, _ in pattern.params), params))
+        key = params[:len(BUCKETED_TABLES[pattern.bucketed].key)]
+        return self.buckets.read(pattern.bucketed, key, limit=values.get('limit'), columns=pattern.select,
+                                 consistency_level=self._level(pattern, consistency))
+
+    # Run reads given as (name, params) and print each in the order given. The unpaged reads run
+    # concurrently up front; scans, paged, bucketed and cached reads run while they print.
+    def run_all(self, reads, concurrency=8, consistency=None):
+        outcomes = {}
+        for index, (name, params) in enumerate(reads):
+            pattern = self.pattern(name)
+            if pattern.scan is None and pattern.fetch_size is None and not self._bucketed(pattern) \
+                    and not self._cached(pattern, consistency):
+                try:
+                    outcomes[index] = QuerySpec(name, self.bind(name, params, consistency))
+                except Exception as e:
+                    outcomes[index] = e
+        pending = [index for index, spec in outcomes.items() if isinstance(spec, QuerySpec)]
+        outcomes.update(zip(pending, run_queries(self.session, [outcomes[index] for index in pending], concurrency)))
+        for index, (name, params) in enumerate(reads):
+            pattern = self.pattern(name)
+            try:
+                if index not in outcomes:
+                    print_rows(pattern, self.rows(name, *params, consistency=consistency), f"Query {index + 1}")
+                    continue
+                result = outcomes[index]
+                if isinstance(result, Exception):
+                    raise result
+                if not result.ok:
+                    raise result.error
+                print_rows(pattern, result.rows, f"Query {index + 1}")
+            except Exception as e:
+                print(f"\nError executing {name}: {e}")
+
+
+# The shared formatter: every pattern prints under its declared headers
+def print_rows(pattern, rows, title=None):
+    if title:
+        print(f"\n{title}: {pattern.description}\n")
+    if pattern.layout == 'record':
+        for row in rows:
+            for header, value in zip(pattern.columns, row):
+                print(f"{header}: {value}")
+        return
+    print_table_streaming(pattern.columns, rows)
+
+
+# The read suite the script has always printed, in display order
+READ_SUITE = [
+    ('all_users', ()),
+    ('user_by_id', (uuid.UUID('d0f60aa8-54a9-4840-b70c-fe562b68842b'),)),
+    ('video_by_id', (uuid.UUID('06049cbb-dfed-421f-b889-5f649a0de1ed'),)),
+    ('video_tags', (uuid.UUID('06049cbb-dfed-421f-b889-5f649a0de1ed'),)),
+    ('video_location', (uuid.UUID('06049cbb-dfed-421f-b889-5f649a0de1ed'),)),
+    ('videos_by_user', (uuid.UUID('522b1fe2-2e36-4cef-a667-cd4237d08b89'),)),
+    ('videos_by_user_newest', (uuid.UUID('9761d3d7-7fbd-4269-9988-6cfd4e188678'),)),
+    ('videos_by_user_in_range', (uuid.UUID('9761d3d7-7fbd-4269-9988-6cfd4e188678'), datetime(2013, 5, 15),
+                                 datetime(2013, 7, 1))),
+    ('video_rating', (uuid.UUID('99051fe9-6a9c-46c2-b949-38ef78858dd0'),)),
+    ('videos_by_tag', ('lol',)),
+    ('comments_by_video', (uuid.UUID('99051fe9-6a9c-46c2-b949-38ef78858dd0'),)),
+    ('video_events', (uuid.UUID('99051fe9-6a9c-46c2-b949-38ef78858dd0'),
+                      uuid.UUID('d0f60aa8-54a9-4840-b70c-fe562b68842b'), 5)),
+]
+
+
+# Run the read suite and print each result in the original order
+def run_read_suite(session, concurrency=8, registry=None):
+    (registry or QueryRegistry(session)).run_all(READ_SUITE, concurrency)
+
+
+def list_patterns():
+    width = max(len(name) for name in PATTERNS) + 2
+    for name, pattern in PATTERNS.items():
+        params = " ".join(f"<{param}:{ctype}>" for param, ctype in pattern.params)
+        print(f"{name.ljust(width)}{params}")
+        print(f"{'':{width}}{pattern.description}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run a killrvideo access pattern, or the whole read suite when none is named")
+    parser.add_argument('pattern', nargs='?', help="access pattern to run (see --list)")
+    parser.add_argument('params', nargs='*', help="parameter values in order, or name=value pairs")
+    parser.add_argument('--list', action='store_true', help="list the access patterns and their parameters")
+    parser.add_argument('--consistency', type=str.upper, choices=sorted(ConsistencyLevel.name_to_value),
+                        help="consistency level for every read (default: each pattern's own)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--embedded', metavar='DIR', help="read an embedded store instead of the cluster")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        list_patterns()
+        return 0
+    if args.pattern is not None:
+        if args.pattern not in PATTERNS:
+            parser.error(f"unknown access pattern {args.pattern}; see --list")
+        try:
+            params = parse_params(PATTERNS[args.pattern], args.params)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # Connect to Cassandra, or the embedded store when KILLRVIDEO_EMBEDDED names a data directory
+    session = create_cassandra_connection(args.embedded)
+    if session is None:
+        return 1
+    session.set_keyspace('killrvideo')
+
+    # Per-statement latency metrics when KILLRVIDEO_METRICS names an output directory
+    instrumentation = instrument_from_env(session)
+    status = 0
+    try:
+        consistency = ConsistencyLevel.name_to_value[args.consistency] if args.consistency else None
+        registry = QueryRegistry(session, consistency=consistency, cache=CachedReader(session))
+        if args.pattern is None:
+            registry.run_all(READ_SUITE, args.concurrency)
+        else:
+            try:
+                print_rows(registry.pattern(args.pattern), registry.rows(args.pattern, *params))
+            except Exception as e:
+                print(f"Error executing {args.pattern}: {e}")
+                status = 1
+    finally:
+        if instrumentation:
+            instrumentation.close()
+        session.shutdown()
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,91 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# Bulk average ratings for leaderboards. video_rating partitions for many videos are read
+# concurrently straight into NumPy arrays, and averages, Bayesian-smoothed scores and top-K are
+# computed vectorized instead of calling the avg_rating UDF per row on the coordinator.
+
+RATING_LOOKUP = "SELECT rating_counter, rating_total FROM video_rating WHERE videoid = ?"
+
+# Column-oriented result: one array per field, aligned by position
+RatingColumns = namedtuple('RatingColumns', 'videoid count total average score')
+
+
+# Read rating_counter/rating_total for every videoid with up to `concurrency` requests in flight.
+# Returns (counts, totals) int64 arrays aligned with `videoids`; unrated videos read as 0.
+def fetch_ratings(session, videoids, concurrency=64):
+    statement = session.prepare(RATING_LOOKUP)
+    counts = np.zeros(len(videoids), dtype=np.int64)
+    totals = np.zeros(len(videoids), dtype=np.int64)
+    slots = threading.Semaphore(concurrency)
+    errors = []
+
+    def on_success(rows, index):
+        for row in rows:
+            counts[index] = row.rating_counter or 0
+            totals[index] = row.rating_total or 0
+        slots.release()
+
+    def on_error(error, index):
+        errors.append((videoids[index], error))
+        slots.release()
+
+    for index, videoid in enumerate(videoids):
+        slots.acquire()
+        future = session.execute_async(statement, (videoid,))
+        future.add_callbacks(on_success, on_error, callback_args=(index,), errback_args=(index,))
+    for _ in range(concurrency):
+        slots.acquire()
+    for _ in range(concurrency):
+        slots.release()
+    if errors:
+        videoid, error = errors[0]
+        raise RuntimeError(f"{len(errors)} rating reads failed, first for {videoid}: {error}")
+    return counts, totals
+
+
+# rating_total / rating_counter per video, NaN where there are no ratings (the UDF would divide by zero)
+def average_ratings(counts, totals):
+    counts = np.asarray(counts, dtype=np.float64)
+    averages = np.full(counts.shape, np.nan)
+    np.divide(totals, counts, out=averages, where=counts > 0)
+    return averages
+
+
+# Bayesian average: each video is pulled toward `prior_mean` as if it had `prior_weight` extra
+# ratings at that value, so one 5-star rating does not top the leaderboard. Defaults are the
+# catalogue-wide mean rating and the mean number of ratings per rated video.
+def bayesian_scores(counts, totals, prior_mean=None, prior_weight=None):
+    counts = np.asarray(counts, dtype=np.float64)
+    totals = np.asarray(totals, dtype=np.float64)
+    rated = counts > 0
+    if prior_mean is None:
+        prior_mean = totals.sum() / counts.sum() if rated.any() else 0.0
+    if prior_weight is None:
+        prior_weight = counts[rated].mean() if rated.any() else 1.0
+    return (prior_weight * prior_mean + totals) / (prior_weight + counts)
+
+
+# Indices of the k largest scores in descending order, skipping NaN
+def top_k(scores, k):
+    scores = np.asarray(scores, dtype=np.float64)
+    candidates = np.flatnonzero(~np.isnan(scores))
+    if k < len(candidates):
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def rating_columns(session, videoids, concurrency=64, prior_mean=None, prior_weight=None):
+    counts, totals = fetch_ratings(session, videoids, concurrency)
+    return RatingColumns(np.asarray(videoids, dtype=object), counts, totals,
+                         average_ratings(counts, totals), bayesian_scores(counts, totals, prior_mean, prior_weight))
+
+
+# Top-k videos by smoothed score, as columns in rank order
+def leaderboard(session, videoids, k=10, min_count=1, concurrency=64, prior_mean=None, prior_weight=None):
+    columns = rating_columns(session, videoids, concurrency, prior_mean, prior_weight)
+    scores = np.where(columns.count >= min_count, columns.score, np.nan)
+    order = top_k(scores, k)
+    return RatingColumns(*(column[order] for column in columns))
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+
+from loader import BulkLoader
+
+RATING_TABLES = ("video_rating", "video_ratings_by_user")
+
+
+class RatingMetrics:
+    def __init__(self):
+        self.updates = 0
+        self.counter_writes = 0
+        self.rating_rows = 0
+        self.flushes = 0
+        self.rerated = 0
+
+    # Counter updates that were folded into another update for the same video instead of being sent
+    @property
+    def merged(self):
+        return self.updates - self.counter_writes
+
+    def summary(self):
+        return (f"Ratings: {self.updates} counter updates coalesced into {self.counter_writes} writes "
+                f"({self.merged} merged) over {self.flushes} flushes; {self.rating_rows} video_ratings_by_user rows, {self.rerated} re-ratings")
+
+
+# Sums video_rating increments per videoid in memory and writes one combined counter update per
+# video when `max_pending` videos are waiting or `flush_interval` seconds have passed, so a popular
+# video costs one read-before-write on the replica per flush instead of one per rating.
+# video_ratings_by_user rows go straight out through the same loader.
+# A user rating the same video again replaces their rating there, so the counters take the earlier
+# rating back out. This relies on every by-user row coming with its own +1 / +rating increment, as
+# rate() and datagen emit them, and on the earlier rating being among the last `max_rated` seen.
+class RatingIngest:
+    def __init__(self, session=None, concurrency=64, flush_interval=1.0, max_pending=1000, loader=None,
+                 max_rated=100000):
+        self.loader = loader or BulkLoader(session, concurrency)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_rated = max_rated
+        self.metrics = RatingMetrics()
+        self._pending = OrderedDict()
+        # (videoid, userid) -> the latest rating seen, most recent last
+        self._rated = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._timer = None
+        if flush_interval:
+            self._timer = threading.Thread(target=self._flush_periodically, name="rating-flush", daemon=True)
+            self._timer.start()
+
+    @property
+    def report(self):
+        return self.loader.report
+
+    # One user's rating of a video: the by-user row plus a +1 / +rating counter increment
+    def rate(self, videoid, userid, rating):
+        self.loader.report.rows += 2
+        self.add_rating_row((videoid, userid, rating))
+        self.add_counter(1, rating, videoid)
+
+    # Accepts rows from a (table, params) stream, e.g. app1.insert_rows
+    def add(self, table, params):
+        if table == "video_rating":
+            self.add_counter(*params)
+        elif table == "video_ratings_by_user":
+            self.add_rating_row(params)
+        else:
+            raise ValueError(f"RatingIngest does not write {table}")
+
+    def add_rating_row(self, params):
+        videoid, userid, rating = params
+        with self._lock:
+            self.metrics.rating_rows += 1
+            previous = self._rated.pop((videoid, userid), None)
+            self._rated[(videoid, userid)] = rating
+            if len(self._rated) > self.max_rated:
+                self._rated.popitem(last=False)
+            full = False
+            if previous is not None:
+                self.metrics.rerated += 1
+                full = self._increment(-1, -previous, videoid, 0)
+        if full:
+            self.flush()
+        self.loader.submit("video_ratings_by_user", self.loader.statement("video_ratings_by_user"), params)
+
+    def add_counter(self, counter_delta, total_delta, videoid):
+        with self._lock:
+            self.metrics.updates += 1
+            full = self._increment(counter_delta, total_delta, videoid, 1)
+        if full:
+            self.flush()
+
+    # Fold an increment carrying `updates` rows into the video's pending one; the caller holds the lock
+    def _increment(self, counter_delta, total_delta, videoid, updates):
+        pending = self._pending.get(videoid)
+        if pending is None:
+            self._pending[videoid] = [counter_delta, total_delta, updates]
+        else:
+            pending[0] += counter_delta
+            pending[1] += total_delta
+            pending[2] += updates
+        return len(self._pending) >= self.max_pending
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+            if not pending:
+                return
+            self.metrics.flushes += 1
+            self.metrics.counter_writes += len(pending)
+        statement = self.loader.statement("video_rating")
+        for videoid, (counter_delta, total_delta, updates) in pending.items():
+            self.loader.submit("video_rating", statement, (counter_delta, total_delta, videoid), rows=updates)
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    # Stop the timer, write whatever is still pending and wait for every request to finish
+    def close(self):
+        self._stopped.set()
+        if self._timer is not None:
+            self._timer.join()
+        self.flush()
+        self.loader.drain()
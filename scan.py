@@ -0,0 +1,178 @@
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest import RETRYABLE_ERRORS
+from loader import PARTITION_KEYS
+from paging import fetch_page
+
+# Full-table reads split over the Murmur3 token ring. Each range is an independent partition-range
+# query, so several ranges can be read at once from different coordinators instead of one long
+# sequential scan.
+
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+
+# A (start, end] slice of the ring and the hosts that hold it, in the order to try them as
+# coordinator; empty when the session has no cluster metadata
+TokenRange = namedtuple('TokenRange', 'start end replicas')
+
+
+class ScanError(Exception):
+    def __init__(self, table, token_range, error):
+        super().__init__(f"Scan of {table} failed in token range ({token_range.start}, {token_range.end}]: "
+                         f"{type(error).__name__}: {error}")
+        self.table = table
+        self.token_range = token_range
+        self.error = error
+
+
+class ScanReport:
+    def __init__(self):
+        self.ranges = 0
+        self.pages = 0
+        self.rows = 0
+        self.retries = 0
+        self.elapsed = 0.0
+
+    def summary(self):
+        return (f"Scanned {self.rows} rows in {self.pages} pages over {self.ranges} token ranges in "
+                f"{self.elapsed:.2f}s; {self.retries} page retries")
+
+
+# `splits` contiguous (start, end] ranges covering the whole ring. Murmur3 never hands out
+# MIN_TOKEN itself, so starting the first range exclusive of it loses nothing.
+def token_ranges(splits):
+    step = (MAX_TOKEN - MIN_TOKEN) // splits
+    bounds = [MIN_TOKEN + i * step for i in range(splits)] + [MAX_TOKEN]
+    return list(zip(bounds, bounds[1:]))
+
+
+# Ranges that follow the cluster's own token ownership: the ring is cut at every node (or vnode)
+# token, each owned range is split further until there are at least `splits` in all, and each range
+# carries the replicas for `keyspace` so it can be read from a node that holds it. Without cluster
+# metadata (the in-memory and embedded stores) this is token_ranges with no replicas.
+def ring_ranges(session, splits=64, keyspace=None):
+    cluster = getattr(session, 'cluster', None)
+    token_map = getattr(getattr(cluster, 'metadata', None), 'token_map', None)
+    keyspace = keyspace or getattr(session, 'keyspace', None)
+    if token_map is None or not token_map.ring or keyspace is None:
+        return [TokenRange(start, end, ()) for start, end in token_ranges(splits)]
+    ring = list(token_map.ring)
+    edges = [MIN_TOKEN] + [token.value for token in ring] + [MAX_TOKEN]
+    # The range past the last token wraps around to the owner of the first
+    owners = ring + [ring[0]]
+    pieces = max(1, -(-splits // len(owners)))
+    ranges = []
+    for start, end, owner in zip(edges, edges[1:], owners):
+        if start >= end:
+            continue
+        replicas = tuple(token_map.get_replicas(keyspace, owner))
+        step = max(1, (end - start) // pieces)
+        bounds = sorted({min(end, start + i * step) for i in range(pieces)} | {end})
+        ranges.extend(TokenRange(a, b, replicas) for a, b in zip(bounds, bounds[1:]))
+    return ranges
+
+
+def range_cql(table, columns='*', partition_key=None):
+    key = ", ".join(partition_key or PARTITION_KEYS[table])
+    return f"SELECT {columns} FROM {table} WHERE token({key}) > ? AND token({key}) <= ?"
+
+
+# Pages of one token range. A failed page is retried from the paging state of the page before it,
+# so rows already handed out are not read again; each retry moves to the range's next replica and
+# waits a jittered, exponentially growing delay first. `stopped` cuts the wait short.
+def range_pages(session, statement, token_range, fetch_size=1000, max_attempts=5, base_delay=0.1,
+                max_delay=5.0, stopped=None, report=None, consistency_level=None):
+    statement = statement.bind((token_range.start, token_range.end))
+    if consistency_level is not None:
+        statement.consistency_level = consistency_level
+    replicas = list(token_range.replicas)
+    # Start at a random replica so concurrent scans spread over the nodes holding each range
+    offset = random.randrange(len(replicas)) if replicas else 0
+    cursor = None
+    attempt = 1
+    while True:
+        host = replicas[(offset + attempt - 1) % len(replicas)] if replicas else None
+        try:
+            page = fetch_page(session, statement, None, fetch_size, cursor, host=host)
+        except RETRYABLE_ERRORS:
+            if attempt >= max_attempts:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            attempt += 1
+            if report is not None:
+                report.retries += 1
+            if stopped is None:
+                time.sleep(delay)
+            elif stopped.wait(delay):
+                return
+            continue
+        attempt = 1
+        yield page
+        cursor = page.cursor
+        if cursor is None:
+            return
+
+
+_RANGE_DONE = object()
+
+
+# Every row of `table` as one stream, with up to `concurrency` token ranges read at once, each with
+# its own paging. Rows arrive as pages complete, so ranges interleave and there is no overall order.
+# At most a couple of pages per reader are buffered, and closing the generator early stops the
+# readers. A range that still fails after `max_attempts` tries of one page raises ScanError.
+# `statement` is a range_cql statement for `table` prepared ahead of time; `columns` and
+# `partition_key` are then unused.
+def scan_table(session, table, columns='*', splits=64, concurrency=8, fetch_size=1000, partition_key=None,
+               max_attempts=5, report=None, statement=None, consistency_level=None):
+    report = report if report is not None else ScanReport()
+    start = time.perf_counter()
+    statement = statement or session.prepare(range_cql(table, columns, partition_key))
+    ranges = ring_ranges(session, splits)
+    report.ranges += len(ranges)
+    stopped = threading.Event()
+    pages = queue.Queue(maxsize=2 * concurrency)
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(token_range):
+        try:
+            for page in range_pages(session, statement, token_range, fetch_size, max_attempts,
+                                    stopped=stopped, report=report, consistency_level=consistency_level):
+                if not put(page.rows):
+                    return
+        except Exception as e:
+            put(ScanError(table, token_range, e))
+        finally:
+            put(_RANGE_DONE)
+
+    pool = ThreadPoolExecutor(concurrency, thread_name_prefix=f"scan-{table}")
+    try:
+        for token_range in ranges:
+            pool.submit(read, token_range)
+        remaining = len(ranges)
+        while remaining:
+            item = pages.get()
+            if item is _RANGE_DONE:
+                remaining -= 1
+            elif isinstance(item, ScanError):
+                raise item
+            else:
+                report.pages += 1
+                report.rows += len(item)
+                yield from item
+    finally:
+        stopped.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+        report.elapsed += time.perf_counter() - start
@@ -0,0 +1,417 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from cassandra.query import UNSET_VALUE
+
+from ingest import AdaptiveLoader
+from scan import ScanError, ScanReport, range_cql, range_pages, ring_ranges
+
+# Columnar snapshots of a keyspace: one Parquet or Arrow IPC file per table plus manifest.json.
+# Export reads token ranges in parallel and hands record batches to a single writer per table
+# through a bounded queue, so memory stays at a few batches whatever the table size. Import
+# memory-maps each file and streams its batches into an AdaptiveLoader.
+
+MANIFEST = 'manifest.json'
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+# CQL scalar types a snapshot can hold. uuid and timeuuid are stored as their 16 raw bytes; each
+# field keeps its CQL type in the Arrow field metadata so import can turn the values back.
+SCALAR_TYPES = {
+    'ascii': pa.string(),
+    'text': pa.string(),
+    'varchar': pa.string(),
+    'inet': pa.string(),
+    'boolean': pa.bool_(),
+    'tinyint': pa.int8(),
+    'smallint': pa.int16(),
+    'int': pa.int32(),
+    'bigint': pa.int64(),
+    'counter': pa.int64(),
+    'float': pa.float32(),
+    'double': pa.float64(),
+    'timestamp': pa.timestamp('ms'),
+    'blob': pa.binary(),
+    'uuid': pa.binary(16),
+    'timeuuid': pa.binary(16),
+}
+
+
+# Parse a CQL type string such as 'set<frozen<video_metadata>>' into (name, [argument types]).
+# frozen<> changes nothing about the values, so it is dropped.
+def parse_type(cql_type):
+    text = cql_type.replace(' ', '')
+    if '<' not in text:
+        return (text.lower(), [])
+    name, inner = text[:text.index('<')].lower(), text[text.index('<') + 1:-1]
+    args, depth, start = [], 0, 0
+    for i, char in enumerate(inner):
+        if char == '<':
+            depth += 1
+        elif char == '>':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            args.append(parse_type(inner[start:i]))
+            start = i + 1
+    args.append(parse_type(inner[start:]))
+    if name == 'frozen':
+        return args[0]
+    return (name, args)
+
+
+def arrow_type(ctype, user_types):
+    name, args = ctype
+    if name in SCALAR_TYPES:
+        return SCALAR_TYPES[name]
+    if name in ('set', 'list'):
+        return pa.list_(arrow_type(args[0], user_types))
+    if name == 'map':
+        return pa.map_(arrow_type(args[0], user_types), arrow_type(args[1], user_types))
+    if name in user_types:
+        return pa.struct([(field, arrow_type(ftype, user_types)) for field, ftype in user_types[name]])
+    raise ValueError(f"CQL type {name} is not supported in snapshots")
+
+
+# Converter from a driver value to what pyarrow accepts for the type, or None where the value
+# passes through as is
+def _to_arrow(ctype, user_types):
+    name, args = ctype
+    if name in ('uuid', 'timeuuid'):
+        return lambda value: value.bytes
+    if name in ('set', 'list'):
+        item = _to_arrow(args[0], user_types)
+        return (lambda value: list(value)) if item is None else (lambda value: [item(v) for v in value])
+    if name == 'map':
+        key, val = _to_arrow(args[0], user_types), _to_arrow(args[1], user_types)
+        key, val = key or (lambda v: v), val or (lambda v: v)
+        return lambda value: [(key(k), val(v)) for k, v in value.items()]
+    if name in user_types:
+        fields = [(i, field, _to_arrow(ftype, user_types)) for i, (field, ftype) in enumerate(user_types[name])]
+        return lambda value: {field: (value[i] if fn is None or value[i] is None else fn(value[i]))
+                              for i, field, fn in fields}
+    return None
+
+
+# Converter from Arrow's Python value back to what the driver binds, or None to pass through.
+# Sets come back as frozensets so they can sit inside other sets.
+def _from_arrow(ctype, user_types):
+    name, args = ctype
+    if name in ('uuid', 'timeuuid'):
+        return lambda value: uuid.UUID(bytes=value)
+    if name in ('set', 'list'):
+        item = _from_arrow(args[0], user_types) or (lambda v: v)
+        collection = frozenset if name == 'set' else list
+        return lambda value: collection(item(v) for v in value)
+    if name == 'map':
+        key = _from_arrow(args[0], user_types) or (lambda v: v)
+        val = _from_arrow(args[1], user_types) or (lambda v: v)
+        return lambda value: {key(k): val(v) for k, v in value}
+    if name in user_types:
+        fields = [(field, _from_arrow(ftype, user_types)) for field, ftype in user_types[name]]
+        return lambda value: tuple(value[field] if fn is None or value[field] is None else fn(value[field])
+                                   for field, fn in fields)
+    return None
+
+
+def _convert(values, fn):
+    if fn is None:
+        return values
+    return [None if value is None else fn(value) for value in values]
+
+
+# Table layout from the live schema: columns as (name, cql type), keys, and the keyspace's UDTs
+def describe_keyspace(session, keyspace='killrvideo'):
+    metadata = session.cluster.metadata.keyspaces[keyspace]
+    user_types = {name: [[field, ftype] for field, ftype in zip(udt.field_names, udt.field_types)]
+                  for name, udt in metadata.user_types.items()}
+    tables = {}
+    for name, table in metadata.tables.items():
+        tables[name] = {
+            'columns': [[column.name, column.cql_type] for column in table.columns.values()],
+            'partition_key': [column.name for column in table.partition_key],
+            'clustering_key': [column.name for column in table.clustering_key],
+        }
+    return tables, user_types
+
+
+def _parsed_user_types(user_types):
+    return {name: [(field, parse_type(ftype)) for field, ftype in fields] for name, fields in user_types.items()}
+
+
+def arrow_schema(columns, user_types):
+    parsed = _parsed_user_types(user_types)
+    return pa.schema([pa.field(name, arrow_type(parse_type(ctype), parsed), metadata={'cql_type': ctype})
+                      for name, ctype in columns])
+
+
+class SnapshotReport:
+    def __init__(self, action):
+        self.action = action
+        self.rows = {}
+        self.bytes = 0
+        self.failed = 0
+        # Tables left out entirely, e.g. an import whose columns are not in the live schema
+        self.skipped = []
+        self.retries = 0
+        self.elapsed = 0.0
+
+    def summary(self):
+        total = sum(self.rows.values())
+        rate = total / self.elapsed if self.elapsed else 0.0
+        lines = [f"{self.action} {total} rows from {len(self.rows)} tables in {self.elapsed:.2f}s "
+                 f"({rate:.0f} rows/sec, {self.bytes / 1e6:.1f} MB on disk)"]
+        if self.retries:
+            lines[0] += f", {self.retries} page retries"
+        if self.failed:
+            lines[0] += f", {self.failed} rows failed"
+        for table, rows in sorted(self.rows.items()):
+            lines.append(f"  {table}: {rows} rows")
+        for table in self.skipped:
+            lines.append(f"  {table}: skipped")
+        return "\n".join(lines)
+
+    @property
+    def ok(self):
+        return not self.failed and not self.skipped
+
+
+_RANGE_DONE = object()
+
+
+# Stream one table to `path`. Each token range is read by a pool thread and cut into record batches
+# of `batch_rows`; the queue holds at most two batches per thread, so readers wait for the writer.
+# Ranges come from scan.ring_ranges and are paged with scan.range_pages, so a failed page is retried
+# on another replica from where it left off; a range that still fails raises ScanError.
+def export_table(session, table, layout, user_types, path, fmt='parquet', splits=64, concurrency=8,
+                 fetch_size=1000, batch_rows=10000, report=None):
+    schema = arrow_schema(layout['columns'], user_types)
+    parsed = _parsed_user_types(user_types)
+    names = [name for name, _ in layout['columns']]
+    converters = [_to_arrow(parse_type(ctype), parsed) for _, ctype in layout['columns']]
+    statement = session.prepare(range_cql(table, ", ".join(names), layout['partition_key']))
+    batches = queue.Queue(maxsize=concurrency * 2)
+    cancelled = threading.Event()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def to_batch(rows):
+        columns = [_convert(list(values), fn) for values, fn in zip(zip(*rows), converters)]
+        return pa.RecordBatch.from_arrays([pa.array(values, type=field.type)
+                                           for values, field in zip(columns, schema)], schema=schema)
+
+    def read(token_range):
+        try:
+            chunk = []
+            for page in range_pages(session, statement, token_range, fetch_size, stopped=cancelled, report=report):
+                if cancelled.is_set():
+                    return
+                chunk.extend(page.rows)
+                while len(chunk) >= batch_rows:
+                    put(to_batch(chunk[:batch_rows]))
+                    chunk = chunk[batch_rows:]
+            if chunk:
+                put(to_batch(chunk))
+            put(_RANGE_DONE)
+        except Exception as e:
+            put(ScanError(table, token_range, e))
+
+    ranges = ring_ranges(session, splits)
+    rows = 0
+    partial = path + '.partial'
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(partial, schema, compression='zstd')
+    else:
+        # Uncompressed, so import reads the buffers straight out of the memory map
+        writer = pa.ipc.new_file(partial, schema)
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            try:
+                for token_range in ranges:
+                    pool.submit(read, token_range)
+                remaining = len(ranges)
+                while remaining:
+                    item = batches.get()
+                    if item is _RANGE_DONE:
+                        remaining -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        writer.write_batch(item)
+                        rows += item.num_rows
+            finally:
+                cancelled.set()
+        writer.close()
+    except BaseException:
+        writer.close()
+        os.remove(partial)
+        raise
+    os.replace(partial, path)
+    return rows
+
+
+# Snapshot every table of the keyspace (or `tables`) into `directory`. The manifest is written
+# last, so a directory with a manifest holds a complete snapshot. A manifest left by an earlier
+# export is removed before any file is replaced, so an export that fails halfway cannot leave it
+# vouching for a mix of old and new files.
+def export_keyspace(session, directory, tables=None, fmt='parquet', keyspace='killrvideo', splits=64,
+                    concurrency=8, fetch_size=1000, batch_rows=10000):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown snapshot format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    os.makedirs(directory, exist_ok=True)
+    try:
+        os.remove(os.path.join(directory, MANIFEST))
+    except FileNotFoundError:
+        pass
+    layouts, user_types = describe_keyspace(session, keyspace)
+    report = SnapshotReport("Exported")
+    scan_report = ScanReport()
+    start = time.perf_counter()
+    manifest = {'keyspace': keyspace, 'format': fmt, 'created': datetime.now().isoformat(timespec='seconds'),
+                'user_types': user_types, 'tables': {}}
+    for table in tables or sorted(layouts):
+        layout = layouts[table]
+        filename = table + FORMATS[fmt]
+        path = os.path.join(directory, filename)
+        rows = export_table(session, table, layout, user_types, path, fmt, splits, concurrency, fetch_size,
+                            batch_rows, scan_report)
+        manifest['tables'][table] = dict(layout, file=filename, rows=rows)
+        report.rows[table] = rows
+        report.bytes += os.path.getsize(path)
+    with open(os.path.join(directory, MANIFEST + '.tmp'), 'w', encoding='utf-8') as out:
+        json.dump(manifest, out, indent=2)
+    os.replace(os.path.join(directory, MANIFEST + '.tmp'), os.path.join(directory, MANIFEST))
+    report.retries = scan_report.retries
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Record batches of a snapshot file, read through a memory map so pages come straight from the
+# page cache instead of being copied into the process first
+def iter_batches(path, batch_rows=10000):
+    if path.endswith(FORMATS['parquet']):
+        yield from pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_rows)
+        return
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+# Write statement for a snapshot table. Counter tables get an increment per counter column, so
+# they must be empty before import or the snapshot values add to what is already there.
+def restore_cql(table, layout):
+    types = dict(layout['columns'])
+    counters = [name for name, ctype in layout['columns'] if ctype == 'counter']
+    if not counters:
+        names = [name for name, _ in layout['columns']]
+        return (f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})", names)
+    keys = layout['partition_key'] + layout['clustering_key']
+    regular = [name for name in types if name not in keys]
+    if regular != counters:
+        raise ValueError(f"Table {table} mixes counter and regular columns")
+    assignments = ", ".join(f"{name} = {name} + ?" for name in counters)
+    where = " AND ".join(f"{name} = ?" for name in keys)
+    return f"UPDATE {table} SET {assignments} WHERE {where}", counters + keys
+
+
+# Rows of one snapshot file as parameter tuples in `order`. Null regular columns are bound unset, so
+# restoring writes no tombstones; null counters are skipped the same way.
+def iter_params(path, layout, user_types, order, batch_rows=10000):
+    parsed = _parsed_user_types(user_types)
+    types = dict(layout['columns'])
+    keys = set(layout['partition_key'] + layout['clustering_key'])
+    converters = [_from_arrow(parse_type(types[name]), parsed) for name in order]
+    for batch in iter_batches(path, batch_rows):
+        columns = []
+        for name, fn in zip(order, converters):
+            values = _convert(batch.column(name).to_pylist(), fn)
+            if name not in keys:
+                values = [UNSET_VALUE if value is None else value for value in values]
+            columns.append(values)
+        yield from zip(*columns)
+
+
+# Restore a snapshot into the live keyspace, whose schema must already exist (app1.py or migrate.py).
+# Tables are restored one after another; each table's rows are written concurrently.
+def import_keyspace(session, directory, tables=None, concurrency=64, batch_rows=10000, dead_letter=None):
+    manifest = read_manifest(directory)
+    live, _ = describe_keyspace(session, manifest['keyspace'])
+    report = SnapshotReport("Imported")
+    start = time.perf_counter()
+    loader = AdaptiveLoader(session, concurrency, dead_letter=dead_letter)
+    for table in tables or sorted(manifest['tables']):
+        layout = manifest['tables'][table]
+        missing = [name for name, _ in layout['columns']
+                   if table not in live or name not in dict(live[table]['columns'])]
+        if missing:
+            print(f"Error importing {table}: columns {', '.join(missing)} are not in the live schema")
+            report.skipped.append(table)
+            report.failed += layout.get('rows', 0)
+            continue
+        cql, order = restore_cql(table, layout)
+        statement = session.prepare(cql)
+        path = os.path.join(directory, layout['file'])
+        for params in iter_params(path, layout, manifest['user_types'], order, batch_rows):
+            loader.report.rows += 1
+            loader.submit(table, statement, params)
+        loader.drain()
+        report.rows[table] = loader.report.written[table]
+        report.bytes += os.path.getsize(path)
+    report.failed += loader.report.failed
+    report.elapsed = time.perf_counter() - start
+    if report.failed:
+        print(loader.report.summary())
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or restore a columnar snapshot of the killrvideo keyspace")
+    parser.add_argument('action', choices=('export', 'import'))
+    parser.add_argument('directory')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='parquet')
+    parser.add_argument('--table', action='append', dest='tables', help="limit to this table (repeatable)")
+    parser.add_argument('--embedded', metavar='DIR', help="use an embedded store instead of the cluster")
+    parser.add_argument('--splits', type=int, default=64, help="token ranges per table on export")
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help="ranges read at once on export (default 8), writes in flight on import (default 64)")
+    args = parser.parse_args(argv)
+
+    from app1 import create_cassandra_connection
+    session = create_cassandra_connection(args.embedded)
+    if session is None:
+        return 1
+    session.set_keyspace('killrvideo')
+    try:
+        if args.action == 'export':
+            report = export_keyspace(session, args.directory, args.tables, args.format, splits=args.splits,
+                                     concurrency=args.concurrency or 8)
+        else:
+            report = import_keyspace(session, args.directory, args.tables, args.concurrency or 64,
+                                     dead_letter=os.path.join(args.directory, 'import-dead-letter.jsonl'))
+    finally:
+        session.shutdown()
+    print(report.summary())
+    return 0 if report.ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
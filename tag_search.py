@@ -0,0 +1,131 @@
+import heapq
+import math
+import re
+from datetime import datetime
+
+# Multi-tag search over videos_by_tag, replacing the tags_idx secondary index on videos(tags).
+# A query is tags joined by AND / OR, AND binding tighter: "cassandra AND instruction OR cats".
+# Each tag is one videos_by_tag partition read directly; an AND reads its smallest partition in
+# full and only probes the larger ones for the surviving videoids.
+
+COLUMNS = "videoid, added_date, name, preview_image_location"
+TAG_VIDEOS = f"SELECT {COLUMNS} FROM videos_by_tag WHERE tag = ?"
+TAG_PROBE = f"SELECT {COLUMNS} FROM videos_by_tag WHERE tag = ? AND videoid IN ?"
+
+# Largest IN list sent in one probe; bigger candidate sets are split and probed concurrently
+PROBE_BATCH = 100
+
+_QUERY_TOKEN_RE = re.compile(r'"([^"]*)"|\'([^\']*)\'|(\S+)')
+
+
+# Parse into OR-ed groups of AND-ed tags. Quotes keep a multi-word tag together, and so do
+# consecutive bare words: 'data model AND cql' is [['data model', 'cql']].
+def parse_tag_query(text):
+    groups = [[]]
+    words = []
+
+    def end_tag():
+        if words:
+            groups[-1].append(' '.join(words))
+            words.clear()
+
+    for match in _QUERY_TOKEN_RE.finditer(text):
+        quoted = match.group(1) if match.group(1) is not None else match.group(2)
+        if quoted is not None:
+            end_tag()
+            groups[-1].append(quoted)
+        elif match.group(3).upper() == 'AND':
+            end_tag()
+        elif match.group(3).upper() == 'OR':
+            end_tag()
+            groups.append([])
+        else:
+            words.append(match.group(3))
+    end_tag()
+    groups = [group for group in groups if group]
+    if not groups:
+        raise ValueError(f"Empty tag query: {text!r}")
+    return groups
+
+
+class TagSearch:
+    # sizes: optional tag -> video count estimate (e.g. autocomplete.TagIndex.weights) used to
+    # order partitions that do not fit in one page; fetch_size bounds the first read of each tag
+    def __init__(self, session, fetch_size=500, sizes=None):
+        self.session = session
+        self.fetch_size = fetch_size
+        self.sizes = sizes if sizes is not None else {}
+        self._statements = {}
+
+    def _statement(self, cql):
+        statement = self._statements.get(cql)
+        if statement is None:
+            statement = self._statements[cql] = self.session.prepare(cql)
+        return statement
+
+    def _execute_async(self, cql, params):
+        bound = self._statement(cql).bind(params)
+        bound.fetch_size = self.fetch_size
+        return self.session.execute_async(bound)
+
+    # Matching videos as rows of (videoid, added_date, name, preview_image_location), newest first.
+    # With `limit`, only the newest `limit` of them. videos_by_tag clusters by videoid rather than
+    # date, so no partition can be cut short: the newest match may be its last row. Every matching
+    # row is read, and only the top `limit` are kept sorted.
+    def search(self, query, limit=None):
+        groups = parse_tag_query(query)
+        matches = {}
+        singles = [group[0] for group in groups if len(group) == 1]
+        if singles:
+            # Plain OR terms: every partition is requested at once
+            futures = [self._execute_async(TAG_VIDEOS, (tag,)) for tag in singles]
+            for future in futures:
+                for row in future.result():
+                    matches.setdefault(row.videoid, row)
+        for group in groups:
+            if len(group) == 1:
+                continue
+            for row in self.intersect(group):
+                matches.setdefault(row.videoid, row)
+        return self._ordered(matches, limit)
+
+    def _ordered(self, matches, limit):
+        def newest(row):
+            return row.added_date is not None, row.added_date or datetime.min
+        if limit is not None:
+            return heapq.nlargest(limit, matches.values(), key=newest)
+        return sorted(matches.values(), key=newest, reverse=True)
+
+    # Videos carrying every tag. First pages of all tags are read concurrently; a tag whose first
+    # page held its whole partition has an exact size, otherwise the `sizes` estimate (or infinity)
+    # is used. The smallest partition seeds the candidates, larger ones are only probed for them,
+    # and reading stops as soon as the candidate set is empty.
+    def intersect(self, tags):
+        tags = list(dict.fromkeys(tags))
+        firsts = {tag: self._execute_async(TAG_VIDEOS, (tag,)) for tag in tags}
+        firsts = {tag: future.result() for tag, future in firsts.items()}
+
+        def size(tag):
+            result = firsts[tag]
+            if not result.has_more_pages:
+                return len(result.current_rows)
+            return max(self.sizes.get(tag, math.inf), len(result.current_rows))
+
+        order = sorted(tags, key=size)
+        candidates = {row.videoid: row for row in firsts[order[0]]}
+        for tag in order[1:]:
+            if not candidates:
+                break
+            result = firsts[tag]
+            if result.has_more_pages:
+                present = self._probe(tag, list(candidates))
+            else:
+                present = {row.videoid for row in result.current_rows}
+            candidates = {videoid: row for videoid, row in candidates.items() if videoid in present}
+        return list(candidates.values())
+
+    # Which of `videoids` are in the tag's partition, using clustering-key IN lookups
+    def _probe(self, tag, videoids):
+        futures = [self._execute_async(TAG_PROBE, (tag, videoids[i:i + PROBE_BATCH]))
+                   for i in range(0, len(videoids), PROBE_BATCH)]
+        return {row.videoid for future in futures for row in future.result()}
@@ -0,0 +1,277 @@
+import argparse
+from collections import Counter
+from datetime import datetime
+
+from cassandra.query import BatchStatement, BatchType
+
+from buckets import bucket_range
+from loader import BulkLoader, INSERT_COLUMNS, insert_cql
+from paging import iter_rows
+
+# Query tables that replace the SASI indexes on users. Every users row is written together with
+# one row per lookup table (see batcher.FANOUT), so finding a user by email, last-name prefix or
+# signup day is a single-partition read instead of an index scan over every node.
+#
+# An email belongs to one user: the first to claim it. UserDirectory claims the users_by_email row
+# with a lightweight transaction before writing anything else, releases it only while it still
+# holds it, and check_user_lookups treats whoever holds the row as the owner.
+
+USER_LOOKUP_TABLES = ('users_by_email', 'users_by_lastname_prefix', 'users_by_signup_day')
+
+# Last names are partitioned by their first characters; prefix searches need at least this many
+LASTNAME_PREFIX_LENGTH = 2
+DAY_FORMAT = '%Y-%m-%d'
+# Sorts after every other code point, so key + _MAX_CHAR bounds every text starting with key
+_MAX_CHAR = '\U0010ffff'
+# LIMIT bound when the caller asked for everything in the range
+_NO_LIMIT = 2 ** 31 - 1
+
+# Full primary key of each lookup table, used to delete a row that no longer matches its user
+PRIMARY_KEYS = {
+    'users_by_email': ('email',),
+    'users_by_lastname_prefix': ('prefix', 'lastname_key', 'userid'),
+    'users_by_signup_day': ('signup_day', 'created_date', 'userid'),
+}
+
+USER_ROW = "SELECT userid, firstname, lastname, email, created_date FROM users WHERE userid = ?"
+CLAIM_EMAIL = insert_cql('users_by_email') + " IF NOT EXISTS"
+RELEASE_EMAIL = "DELETE FROM users_by_email WHERE email = ? IF userid = ?"
+ALL_USERS = "SELECT userid, firstname, lastname, email, created_date FROM users"
+BY_EMAIL = "SELECT userid, firstname, lastname, created_date FROM users_by_email WHERE email = ?"
+BY_LASTNAME = ("SELECT userid, firstname, lastname, email, created_date FROM users_by_lastname_prefix "
+               "WHERE prefix = ? AND lastname_key >= ? AND lastname_key < ? LIMIT ?")
+BY_SIGNUP_DAY = ("SELECT userid, firstname, lastname, email, created_date FROM users_by_signup_day "
+                 "WHERE signup_day = ? AND created_date >= ? AND created_date <= ? LIMIT ?")
+
+
+# Emails are matched case-insensitively, as the SASI index on users(email) did
+def email_key(email):
+    return email.strip().lower()
+
+
+def lastname_key(lastname):
+    return lastname.strip().lower()
+
+
+# Lookup rows for one users row (userid, firstname, lastname, email, created_date), in the column
+# order of loader.INSERT_COLUMNS. A null email, last name or signup date gets no row.
+def lookup_rows(params):
+    userid, firstname, lastname, email, created_date = params
+    rows = []
+    if email:
+        rows.append(('users_by_email', (email_key(email), userid, firstname, lastname, created_date)))
+    if lastname:
+        key = lastname_key(lastname)
+        rows.append(('users_by_lastname_prefix', (key[:LASTNAME_PREFIX_LENGTH], key, userid, firstname,
+                                                  lastname, email, created_date)))
+    if created_date:
+        rows.append(('users_by_signup_day', (created_date.strftime(DAY_FORMAT), created_date, userid,
+                                             firstname, lastname, email)))
+    return rows
+
+
+def primary_key(table, params):
+    columns = INSERT_COLUMNS[table]
+    return tuple(params[columns.index(column)] for column in PRIMARY_KEYS[table])
+
+
+def delete_cql(table):
+    where = " AND ".join(f"{column} = ?" for column in PRIMARY_KEYS[table])
+    return f"DELETE FROM {table} WHERE {where}"
+
+
+# Timestamps are stored with millisecond precision, so compare them that way
+def _comparable(params):
+    return tuple(value.replace(microsecond=value.microsecond // 1000 * 1000) if isinstance(value, datetime)
+                 else value for value in params)
+
+
+class UserDirectory:
+    def __init__(self, session, concurrency=8):
+        self.session = session
+        self.concurrency = concurrency
+        self._statements = {}
+
+    def _statement(self, cql):
+        statement = self._statements.get(cql)
+        if statement is None:
+            statement = self._statements[cql] = self.session.prepare(cql)
+        return statement
+
+    # Claim the email, then write the users row and its lookup rows in one LOGGED batch, so the
+    # tables never disagree for long. A conditional write cannot share a batch with other
+    # partitions, hence the separate claim. Returns False, writing nothing, when another user
+    # already holds the email.
+    def register(self, userid, firstname, lastname, email, created_date):
+        params = (userid, firstname, lastname, email, created_date)
+        rows = lookup_rows(params)
+        if not all(self._claim_email(row) for table, row in rows if table == 'users_by_email'):
+            return False
+        self._write([('users', params)] + rows, [])
+        return True
+
+    # Change a user's profile fields. A new email is claimed first, as in register. Lookup rows
+    # keyed by the old values are deleted in the same batch that writes the new ones, except the old
+    # email, which is released afterwards and only if this user still holds it. Returns False when
+    # the user does not exist or the new email belongs to someone else.
+    def update(self, userid, firstname=None, lastname=None, email=None):
+        current = self.session.execute(self._statement(USER_ROW), (userid,)).one()
+        if current is None:
+            return False
+        params = (userid, current.firstname if firstname is None else firstname,
+                  current.lastname if lastname is None else lastname,
+                  current.email if email is None else email, current.created_date)
+        new_rows = lookup_rows(params)
+        if not all(self._claim_email(row) for table, row in new_rows if table == 'users_by_email'):
+            return False
+        new_keys = {(table, primary_key(table, row)) for table, row in new_rows}
+        stale = [(table, primary_key(table, row)) for table, row in lookup_rows(tuple(current))
+                 if (table, primary_key(table, row)) not in new_keys]
+        self._write([('users', params)] + new_rows, [item for item in stale if item[0] != 'users_by_email'])
+        for table, key in stale:
+            if table == 'users_by_email':
+                self.session.execute(self._statement(RELEASE_EMAIL), key + (userid,))
+        return True
+
+    # True when the users_by_email row now belongs to the row's userid: newly claimed, or already
+    # held by the same user, as when a registration is retried
+    def _claim_email(self, params):
+        result = self.session.execute(self._statement(CLAIM_EMAIL), params)
+        return result.was_applied or result.one().userid == params[1]
+
+    def _write(self, rows, deletes):
+        batch = BatchStatement(batch_type=BatchType.LOGGED)
+        for table, key in deletes:
+            batch.add(self._statement(delete_cql(table)), key)
+        for table, params in rows:
+            batch.add(self._statement(insert_cql(table)), params)
+        self.session.execute(batch)
+
+    def by_email(self, email):
+        return self.session.execute(self._statement(BY_EMAIL), (email_key(email),)).one()
+
+    # Users whose last name starts with `prefix` (case-insensitive), ordered by last name
+    def by_lastname_prefix(self, prefix, limit=None):
+        key = lastname_key(prefix)
+        if len(key) < LASTNAME_PREFIX_LENGTH:
+            raise ValueError(f"Last-name prefix {prefix!r} is shorter than {LASTNAME_PREFIX_LENGTH} characters")
+        params = (key[:LASTNAME_PREFIX_LENGTH], key, key + _MAX_CHAR, _NO_LIMIT if limit is None else limit)
+        return list(self.session.execute(self._statement(BY_LASTNAME), params))
+
+    # Users who signed up between start and end, newest first. Days are read `concurrency` at a time
+    # and older days are not read once `limit` users are in hand.
+    def signed_up_between(self, start, end, limit=None):
+        statement = self._statement(BY_SIGNUP_DAY)
+        days = bucket_range(start, end, 'day')
+        rows = []
+        for i in range(0, len(days), self.concurrency):
+            wanted = _NO_LIMIT if limit is None else limit - len(rows)
+            futures = [self.session.execute_async(statement, (day, start, end, wanted))
+                       for day in days[i:i + self.concurrency]]
+            for future in futures:
+                rows.extend(future.result())
+            if limit is not None and len(rows) >= limit:
+                return rows[:limit]
+        return rows
+
+
+class LookupReport:
+    def __init__(self):
+        self.users = 0
+        self.checked = Counter()
+        self.missing = Counter()
+        self.mismatched = Counter()
+        self.stale = Counter()
+        # Emails claimed by more than one user: email -> userids
+        self.conflicts = {}
+        self.repaired = False
+
+    @property
+    def drift(self):
+        return sum(self.missing.values()) + sum(self.mismatched.values()) + sum(self.stale.values())
+
+    def summary(self):
+        lines = [f"Checked lookup tables against {self.users} users: {self.drift} rows drifted"
+                 + (" (repaired)" if self.repaired and self.drift else "")]
+        for table in USER_LOOKUP_TABLES:
+            lines.append(f"  {table}: {self.checked[table]} rows, {self.missing[table]} missing, "
+                         f"{self.mismatched[table]} mismatched, {self.stale[table]} stale")
+        for email, userids in sorted(self.conflicts.items()):
+            lines.append(f"  email {email} is used by {len(userids)} users: {', '.join(map(str, userids))}")
+        return "\n".join(lines)
+
+
+# Offline consistency check: scan users, derive the lookup rows it implies and diff them with a scan
+# of each lookup table. With `repair`, missing and mismatched rows are rewritten and stale rows
+# deleted. The expected rows are held in memory, so run it from a machine sized for the user count.
+def check_user_lookups(session, repair=False, concurrency=64, fetch_size=1000):
+    report = LookupReport()
+    expected = {table: {} for table in USER_LOOKUP_TABLES}
+    owners = {}
+    # Emails claimed by several users: key -> {userid: expected row for that user}
+    claims = {}
+    for user in iter_rows(session, ALL_USERS, fetch_size=fetch_size):
+        report.users += 1
+        for table, params in lookup_rows(tuple(user)):
+            key = primary_key(table, params)
+            if table == 'users_by_email' and key in expected[table]:
+                # Two users claim one email. The one holding the users_by_email row keeps it (see
+                # below); when neither does, the earliest signup gets it.
+                report.conflicts.setdefault(key[0], [owners[key]]).append(user.userid)
+                claims.setdefault(key, {owners[key]: expected[table][key]})[user.userid] = params
+                if (user.created_date or datetime.max) >= (expected[table][key][4] or datetime.max):
+                    continue
+            owners[key] = user.userid
+            expected[table][key] = params
+
+    loader = BulkLoader(session, concurrency) if repair else None
+    deletes = {table: session.prepare(delete_cql(table)) for table in USER_LOOKUP_TABLES} if repair else None
+    for table in USER_LOOKUP_TABLES:
+        wanted = expected[table]
+        columns = INSERT_COLUMNS[table]
+        for row in iter_rows(session, f"SELECT {', '.join(columns)} FROM {table}", fetch_size=fetch_size):
+            report.checked[table] += 1
+            key = primary_key(table, row)
+            params = wanted.pop(key, None)
+            if table == 'users_by_email' and key in claims:
+                params = claims[key].get(row.userid, params)
+            if params is None:
+                report.stale[table] += 1
+                if loader:
+                    loader.submit(table, deletes[table], key)
+            elif _comparable(row) != _comparable(params):
+                report.mismatched[table] += 1
+                if loader:
+                    loader.submit(table, loader.statement(table), params)
+        report.missing[table] = len(wanted)
+        if loader:
+            for params in wanted.values():
+                loader.submit(table, loader.statement(table), params)
+    if loader:
+        loader.drain()
+        report.repaired = True
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the user lookup tables against users")
+    parser.add_argument('--repair', action='store_true', help="rewrite missing rows and delete stale ones")
+    parser.add_argument('--embedded', metavar='DIR', help="check an embedded store instead of the cluster")
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    from app1 import create_cassandra_connection
+    session = create_cassandra_connection(args.embedded)
+    if session is None:
+        return 1
+    session.set_keyspace('killrvideo')
+    try:
+        report = check_user_lookups(session, args.repair, args.concurrency)
+    finally:
+        session.shutdown()
+    print(report.summary())
+    return 1 if report.drift and not args.repair else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
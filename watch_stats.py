@@ -0,0 +1,272 @@
+import argparse
+import os
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from buckets import BUCKETED_TABLES
+from ingest import AdaptiveLoader
+from scan import range_cql, range_pages, ring_ranges
+
+# Watch-session analytics over video_event, or video_event_bucketed when the app writes buckets.
+# Token ranges are read in parallel (one process per worker against the cluster, or threads over a
+# given session), start/stop events are paired into sessions with array operations, and per-video
+# aggregates are computed with grouped NumPy reductions over the session arrays.
+
+EVENT_COLUMNS = "videoid, userid, event_timestamp, event, video_timestamp"
+
+# Upper edges (ms) of the watch-time histogram buckets; the last bucket is open-ended
+WATCH_TIME_EDGES_MS = np.array([10_000, 30_000, 60_000, 120_000, 300_000, 600_000, 1_800_000], dtype=np.int64)
+# Drop-off histogram buckets: tenths of the video in which sessions stopped
+DROPOFF_BINS = 10
+# A session that stops at or past this fraction of the video counts as completed
+COMPLETION_THRESHOLD = 0.9
+
+# Paired sessions, one array per field, aligned by position
+WatchSessions = namedtuple('WatchSessions', 'videoid start_position stop_position watched_ms elapsed_ms')
+
+# Per-video results aligned by position; the histograms are (videos, buckets) arrays
+WatchStats = namedtuple('WatchStats', 'videoid sessions completed completion_rate total_watch_ms mean_watch_ms '
+                                      'median_watch_ms duration_ms watch_time_histogram dropoff_histogram')
+
+
+class WatchReport:
+    def __init__(self):
+        self.rows = 0
+        self.sessions = 0
+        # A start with no stop after it (still watching, or the stop was lost) and the reverse
+        self.unmatched_starts = 0
+        self.unmatched_stops = 0
+        self.videos = 0
+        self.elapsed = 0.0
+
+    def merge(self, counts):
+        rows, sessions, starts, stops = counts
+        self.rows += rows
+        self.sessions += sessions
+        self.unmatched_starts += starts
+        self.unmatched_stops += stops
+
+    def summary(self):
+        return (f"Paired {self.sessions} watch sessions for {self.videos} videos from {self.rows} events in "
+                f"{self.elapsed:.2f}s; {self.unmatched_starts} unmatched starts, "
+                f"{self.unmatched_stops} unmatched stops")
+
+
+def _empty_sessions():
+    return WatchSessions(np.empty(0, dtype='S16'), *(np.empty(0, dtype=np.int64) for _ in range(4)))
+
+
+# Pair each start with the stop that directly follows it in the same (videoid, userid) partition.
+# Arguments are equal-length arrays; event times are timeuuid timestamps in 100 ns units.
+def pair_events(videoids, userids, times, events, positions):
+    order = np.lexsort((times, userids, videoids))
+    videoids, userids, times = videoids[order], userids[order], times[order]
+    is_start, is_stop = events[order] == 'start', events[order] == 'stop'
+    positions = positions[order]
+    same = (videoids[1:] == videoids[:-1]) & (userids[1:] == userids[:-1])
+    first = np.flatnonzero(same & is_start[:-1] & is_stop[1:])
+    sessions = WatchSessions(videoids[first], positions[first], positions[first + 1],
+                             np.maximum(positions[first + 1] - positions[first], 0),
+                             (times[first + 1] - times[first]) // 10_000)
+    unmatched = (int(is_start.sum()) - len(first), int(is_stop.sum()) - len(first))
+    return sessions, unmatched
+
+
+# Events of one token range as the arrays pair_events takes. A page that fails is retried from
+# where it left off (see scan.range_pages).
+def read_events(session, statement, token_range, fetch_size=1000):
+    videoids, userids, times, events, positions = [], [], [], [], []
+    for page in range_pages(session, statement, token_range, fetch_size):
+        for row in page.rows:
+            videoids.append(row.videoid.bytes)
+            userids.append(row.userid.bytes)
+            times.append(row.event_timestamp.time)
+            events.append(row.event)
+            positions.append(row.video_timestamp if row.video_timestamp is not None else 0)
+    return (np.array(videoids, dtype='S16'), np.array(userids, dtype='S16'), np.array(times, dtype=np.int64),
+            np.array(events, dtype=str), np.array(positions, dtype=np.int64))
+
+
+# Sessions in a set of events, with (rows, sessions, unmatched starts, unmatched stops)
+def paired_sessions(events):
+    if not len(events[3]):
+        return _empty_sessions(), (0, 0, 0, 0)
+    sessions, (starts, stops) = pair_events(*events)
+    return sessions, (len(events[3]), len(sessions.videoid), starts, stops)
+
+
+# Sessions in one token range. Only valid where each viewer's events sit in one partition.
+def read_range(session, statement, token_range, fetch_size=1000):
+    return paired_sessions(read_events(session, statement, token_range, fetch_size))
+
+
+# Per-process state for the process pool: each worker opens its own connection, since a driver
+# session cannot cross a fork
+_worker = {}
+
+
+def connect_cluster():
+    from app1 import create_cassandra_connection
+    session = create_cassandra_connection()
+    if session is None:
+        raise RuntimeError("Could not connect to Cassandra")
+    session.set_keyspace('killrvideo')
+    return session
+
+
+def _init_worker(connect, table):
+    session = connect()
+    _worker['session'] = session
+    _worker['statement'] = session.prepare(range_cql(table, EVENT_COLUMNS))
+
+
+def _read_range_in_worker(token_range, fetch_size, pair=True):
+    read = read_range if pair else read_events
+    return read(_worker['session'], _worker['statement'], token_range, fetch_size)
+
+
+# Group sessions by video and reduce them. Videos have no stored length, so a video's duration is
+# the furthest position any of its sessions reached.
+def aggregate(sessions):
+    videos, inverse = np.unique(sessions.videoid, return_inverse=True)
+    n = len(videos)
+    counts = np.bincount(inverse, minlength=n)
+    watched = sessions.watched_ms
+    total_watch = np.bincount(inverse, weights=watched, minlength=n).astype(np.int64)
+    duration = np.zeros(n, dtype=np.int64)
+    np.maximum.at(duration, inverse, sessions.stop_position)
+
+    fraction = np.zeros(len(inverse))
+    np.divide(sessions.stop_position, duration[inverse], out=fraction, where=duration[inverse] > 0)
+    completed = np.bincount(inverse, weights=fraction >= COMPLETION_THRESHOLD, minlength=n).astype(np.int64)
+    dropoff_bin = np.minimum((fraction * DROPOFF_BINS).astype(np.int64), DROPOFF_BINS - 1)
+    dropoff = np.bincount(inverse * DROPOFF_BINS + dropoff_bin, minlength=n * DROPOFF_BINS).reshape(n, DROPOFF_BINS)
+    buckets = len(WATCH_TIME_EDGES_MS) + 1
+    watch_bin = np.searchsorted(WATCH_TIME_EDGES_MS, watched, side='right')
+    watch_hist = np.bincount(inverse * buckets + watch_bin, minlength=n * buckets).reshape(n, buckets)
+
+    # Lower median per video: sort by (video, watch time) and take the middle of each group
+    order = np.lexsort((watched, inverse))
+    group_start = np.searchsorted(inverse[order], np.arange(n))
+    median = watched[order][group_start + (counts - 1) // 2] if n else np.empty(0, dtype=np.int64)
+
+    # 'S' arrays drop trailing zero bytes, so pad ids back to 16 bytes
+    videoids = np.array([uuid.UUID(bytes=bytes(v).ljust(16, b'\0')) for v in videos], dtype=object)
+    return WatchStats(videoids, counts, completed, completed / np.maximum(counts, 1), total_watch,
+                      total_watch / np.maximum(counts, 1), median, duration, watch_hist, dropoff)
+
+
+# The events table the app writes: video_event, or its bucketed table with a bucket granularity
+def events_table(bucket_granularity=None):
+    return BUCKETED_TABLES['video_event'].name if bucket_granularity else 'video_event'
+
+
+# Read every events range and aggregate per video. With `processes`, ranges are read by that
+# many worker processes, each connecting through `connect` (a picklable callable returning a
+# session; by default the cluster from app1). With processes=0 they are read on `concurrency`
+# threads over `session`, which is how the in-memory and embedded stores are analysed.
+# video_event keeps a viewer's events in one partition, so each range is paired on its own. The
+# bucketed table spreads them over one partition per bucket, and so over several ranges; its
+# events are gathered from every range and paired in one pass.
+def watch_stats(session=None, splits=64, processes=4, concurrency=8, connect=connect_cluster, fetch_size=1000,
+                table='video_event'):
+    report = WatchReport()
+    start = time.perf_counter()
+    ranges = ring_ranges(session, splits)
+    pair = table != BUCKETED_TABLES['video_event'].name
+    if processes:
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(connect, table)) as pool:
+            parts = list(pool.map(partial(_read_range_in_worker, fetch_size=fetch_size, pair=pair), ranges))
+    else:
+        statement = session.prepare(range_cql(table, EVENT_COLUMNS))
+        read = read_range if pair else read_events
+        with ThreadPoolExecutor(concurrency) as pool:
+            parts = list(pool.map(lambda token_range: read(session, statement, token_range, fetch_size), ranges))
+    if not pair:
+        parts = [paired_sessions([np.concatenate(column) for column in zip(*parts)])]
+    for _, counts in parts:
+        report.merge(counts)
+    sessions = WatchSessions(*(np.concatenate(column) for column in zip(*(part for part, _ in parts))))
+    stats = aggregate(sessions)
+    report.videos = len(stats.videoid)
+    report.elapsed = time.perf_counter() - start
+    return stats, report
+
+
+# video_watch_stats rows in the column order of loader.INSERT_COLUMNS
+def stats_rows(stats, computed_at=None):
+    computed_at = computed_at or datetime.now(timezone.utc).replace(tzinfo=None)
+    for i in range(len(stats.videoid)):
+        yield ('video_watch_stats', (stats.videoid[i], int(stats.sessions[i]), int(stats.completed[i]),
+                                     float(stats.completion_rate[i]), int(stats.total_watch_ms[i]),
+                                     float(stats.mean_watch_ms[i]), int(stats.median_watch_ms[i]),
+                                     int(stats.duration_ms[i]), stats.watch_time_histogram[i].tolist(),
+                                     stats.dropoff_histogram[i].tolist(), computed_at))
+
+
+def write_stats_table(session, stats, concurrency=64):
+    return AdaptiveLoader(session, concurrency).load(stats_rows(stats))
+
+
+# One row per video; histograms become fixed-size list columns
+def write_stats_file(stats, path):
+    columns = {
+        'videoid': pa.array([v.bytes for v in stats.videoid], type=pa.binary(16)),
+        'sessions': pa.array(stats.sessions, type=pa.int64()),
+        'completed': pa.array(stats.completed, type=pa.int64()),
+        'completion_rate': pa.array(stats.completion_rate),
+        'total_watch_ms': pa.array(stats.total_watch_ms),
+        'mean_watch_ms': pa.array(stats.mean_watch_ms),
+        'median_watch_ms': pa.array(stats.median_watch_ms, type=pa.int64()),
+        'duration_ms': pa.array(stats.duration_ms),
+    }
+    for name, histogram in (('watch_time_histogram', stats.watch_time_histogram),
+                            ('dropoff_histogram', stats.dropoff_histogram)):
+        columns[name] = pa.FixedSizeListArray.from_arrays(pa.array(histogram.ravel().astype(np.int64)),
+                                                          histogram.shape[1])
+    table = pa.table(columns)
+    table = table.replace_schema_metadata({'watch_time_edges_ms': ','.join(map(str, WATCH_TIME_EDGES_MS)),
+                                           'completion_threshold': str(COMPLETION_THRESHOLD)})
+    pq.write_table(table, path + '.partial', compression='zstd')
+    os.replace(path + '.partial', path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-video watch-time, completion and drop-off statistics")
+    parser.add_argument('--output', metavar='PATH', help="write a Parquet file instead of video_watch_stats")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--splits', type=int, default=256)
+    parser.add_argument('--embedded', metavar='DIR', help="analyse an embedded store (read on threads)")
+    args = parser.parse_args(argv)
+
+    from app1 import create_cassandra_connection
+    session = create_cassandra_connection(args.embedded)
+    if session is None:
+        return 1
+    session.set_keyspace('killrvideo')
+    try:
+        # The embedded store belongs to this process, so it is read on threads
+        processes = 0 if args.embedded or os.environ.get('KILLRVIDEO_EMBEDDED') else args.processes
+        from app1 import BUCKET_GRANULARITY
+        stats, report = watch_stats(session, args.splits, processes, table=events_table(BUCKET_GRANULARITY))
+        print(report.summary())
+        if args.output:
+            write_stats_file(stats, args.output)
+            print(f"Wrote {len(stats.videoid)} videos to {args.output}")
+        else:
+            print(write_stats_table(session, stats).summary())
+    finally:
+        session.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())